@@ -0,0 +1,202 @@
+"""Persistent cache of validated actions for previously solved screens.
+
+Recurring flows ask the model the same question on the same screen every
+day.  `ActionCache` remembers the action taken for (task text, perceptual
+hash of the screenshot, optional UI‑tree signature) and replays it without
+an LLM round trip.  Only actions that visibly changed the screen are
+stored, and a hit whose replay leaves the screen unchanged is evicted, so a
+stale entry costs at most one wasted step.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import PIL.Image as Image
+
+from ui_tree import UITree
+
+logger = logging.getLogger(__name__)
+
+# STATUS values that end a task; such actions cannot be verified, so they
+# are never cached
+_TERMINAL_STATUS = {"finish", "satisfied", "impossible", "interrupt", "need_feedback"}
+
+
+def screen_hash(img: Image.Image, hash_size: int = 16) -> int:
+    """Perceptual hash of a screen, 2·`hash_size`² bits.
+
+    A difference hash (horizontal gradients) followed by a brightness hash
+    (pixels above mid‑grey); gradients alone cannot tell flat light and
+    dark screens apart.  Cheap enough on the 36×64 settle signature
+    (`adb_utils._frame_signature`), which is what `run_steps` passes in.
+    """
+    small = img.resize((hash_size + 1, hash_size), Image.Resampling.BOX).convert("L")
+    px = small.tobytes()
+    gradient = brightness = 0
+    row = hash_size + 1
+    for y in range(hash_size):
+        base = y * row
+        for x in range(hash_size):
+            gradient = (gradient << 1) | (px[base + x] > px[base + x + 1])
+            brightness = (brightness << 1) | (px[base + x] > 127)
+    return (gradient << (hash_size * hash_size)) | brightness
+
+
+def ui_signature(tree: UITree) -> str:
+    """Short digest of the interactive skeleton (classes + resource ids)."""
+    h = hashlib.blake2b(digest_size=8)
+    for node in tree.nodes:
+        if node.interactive:
+            h.update(f"{node.cls}#{node.resource_id};".encode())
+    return h.hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ("task", "ui", "phash", "action", "confirmations", "last_used")
+
+    def __init__(self, task: str, ui: str, phash: int, action: Dict[str, Any],
+                 confirmations: int = 1, last_used: float = 0.0):
+        self.task = task
+        self.ui = ui
+        self.phash = phash
+        self.action = action
+        self.confirmations = confirmations
+        self.last_used = last_used or time.time()
+
+    @property
+    def key(self) -> Tuple[str, str, int]:
+        return self.task, self.ui, self.phash
+
+
+class ActionCache:
+    """LRU action cache, optionally persisted to a JSON file.
+
+    Args:
+      path: JSON file to load from / save to (None keeps it in memory).
+      capacity: maximum number of entries; least recently used go first.
+      max_distance: Hamming distance (out of 512 bits) still counted as the
+        same screen.
+      min_confirmations: times an action must have changed the screen before
+        it is replayed.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 5000,
+                 max_distance: int = 16, min_confirmations: int = 1):
+        self.path = path
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.min_confirmations = min_confirmations
+        self._entries: "collections.OrderedDict[Tuple[str, str, int], CacheEntry]" = \
+            collections.OrderedDict()
+        self._buckets: Dict[Tuple[str, str], List[CacheEntry]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ---------- lookup / update ----------
+    def key(self, task: str, frame: Image.Image, tree: Optional[UITree] = None
+            ) -> Tuple[str, str, int]:
+        return task, ui_signature(tree) if tree is not None else "", screen_hash(frame)
+
+    def lookup(self, key: Tuple[str, str, int]) -> Optional[CacheEntry]:
+        """Closest eligible entry for `key`, or None."""
+        task, ui, phash = key
+        with self._lock:
+            best, best_dist = None, self.max_distance + 1
+            for entry in self._buckets.get((task, ui), ()):
+                dist = (entry.phash ^ phash).bit_count()
+                if dist < best_dist and entry.confirmations >= self.min_confirmations:
+                    best, best_dist = entry, dist
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            best.last_used = time.time()
+            self._entries.move_to_end(best.key)
+            return best
+
+    def record(self, key: Tuple[str, str, int], action: Any, changed: bool,
+               hit: Optional[CacheEntry] = None) -> None:
+        """Feed back the outcome of executing `action` on the screen `key`.
+
+        A replayed entry is confirmed when the screen changed and evicted
+        when it did not; a fresh model action is stored only if it changed
+        the screen.
+        """
+        if not isinstance(action, dict) or action.get("STATUS") in _TERMINAL_STATUS:
+            return
+        with self._lock:
+            if hit is not None:
+                if changed:
+                    hit.confirmations += 1
+                else:
+                    logger.info("Cached action had no effect; evicting it")
+                    self._remove(hit)
+                return
+            if not changed:
+                return
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.action, entry.confirmations = action, entry.confirmations + 1
+                self._entries.move_to_end(key)
+                return
+            entry = CacheEntry(key[0], key[1], key[2], action)
+            self._entries[key] = entry
+            self._buckets.setdefault((key[0], key[1]), []).append(entry)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries.values())))
+
+    def _remove(self, entry: CacheEntry) -> None:
+        self._entries.pop(entry.key, None)
+        bucket = self._buckets.get((entry.task, entry.ui))
+        if bucket is not None:
+            bucket.remove(entry)
+            if not bucket:
+                del self._buckets[(entry.task, entry.ui)]
+
+    # ---------- persistence ----------
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            data = {"version": 1, "entries": [
+                {"task": e.task, "ui": e.ui, "phash": format(e.phash, "x"),
+                 "action": e.action, "confirmations": e.confirmations,
+                 "last_used": e.last_used}
+                for e in self._entries.values()
+            ]}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def load(self, path: Optional[str] = None) -> None:
+        """Add the entries saved in `path`; an unreadable file is ignored
+        (the cache only costs model calls to rebuild)."""
+        path = path or self.path
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            rows = sorted(data.get("entries", []), key=lambda r: r.get("last_used", 0))
+            entries = [CacheEntry(r["task"], r["ui"], int(r["phash"], 16), r["action"],
+                                  r.get("confirmations", 1), r.get("last_used", 0.0))
+                       for r in rows[-self.capacity:]]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("Ignoring unreadable action cache %s: %s", path, e)
+            return
+        with self._lock:
+            for entry in entries:
+                self._entries[entry.key] = entry
+                self._buckets.setdefault((entry.task, entry.ui), []).append(entry)
+        logger.info("Loaded %d cached actions from %s", len(entries), path)
@@ -0,0 +1,409 @@
+"""Fast extraction and validation of model actions.
+
+`compile_schema` turns a JSON Schema (the Draft 7 subset used by
+`schema_for_extraction.json`) into nested Python closures once, at import
+time, so checking an action is a handful of function calls instead of a
+`jsonschema` walk that re‑resolves the schema on every response.  Unknown
+keywords fail at compile time rather than being silently ignored.
+
+`parse_action` also tolerates JSON wrapped in prose or code fences and
+raises `ActionValidationError`, which carries the raw text and a short
+reason suitable for re‑asking the model.  `ActionStreamParser` does the same
+incrementally on a streamed answer and reports the action as soon as it is
+known to be complete.
+"""
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional
+
+# check(value, path) -> None when valid, else a short error message
+Check = Callable[[Any, str], Optional[str]]
+
+# annotation keywords that carry no constraint
+_ANNOTATIONS = {"description", "default", "title", "examples", "$defs", "definitions",
+                "$schema", "$id", "$comment"}
+
+_DECODER = json.JSONDecoder()
+
+
+class ActionValidationError(ValueError):
+    """The model's answer is not a valid action.
+
+    `raw` is the text the model produced, `reason` what is wrong with it.
+    """
+
+    def __init__(self, reason: str, raw: str = ""):
+        super().__init__(reason)
+        self.reason = reason
+        self.raw = raw
+
+
+# ---------------------------------------------------------------------------
+# Schema compiler
+# ---------------------------------------------------------------------------
+
+def _is_integer(v: Any) -> bool:
+    if isinstance(v, bool):
+        return False
+    return isinstance(v, int) or (isinstance(v, float) and math.isfinite(v) and v.is_integer())
+
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": _is_integer,
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+class _Compiler:
+    def __init__(self, root: Dict[str, Any]):
+        self.root = root
+        self.refs: Dict[str, Check] = {}
+
+    def ref(self, ref: str) -> Check:
+        if ref not in self.refs:
+            if not ref.startswith("#/"):
+                raise ValueError(f"Only local $ref is supported: {ref}")
+            target: Any = self.root
+            for part in ref[2:].split("/"):
+                target = target[part]
+            # placeholder first, so recursive references resolve
+            slot: List[Check] = []
+            self.refs[ref] = lambda v, p: slot[0](v, p)
+            slot.append(self.compile(target))
+        return self.refs[ref]
+
+    def compile(self, schema: Any) -> Check:
+        if schema is True or schema == {}:
+            return lambda v, p: None
+        if schema is False:
+            return lambda v, p: f"{p}: not allowed"
+        checks: List[Check] = []
+        for key in schema:
+            if key in _ANNOTATIONS:
+                continue
+            handler = getattr(self, "_kw_" + key.lstrip("$"), None)
+            if handler is None:
+                raise ValueError(f"Unsupported schema keyword: {key}")
+            check = handler(schema[key], schema)
+            if check is not None:
+                checks.append(check)
+        if not checks:
+            return lambda v, p: None
+        if len(checks) == 1:
+            return checks[0]
+
+        def all_checks(v, p):
+            for c in checks:
+                err = c(v, p)
+                if err:
+                    return err
+            return None
+        return all_checks
+
+    # --- keywords -------------------------------------------------------
+    def _kw_ref(self, ref, _):
+        return self.ref(ref)
+
+    def _kw_type(self, types, _):
+        names = [types] if isinstance(types, str) else list(types)
+        tests = [_TYPE_CHECKS[t] for t in names]
+        label = "/".join(names)
+
+        def check(v, p):
+            for t in tests:
+                if t(v):
+                    return None
+            return f"{p}: expected {label}"
+        return check
+
+    def _kw_enum(self, values, _):
+        try:
+            allowed = frozenset(values)
+        except TypeError:
+            allowed = list(values)
+
+        def check(v, p):
+            try:
+                if v in allowed:
+                    return None
+            except TypeError:
+                pass
+            return f"{p}: {v!r} is not one of {sorted(map(str, values))}"
+        return check
+
+    def _kw_properties(self, props, _):
+        compiled = {name: self.compile(sub) for name, sub in props.items()}
+
+        def check(v, p):
+            if not isinstance(v, dict):
+                return None
+            for name, value in v.items():
+                c = compiled.get(name)
+                if c is not None:
+                    err = c(value, f"{p}.{name}")
+                    if err:
+                        return err
+            return None
+        return check
+
+    def _kw_additionalProperties(self, extra, schema):
+        known = frozenset(schema.get("properties", ()))
+        if extra is False:
+            def check(v, p):
+                if isinstance(v, dict):
+                    for name in v:
+                        if name not in known:
+                            return f"{p}: unexpected property {name!r}"
+                return None
+            return check
+        sub = self.compile(extra)
+
+        def check_extra(v, p):
+            if isinstance(v, dict):
+                for name, value in v.items():
+                    if name not in known:
+                        err = sub(value, f"{p}.{name}")
+                        if err:
+                            return err
+            return None
+        return check_extra
+
+    def _kw_required(self, names, _):
+        names = tuple(names)
+
+        def check(v, p):
+            if isinstance(v, dict):
+                for name in names:
+                    if name not in v:
+                        return f"{p}: missing {name!r}"
+            return None
+        return check
+
+    def _kw_items(self, items, _):
+        sub = self.compile(items)
+
+        def check(v, p):
+            if isinstance(v, list):
+                for i, item in enumerate(v):
+                    err = sub(item, f"{p}[{i}]")
+                    if err:
+                        return err
+            return None
+        return check
+
+    def _kw_minItems(self, n, _):
+        return lambda v, p: (f"{p}: expected at least {n} items"
+                             if isinstance(v, list) and len(v) < n else None)
+
+    def _kw_maxItems(self, n, _):
+        return lambda v, p: (f"{p}: expected at most {n} items"
+                             if isinstance(v, list) and len(v) > n else None)
+
+    def _kw_minimum(self, n, _):
+        return lambda v, p: (f"{p}: {v} is below {n}" if _TYPE_CHECKS["number"](v) and v < n
+                             else None)
+
+    def _kw_maximum(self, n, _):
+        return lambda v, p: (f"{p}: {v} is above {n}" if _TYPE_CHECKS["number"](v) and v > n
+                             else None)
+
+    def _kw_allOf(self, subs, _):
+        compiled = [self.compile(s) for s in subs]
+
+        def check(v, p):
+            for c in compiled:
+                err = c(v, p)
+                if err:
+                    return err
+            return None
+        return check
+
+    def _kw_anyOf(self, subs, _):
+        compiled = [self.compile(s) for s in subs]
+
+        def check(v, p):
+            errors = []
+            for c in compiled:
+                err = c(v, p)
+                if not err:
+                    return None
+                errors.append(err)
+            return f"{p}: matches none of {len(compiled)} alternatives ({errors[0]})"
+        return check
+
+    def _kw_oneOf(self, subs, _):
+        compiled = [self.compile(s) for s in subs]
+
+        def check(v, p):
+            matched = sum(1 for c in compiled if not c(v, p))
+            if matched == 1:
+                return None
+            return (f"{p}: matches none of the allowed forms" if not matched
+                    else f"{p}: matches {matched} mutually exclusive forms")
+        return check
+
+    def _kw_not(self, sub, _):
+        compiled = self.compile(sub)
+        return lambda v, p: None if compiled(v, p) else f"{p}: matches a forbidden form"
+
+    def _kw_if(self, cond, schema):
+        test = self.compile(cond)
+        then = self.compile(schema["then"]) if "then" in schema else None
+        other = self.compile(schema["else"]) if "else" in schema else None
+
+        def check(v, p):
+            branch = then if not test(v, p) else other
+            return branch(v, p) if branch is not None else None
+        return check
+
+    def _kw_then(self, *_):
+        return None  # handled by `if`
+
+    _kw_else = _kw_then
+
+
+def compile_schema(schema: Dict[str, Any]) -> Check:
+    """Compile `schema` into `check(value, path="$") -> error message | None`."""
+    check = _Compiler(schema).compile(schema)
+    return lambda value, path="$": check(value, path)
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+def extract_json(text: str) -> Any:
+    """Parse `text` as JSON, or else the first JSON object embedded in it
+    (prose, ```json fences, trailing remarks)."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = _DECODER.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    raise ActionValidationError("no JSON object in the answer", text)
+
+
+def parse_action(text: str, check: Check) -> Dict[str, Any]:
+    """Extract the action from `text` and validate it with `check`."""
+    obj = extract_json(text)
+    err = check(obj)
+    if err:
+        raise ActionValidationError(err, text)
+    return obj
+
+
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+
+ACTION_KEYS = frozenset({"POINT", "to", "duration", "PRESS", "TYPE", "STATUS", "CLEAR",
+                         "DEEP_LINK"})
+
+
+class ActionStreamParser:
+    """Incremental parser for an answer arriving in pieces.
+
+    `feed(delta)` returns the action once, when the top‑level object closes
+    (ahead of any stream tail such as a closing code fence).  Action keys may
+    arrive in any order (`duration` or `to` can follow `POINT`), so a partial
+    object is not an action.
+
+    With `action_first=True` – only for a model constrained to emit every
+    action key before `thought` (e.g. guided decoding with that key order) –
+    the action is reported as soon as a non‑action key starts after an action
+    key, before the thought is streamed.
+
+    Only actions that pass `check` are reported; anything else is left to
+    `parse_action` on the full text (`self.text`) once the stream ends.
+    """
+
+    def __init__(self, check: Check, action_first: bool = False):
+        self.check = check
+        self.action_first = action_first
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.action: Optional[Dict[str, Any]] = None
+        self.closed = False
+        self._pos = 0
+        self._depth = 0
+        self._start = -1        # index of the top-level "{"
+        self._in_str = False
+        self._escaped = False
+        self._key_start = -1    # index of the opening quote of a top-level key
+        self._key: Optional[str] = None
+        self._value_start = -1  # index just after the ":" of the current member
+
+    def feed(self, delta: str) -> Optional[Dict[str, Any]]:
+        self.text += delta
+        if self.action is not None or self.closed:
+            return None
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_str:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._key_start >= 0:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = -1
+                        if self._ready(self._key):
+                            self._pos = i + 1
+                            return self._emit(dict(self.fields))
+            elif self._start < 0:
+                if ch == "{":  # skip prose / code fences before the object
+                    self._start, self._depth = i, 1
+            elif ch == '"':
+                self._in_str = True
+                if self._depth == 1 and self._value_start < 0:
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch == ":" and self._depth == 1:
+                self._value_start = i + 1
+            elif ch == "," and self._depth == 1:
+                self._end_member(i)
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end_member(i)
+                    self.closed = True
+                    self._pos = i + 1
+                    return self._emit(self.fields)
+        self._pos = len(text)
+        return None
+
+    def _ready(self, key: str) -> bool:
+        return (self.action_first and key not in ACTION_KEYS
+                and any(k in ACTION_KEYS for k in self.fields))
+
+    def _end_member(self, end: int) -> None:
+        if self._key is not None and self._value_start >= 0:
+            try:
+                self.fields[self._key] = json.loads(self.text[self._value_start:end])
+            except json.JSONDecodeError:
+                pass
+        self._key = None
+        self._value_start = -1
+
+    def _emit(self, action: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not action or self.check(action):
+            return None
+        self.action = action
+        return action
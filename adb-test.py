@@ -1,4 +1,4 @@
-from ppadb.client import Client
+from adb_client import AdbClient
 import time
 import json
 from typing import Dict, Any, Optional, Tuple
@@ -6,7 +6,7 @@ from typing import Dict, Any, Optional, Tuple
 class AndroidDevice:
     def __init__(self, host='127.0.0.1', port=5037):
         """初始化 ADB 连接"""
-        self.adb = Client(host=host, port=port)
+        self.adb = AdbClient(host=host, port=port)
         self.device = None
         self.connect()
 
@@ -195,6 +195,17 @@ class AndroidDevice:
                 "message": f"按键发送失败: {str(e)}"
             }
 
+    def press_keys(self, keycodes: list, repeat: int = 1) -> None:
+        """
+        一次 `input keyevent` 调用发送多个按键（只启动一次 input 进程）
+
+        Args:
+            keycodes (list): 按键列表（KEYCODE_* 名称或数字代码）
+            repeat (int): 整个列表重复的次数
+        """
+        codes = " ".join(str(k) for k in keycodes)
+        self.device.shell(" ".join(["input keyevent"] + [codes] * repeat))
+
     def back(self) -> Dict[str, Any]:
         """
         MCP工具: 模拟返回键
@@ -318,21 +329,10 @@ class AndroidDevice:
             
             # 方法1: 使用多次退格删除（最可靠的方式）
             try:
-                # 先移动到文本末尾（确保删除所有内容）
-                for _ in range(5):  # 多次按下end键确保到达末尾
-                    self.device.shell("input keyevent KEYCODE_MOVE_END")
-                    time.sleep(0.02)
-                
-                # 执行删除操作
-                delete_count = 0
-                for i in range(200):  # 增加删除次数
-                    self.device.shell("input keyevent KEYCODE_DEL")
-                    delete_count += 1
-                    # 控制删除速度，避免过快导致系统响应不及时
-                    if i % 15 == 0:
-                        time.sleep(0.1)
-                    else:
-                        time.sleep(0.02)
+                # 先移动到文本末尾（确保删除所有内容），再一次性发送全部删除键
+                delete_count = 200
+                self.press_keys(["KEYCODE_MOVE_END"])
+                self.press_keys(["KEYCODE_DEL"], repeat=delete_count)
                 
                 # 删除完成后，再次点击确保焦点仍在输入框
                 time.sleep(0.3)
@@ -378,10 +378,7 @@ class AndroidDevice:
                     # 方法3: 最简单方案 - 直接删除
                     try:
                         # 简单的多次删除，删除完后重新点击
-                        for i in range(100):
-                            self.device.shell("input keyevent KEYCODE_DEL")
-                            if i % 20 == 0:
-                                time.sleep(0.1)
+                        self.press_keys(["KEYCODE_DEL"], repeat=100)
                         
                         # 重新获取焦点
                         time.sleep(0.5)
@@ -496,10 +493,7 @@ class AndroidDevice:
                 time.sleep(0.5)
                 
                 # 简单的清空方式：多次删除
-                for i in range(100):
-                    self.press_key(67)  # KEYCODE_DEL
-                    if i % 20 == 0:
-                        time.sleep(0.05)
+                self.press_keys([67], repeat=100)  # KEYCODE_DEL
                 
                 time.sleep(0.3)
                 
@@ -611,12 +605,7 @@ class AndroidDevice:
             time.sleep(0.5)
             
             # 执行一定数量的删除操作
-            for i in range(80):
-                self.device.shell("input keyevent KEYCODE_DEL")
-                if i % 20 == 0:
-                    time.sleep(0.1)
-                else:
-                    time.sleep(0.02)
+            self.press_keys(["KEYCODE_DEL"], repeat=80)
             
             time.sleep(0.3)
             
@@ -0,0 +1,306 @@
+"""asyncio counterpart of `adb_utils.AndroidDevice`.
+
+One event loop can drive many phones (and their model calls) without a
+thread per device:
+
+    devices = [await asetup_device(s) for s in await alist_devices()]
+    await asyncio.gather(*(run(d) for d in devices))
+
+Action compilation, command framing, frame decoding and the settle
+signatures are shared with the blocking class (`adb_utils._DeviceBase` and
+module helpers); only the I/O differs.
+Shell commands go through one persistent `adb shell` per device
+(`AsyncAdbShellSession`), other adb calls through asyncio subprocesses.
+CPU‑heavy work (resizing) runs in the default executor so it does not
+stall the loop.
+"""
+import asyncio
+import io
+import logging
+import os
+import subprocess
+import time
+import uuid
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+import PIL.Image as Image
+
+from adb_utils import (AdbSessionError, _DeviceBase, _adb_prefix, _decode_raw_screencap,
+                       _frame_shell_command, _frame_signature, _resize_pillow,
+                       _signature_distance, _split_framed_output)
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+async def _arun(cmd: List[str], timeout: float = 30) -> bytes:
+    """asyncio `subprocess.check_output` (stderr merged into stdout)."""
+    logger.debug("$ %s", " ".join(cmd))
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout) from None
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out)
+    return out
+
+
+class AsyncAdbShellSession:
+    """Persistent `adb shell` driven from the event loop; see `AdbShellSession`."""
+
+    RESTART_BACKOFF_SECONDS = 5.0
+
+    def __init__(self, serial: str | None):
+        self.serial = serial
+        self._proc: asyncio.subprocess.Process | None = None
+        self._buf = b""
+        self._lock = asyncio.Lock()
+        self._marker = f"__ADB_AGENT_{uuid.uuid4().hex}__".encode()
+        self._retry_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def _start(self) -> None:
+        if time.monotonic() < self._retry_at:
+            raise AdbSessionError("adb shell session is backing off", delivered=False)
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                *_adb_prefix(self.serial), "shell",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        except OSError as exc:
+            self._retry_at = time.monotonic() + self.RESTART_BACKOFF_SECONDS
+            raise AdbSessionError(f"cannot start adb shell: {exc}", delivered=False) from exc
+        self._buf = b""
+        logger.debug("async adb shell session started for %s", self.serial or "<default>")
+
+    async def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None or proc.returncode is not None:
+            return
+        try:
+            proc.stdin.close()
+            await asyncio.wait_for(proc.wait(), 1)
+        except (OSError, asyncio.TimeoutError):
+            proc.kill()
+            await proc.wait()
+
+    async def run(self, command: str, timeout: float = 30) -> bytes:
+        """Run `command` in the shared shell; raises like `AdbShellSession.run`."""
+        async with self._lock:
+            if not self.alive:
+                await self._start()
+            try:
+                self._proc.stdin.write(_frame_shell_command(command, self._marker))
+                await self._proc.stdin.drain()
+            except (OSError, ConnectionError) as exc:
+                await self.close()
+                raise AdbSessionError(f"adb shell pipe broken: {exc}", delivered=False) from exc
+
+            deadline = time.monotonic() + timeout
+            while True:
+                framed = _split_framed_output(self._buf, self._marker)
+                if framed is not None:
+                    out, code, self._buf = framed
+                    if code != 0:
+                        raise subprocess.CalledProcessError(code, command, output=out)
+                    return out
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await self.close()
+                    raise subprocess.TimeoutExpired(command, timeout, output=self._buf)
+                try:
+                    chunk = await asyncio.wait_for(self._proc.stdout.read(65536), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                if not chunk:
+                    await self.close()
+                    raise AdbSessionError("adb shell session closed mid-command", delivered=True)
+                self._buf += chunk
+
+
+class AsyncAndroidDevice(_DeviceBase):
+    """`AndroidDevice` with coroutine methods, for many devices on one loop."""
+
+    # event loop → serial → lock: an asyncio.Lock is bound to the loop that
+    # first waits on it, so each `asyncio.run` gets its own set
+    _yadb_async_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def __init__(self, serial: str | None, use_shell_session: bool = True,
+                 capture_mode: str = "raw", text_backend: str = "auto"):
+        super().__init__(serial, capture_mode, text_backend)
+        self._session: AsyncAdbShellSession | None = (
+            AsyncAdbShellSession(serial) if use_shell_session else None
+        )
+
+    # ---------- internal ----------
+    async def _adb(self, *args: str, timeout: float = 30) -> bytes:
+        with span("adb", serial=self.serial, cmd=" ".join(args[:3])):
+            if self._session is not None and len(args) > 1 and args[0] == "shell":
+                try:
+                    return await self._session.run(" ".join(args[1:]), timeout)
+                except AdbSessionError as exc:
+                    if exc.delivered:
+                        raise
+                    logger.warning("adb shell session unavailable (%s); falling back to subprocess", exc)
+            return await _arun(_adb_prefix(self.serial) + list(args), timeout)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def _grab_frame(self) -> Image.Image:
+        if self.capture_mode == "raw":
+            buf = await self._adb("exec-out", "screencap")
+            try:
+                return _decode_raw_screencap(buf)
+            except ValueError as exc:
+                logger.warning("Raw screencap unusable (%s); switching to PNG capture", exc)
+                self.capture_mode = "png"
+        png_bytes = await self._adb("exec-out", "screencap", "-p")
+        return Image.open(io.BytesIO(png_bytes))
+
+    async def _ensure_yadb(self) -> None:
+        if not os.path.exists(self._yadb_local):
+            raise FileNotFoundError(f"yadb helper not found: {self._yadb_local}")
+        local = self._local_md5(self._yadb_local)
+        key = self._yadb_key()
+        locks = self._yadb_async_locks.setdefault(asyncio.get_running_loop(), {})
+        lock = locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if _DeviceBase._yadb_pushed.get(key) == local:
+                return
+            try:
+                remote = (await self._adb("shell", f"md5sum {self._yadb_remote} 2>/dev/null")).split()[:1]
+            except subprocess.CalledProcessError:
+                remote = []
+            if remote != [local.encode()]:
+                await self._adb("push", self._yadb_local, "/data/local/tmp")
+                logger.info("yadb pushed to %s for Unicode input support", key)
+            with _DeviceBase._yadb_lock:
+                _DeviceBase._yadb_pushed[key] = local
+
+    async def _resolve_text_backend(self) -> str:
+        if self.text_backend == "auto":
+            current = (await self._adb("shell", "settings get secure default_input_method")).strip()
+            self._ime_ready = current.decode(errors="replace") == self._ADB_KEYBOARD_IME
+            self.text_backend = "adbkeyboard" if self._ime_ready else "yadb"
+            logger.info("Text input backend for %s: %s", self.serial or "<default>",
+                        self.text_backend)
+        elif self.text_backend == "adbkeyboard" and not self._ime_ready:
+            await self._adb("shell", f"ime enable {self._ADB_KEYBOARD_IME} >/dev/null; "
+                                     f"ime set {self._ADB_KEYBOARD_IME} >/dev/null")
+            self._ime_ready = True
+        return self.text_backend
+
+    async def _prepare_text_input(self, actions: List[Dict[str, Any]]) -> None:
+        if any(self._needs_text_backend(a) for a in actions):
+            if await self._resolve_text_backend() == "yadb":
+                await self._ensure_yadb()
+
+    # ---------- public API ----------
+    async def refresh_resolution(self) -> None:
+        """Query and cache `wm size` (sets .width / .height)."""
+        self._parse_wm_size((await self._adb("shell", "wm", "size")).decode())
+
+    async def step(self, data: Dict[str, Any]) -> bool:
+        """Execute one action; returns True when it ends the task."""
+        logger.debug("Step: %s", data)
+        await self._prepare_text_input([data])
+        cmds = self._compile_action(data)
+        if len(cmds) == 1:
+            await self._adb("shell", cmds[0])
+        elif cmds:
+            await self._adb("shell", self._script([cmds]))
+        self._mark_action()
+        return self._is_finish(data)
+
+    async def run_batch(self, actions: List[Dict[str, Any]]) -> List[float]:
+        """See `AndroidDevice.run_batch`."""
+        await self._prepare_text_input(actions)
+        out = await self._adb("shell", self._script([self._compile_action(a) for a in actions]))
+        self._mark_action()
+        return self._script_timings(out)
+
+    async def screenshot(self, max_side: Optional[int] = None) -> Image.Image:
+        with span("screenshot", serial=self.serial):
+            img = await self._grab_frame()
+        if max_side is not None:
+            img = await asyncio.to_thread(_resize_pillow, img, max_side)
+        return img
+
+    async def state(self) -> Dict[str, Any]:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "last_req_time": self.last_req_time.isoformat(),
+            "screenshot": await self.screenshot(),
+        }
+
+    async def wait_for_settle(
+        self,
+        max_side: Optional[int] = None,
+        timeout: float = 5.0,
+        interval: float = 0.1,
+        threshold: float = 1.5,
+        stable_frames: int = 2,
+        min_wait: float = 0.2,
+        on_frame: Optional[Callable[[Image.Image], None]] = None,
+    ) -> Image.Image:
+        """See `AndroidDevice.wait_for_settle`."""
+        start = time.monotonic()
+        with span("settle", serial=self.serial):
+            if min_wait:
+                await asyncio.sleep(min_wait)
+            prev_sig: Image.Image | None = None
+            matches = 0
+            while True:
+                captured_at = time.monotonic()
+                frame = await self._grab_frame()
+                if on_frame is not None:
+                    on_frame(frame)
+                sig = _frame_signature(frame)
+                if prev_sig is not None and _signature_distance(prev_sig, sig) <= threshold:
+                    matches += 1
+                else:
+                    matches = 0
+                prev_sig = sig
+                if matches >= stable_frames - 1:
+                    break
+                if time.monotonic() - start >= timeout:
+                    logger.debug("Screen did not settle within %.1fs", timeout)
+                    break
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - captured_at)))
+        self.last_settle_seconds = time.monotonic() - start
+        if max_side is not None:
+            frame = await asyncio.to_thread(_resize_pillow, frame, max_side)
+        return frame
+
+
+async def alist_devices() -> List[str]:
+    """Serials of all connected & authorised devices (state `device`)."""
+    out = await _arun(_adb_prefix(None) + ["devices"])
+    lines = out.decode().strip().splitlines()[1:]
+    return [parts[0] for parts in (l.split() for l in lines)
+            if len(parts) >= 2 and parts[1] == "device"]
+
+
+async def asetup_device(serial: str | None = None, **kwargs) -> AsyncAndroidDevice:
+    """Async `setup_device`: first authorised phone unless `serial` is given."""
+    if serial is None:
+        serials = await alist_devices()
+        if not serials:
+            raise RuntimeError("No authorised Android device found. Plug in & check adb.")
+        serial = serials[0]
+    dev = AsyncAndroidDevice(serial, **kwargs)
+    await dev.refresh_resolution()
+    return dev
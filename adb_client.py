@@ -0,0 +1,406 @@
+"""In‑process client for the adb server's smart‑socket protocol.
+
+Talks to the adb server (127.0.0.1:5037, or `ANDROID_ADB_SERVER_ADDRESS` /
+`ANDROID_ADB_SERVER_PORT`) directly instead of spawning the `adb` client for
+every call:
+
+    client = AdbClient()
+    client.serials()                                  # host:devices
+    client.shell(serial, "wm size")                   # pooled shell, exit status kept
+    client.exec_out(serial, "screencap")              # exec:, raw bytes until EOF
+    client.push(serial, "yadb", "/data/local/tmp/yadb")   # sync: SEND
+
+Every request is a 4‑hex‑digit length followed by the payload; the server
+answers `OKAY`, or `FAIL` plus a length‑prefixed message.  After
+`host:transport:<serial>` the connection is bound to that device and the next
+request opens a service on it, which then owns the socket until it closes.
+One‑shot services (`exec:`, `shell:`, `sync:`) therefore use a fresh
+connection each, while shell commands share a small pool of long‑lived
+`exec:sh` streams per serial, framed with a sentinel line like
+`adb_utils.AdbShellSession`.
+
+`AdbDevice` wraps a serial with the `ppadb` device calls `adb-test.py` uses.
+"""
+import logging
+import os
+import select
+import shlex
+import socket
+import stat
+import struct
+import subprocess
+import threading
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = os.environ.get("ANDROID_ADB_SERVER_ADDRESS", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+
+SYNC_DATA_MAX = 64 * 1024
+
+
+class AdbSessionError(RuntimeError):
+    """The persistent shell channel failed.
+
+    `delivered` tells whether the command may already have reached the device;
+    only undelivered commands are safe to replay over another transport.
+    """
+
+    def __init__(self, message: str, delivered: bool):
+        super().__init__(message)
+        self.delivered = delivered
+
+
+class AdbServerError(AdbSessionError):
+    """The adb server refused a request (`FAIL`), e.g. an unknown serial."""
+
+    def __init__(self, message: str):
+        super().__init__(message, delivered=False)
+
+
+def _frame_shell_command(command: str, marker: bytes) -> bytes:
+    """Wrap `command` so the shell prints `marker` and its exit status after it.
+
+    The command runs in a child `sh -c` with its text quoted, so a malformed
+    command (e.g. an unbalanced quote) fails in the child with a non‑zero
+    status instead of swallowing the sentinel and wedging the session.
+    """
+    return (b"sh -c " + shlex.quote(command).encode() + b" </dev/null 2>&1\n"
+            b"printf '\\n%s %d\\n' " + marker + b" $?\n")
+
+
+def _split_framed_output(buf: bytes, marker: bytes) -> tuple[bytes, int, bytes] | None:
+    """(output, exit status, rest of buffer) once the sentinel is complete."""
+    end = b"\n" + marker + b" "
+    idx = buf.find(end)
+    if idx < 0:
+        return None
+    nl = buf.find(b"\n", idx + len(end))
+    if nl < 0:
+        return None
+    return buf[:idx], int(buf[idx + len(end):nl]), buf[nl + 1:]
+
+
+# ---------------------------------------------------------------------------
+# Wire helpers
+# ---------------------------------------------------------------------------
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise AdbSessionError("adb server closed the connection", delivered=True)
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_all(sock: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = sock.recv(1 << 20)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _send_request(sock: socket.socket, payload: str) -> None:
+    """Send one smart‑socket request and wait for OKAY."""
+    data = payload.encode()
+    try:
+        sock.sendall(b"%04x" % len(data) + data)
+        status = _recv_exact(sock, 4)
+    except (OSError, AdbSessionError) as exc:
+        # nothing runs on the device before the server has said OKAY
+        raise AdbSessionError(f"adb server request {payload!r} failed: {exc}",
+                              delivered=False) from exc
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        n = int(_recv_exact(sock, 4), 16)
+        raise AdbServerError(_recv_exact(sock, n).decode(errors="replace"))
+    raise AdbServerError(f"unexpected adb server reply {status!r} to {payload!r}")
+
+
+class _SocketShell:
+    """One `exec:sh` stream; commands are framed by a sentinel line."""
+
+    def __init__(self, sock: socket.socket, serial: str | None):
+        self.serial = serial
+        self._sock: socket.socket | None = sock
+        self._buf = b""
+        self._marker = f"__ADB_AGENT_{uuid.uuid4().hex}__".encode()
+
+    @property
+    def alive(self) -> bool:
+        """False once closed, or when the peer hung up while it sat idle."""
+        if self._sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if readable and not self._sock.recv(1, socket.MSG_PEEK):
+                self.close()
+        except OSError:
+            self.close()
+        return self._sock is not None
+
+    def close(self) -> None:
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+    def run(self, command: str, timeout: float = 30) -> bytes:
+        """Run `command`; raises like `adb_utils.AdbShellSession.run`."""
+        try:
+            self._sock.settimeout(timeout)
+            self._sock.sendall(_frame_shell_command(command, self._marker))
+        except OSError as exc:
+            self.close()
+            raise AdbSessionError(f"adb shell socket broken: {exc}", delivered=False) from exc
+        while True:
+            framed = _split_framed_output(self._buf, self._marker)
+            if framed is not None:
+                out, code, self._buf = framed
+                if code != 0:
+                    raise subprocess.CalledProcessError(code, command, output=out)
+                return out
+            try:
+                chunk = self._sock.recv(65536)
+            except socket.timeout:
+                self.close()
+                raise subprocess.TimeoutExpired(command, timeout, output=self._buf) from None
+            except OSError as exc:
+                self.close()
+                raise AdbSessionError(f"adb shell socket broken: {exc}", delivered=True) from exc
+            if not chunk:
+                self.close()
+                raise AdbSessionError("adb shell stream closed mid-command", delivered=True)
+            self._buf += chunk
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class AdbClient:
+    """Connection to one adb server; thread‑safe.
+
+    Up to `max_idle_per_serial` shell streams per device are kept open between
+    calls; concurrent callers on the same device each get their own stream.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 connect_timeout: float = 2.0, max_idle_per_serial: int = 4):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.max_idle_per_serial = max_idle_per_serial
+        self._idle: Dict[str | None, List[_SocketShell]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"AdbClient({self.host!r}, {self.port})"
+
+    # ---------- connections ----------
+    def _open(self) -> socket.socket:
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError as exc:
+            raise AdbSessionError(f"adb server unreachable at {self.host}:{self.port}: {exc}",
+                                  delivered=False) from exc
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _service(self, serial: str | None, service: str) -> socket.socket:
+        """Connection bound to `serial` (any device if None) running `service`."""
+        sock = self._open()
+        try:
+            _send_request(sock, f"host:transport:{serial}" if serial else "host:transport-any")
+            _send_request(sock, service)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _host_query(self, request: str) -> bytes:
+        sock = self._open()
+        try:
+            _send_request(sock, request)
+            return _recv_exact(sock, int(_recv_exact(sock, 4), 16))
+        finally:
+            sock.close()
+
+    def reachable(self) -> bool:
+        """True when an adb server answers on host:port."""
+        try:
+            self.version()
+            return True
+        except (AdbSessionError, OSError, ValueError):
+            return False
+
+    # ---------- host services ----------
+    def version(self) -> int:
+        return int(self._host_query("host:version"), 16)
+
+    def device_states(self) -> Dict[str, str]:
+        """serial -> state (`device`, `unauthorized`, `offline`, ...)."""
+        states = {}
+        for line in self._host_query("host:devices").decode().splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                states[parts[0]] = parts[1]
+        return states
+
+    def serials(self) -> List[str]:
+        """Serials of all connected & authorised devices (state `device`)."""
+        return [s for s, state in self.device_states().items() if state == "device"]
+
+    def devices(self) -> List["AdbDevice"]:
+        return [AdbDevice(self, s) for s in self.serials()]
+
+    def device(self, serial: str) -> "AdbDevice":
+        return AdbDevice(self, serial)
+
+    # ---------- device services ----------
+    def _acquire(self, serial: str | None) -> _SocketShell:
+        with self._lock:
+            idle = self._idle.get(serial, [])
+            while idle:
+                session = idle.pop()
+                if session.alive:
+                    return session
+        return _SocketShell(self._service(serial, "exec:sh"), serial)
+
+    def _release(self, session: _SocketShell) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(session.serial, [])
+            if session.alive and len(idle) < self.max_idle_per_serial:
+                idle.append(session)
+                return
+        session.close()
+
+    def shell(self, serial: str | None, command: str, timeout: float = 30,
+              pooled: bool = True) -> bytes:
+        """Run `command` on the device; stdout+stderr, `CalledProcessError` on
+        a non‑zero exit.  `pooled=False` uses a stream for this call only."""
+        session = self._acquire(serial) if pooled else _SocketShell(
+            self._service(serial, "exec:sh"), serial)
+        try:
+            return session.run(command, timeout)
+        finally:
+            if pooled:
+                self._release(session)
+            else:
+                session.close()
+
+    def exec_out(self, serial: str | None, command: str, timeout: float = 30) -> bytes:
+        """Raw stdout of `command` (`adb exec-out`), read until the device closes it."""
+        sock = self._service(serial, f"exec:{command}")
+        try:
+            sock.settimeout(timeout)
+            return _recv_all(sock)
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout) from None
+        finally:
+            sock.close()
+
+    def shell_once(self, serial: str | None, command: str, timeout: float = 30) -> bytes:
+        """Legacy `shell:<command>` service; output only, no exit status."""
+        sock = self._service(serial, f"shell:{command}")
+        try:
+            sock.settimeout(timeout)
+            return _recv_all(sock)
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout) from None
+        finally:
+            sock.close()
+
+    def push(self, serial: str | None, local: str, remote: str, mode: Optional[int] = None,
+             timeout: float = 60) -> None:
+        """Copy the file `local` to the full device path `remote` (sync SEND)."""
+        st = os.stat(local)
+        mode = stat.S_IFREG | ((st.st_mode if mode is None else mode) & 0o777)
+        spec = f"{remote},{mode}".encode()
+        sock = self._service(serial, "sync:")
+        try:
+            sock.settimeout(timeout)
+            sock.sendall(b"SEND" + struct.pack("<I", len(spec)) + spec)
+            with open(local, "rb") as f:
+                while True:
+                    chunk = f.read(SYNC_DATA_MAX)
+                    if not chunk:
+                        break
+                    sock.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+            sock.sendall(b"DONE" + struct.pack("<I", int(st.st_mtime)))
+            reply, n = struct.unpack("<4sI", _recv_exact(sock, 8))
+            if reply == b"FAIL":
+                raise AdbSessionError(f"push {local} -> {remote} failed: "
+                                      f"{_recv_exact(sock, n).decode(errors='replace')}",
+                                      delivered=True)
+            if reply != b"OKAY":
+                raise AdbSessionError(f"unexpected sync reply {reply!r}", delivered=True)
+            sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(f"push {local}", timeout) from None
+        finally:
+            sock.close()
+
+    def close_device(self, serial: str | None) -> None:
+        """Drop the pooled shell streams of one device."""
+        with self._lock:
+            sessions = self._idle.pop(serial, [])
+        for session in sessions:
+            session.close()
+
+    def close(self) -> None:
+        """Drop all pooled shell streams (they are reopened on demand)."""
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+        for session in sessions:
+            session.close()
+
+
+class AdbDevice:
+    """A serial on an `AdbClient`, with the `ppadb` `Device` calls used by
+    `adb-test.py`."""
+
+    def __init__(self, client: AdbClient, serial: str):
+        self.client = client
+        self.serial = serial
+
+    def __repr__(self) -> str:
+        return f"AdbDevice({self.serial!r})"
+
+    def shell(self, command: str, timeout: float = 30) -> str:
+        """Decoded output; like ppadb, a non‑zero exit status is not an error."""
+        try:
+            out = self.client.shell(self.serial, command, timeout)
+        except subprocess.CalledProcessError as exc:
+            out = exc.output
+        return out.decode("utf-8", errors="replace")
+
+    def exec_out(self, command: str, timeout: float = 30) -> bytes:
+        return self.client.exec_out(self.serial, command, timeout)
+
+    def push(self, local: str, remote: str, mode: Optional[int] = None) -> None:
+        self.client.push(self.serial, local, remote, mode)
+
+    def screencap(self) -> bytes:
+        """PNG screenshot bytes."""
+        return self.exec_out("screencap -p")
+
+
+_default_client: AdbClient | None = None
+_default_lock = threading.Lock()
+
+
+def default_client() -> AdbClient:
+    """Process‑wide client for the local adb server (pools are shared)."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = AdbClient()
+        return _default_client
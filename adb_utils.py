@@ -1,12 +1,28 @@
 import subprocess
+import base64
 import datetime
+import functools
+import hashlib
 import time
 import urllib.parse
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import posixpath
+import queue
+import re
+import shlex
+import struct
+import threading
+import uuid
+from typing import List, Dict, Any, Optional, Callable
 import io
 import PIL.Image as Image
+from PIL import ImageChops, ImageStat
+
+from adb_client import (AdbClient, AdbSessionError, _frame_shell_command,  # noqa: F401
+                        _split_framed_output, default_client)
+from tracing import span
+from ui_tree import UITree, UITreeDiff, diff_trees, parse_ui_xml
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +33,12 @@ logging.basicConfig(level=logging.INFO,
 # Low‑level helpers
 # ---------------------------------------------------------------------------
 
+ADB_BINARY: str = os.environ.get("ADB_BINARY", "adb")
+# "socket": talk to the adb server directly (adb_client), "binary": spawn
+# ADB_BINARY, "auto": socket when the server is up, else binary
+ADB_TRANSPORT: str = os.environ.get("ADB_TRANSPORT", "auto")
+
+
 def _run(cmd: List[str], timeout: int = 30) -> bytes:
     """Run a shell command and return raw stdout (raises on non‑zero exit)."""
     logger.debug("$ %s", " ".join(cmd))
@@ -24,12 +46,17 @@ def _run(cmd: List[str], timeout: int = 30) -> bytes:
 
 
 def _adb_prefix(serial: str | None) -> List[str]:
-    return ["adb", "-s", serial] if serial else ["adb"]
+    return [ADB_BINARY, "-s", serial] if serial else [ADB_BINARY]
 
 
-def _resize_pillow(origin_img, max_line_res: int = 1120):
-    """Resize PIL image so that longest edge ≤ `max_line_res` using Lanczos."""
-    w, h = origin_img.size
+@functools.lru_cache(maxsize=64)
+def _resize_plan(size: tuple[int, int], max_line_res: int | None) -> tuple[tuple[int, int], int]:
+    """Target size and integer box‑reduce factor for frames of `size`.
+
+    Memoised, so the geometry is worked out once per device resolution /
+    orientation rather than on every frame.
+    """
+    w, h = size
     if max_line_res is not None:
         max_line = max_line_res
         if h > max_line:
@@ -38,7 +65,67 @@ def _resize_pillow(origin_img, max_line_res: int = 1120):
         if w > max_line:
             h = int(h * max_line / w)
             w = max_line
-    return origin_img.resize((w, h), resample=Image.Resampling.LANCZOS)
+    factor = min(size[0] // w, size[1] // h) if w and h else 1
+    return (w, h), max(factor, 1)
+
+
+def _resize_pillow(origin_img, max_line_res: int = 1120, fast: bool = True):
+    """Resize PIL image so that longest edge ≤ `max_line_res` using Lanczos.
+
+    The fast path box‑reduces by the largest integer factor first and runs
+    Lanczos only over the remaining < 2x step.  RGBA input is treated as
+    opaque (as screen captures are) and comes back as RGB, which skips
+    Pillow's premultiply round trip for alpha images.
+    """
+    (w, h), factor = _resize_plan(origin_img.size, max_line_res)
+    with span("resize"):
+        if not fast:
+            return origin_img.resize((w, h), resample=Image.Resampling.LANCZOS)
+        img = origin_img.convert("RGBX") if origin_img.mode == "RGBA" else origin_img
+        if factor > 1:
+            img = img.reduce(factor)
+        if img.size != (w, h):
+            img = img.resize((w, h), resample=Image.Resampling.LANCZOS)
+        return img.convert("RGB") if img.mode == "RGBX" else img
+
+# `screencap` (without -p) pixel formats → (Pillow mode, raw decoder mode)
+_RAW_FORMATS = {
+    1: ("RGBA", "RGBA"),  # RGBA_8888
+    2: ("RGB", "RGBX"),   # RGBX_8888
+    5: ("RGBA", "BGRA"),  # BGRA_8888
+}
+
+
+def _decode_raw_screencap(buf: bytes) -> Image.Image:
+    """Wrap raw `screencap` output as an image without copying the pixels.
+
+    The header is width, height, format (uint32 LE) plus a colour‑space word
+    on Android 9+, so its size is inferred from the payload length.
+    """
+    if len(buf) < 12:
+        raise ValueError(f"short screencap output ({len(buf)} bytes)")
+    w, h, fmt = struct.unpack_from("<III", buf)
+    if fmt not in _RAW_FORMATS:
+        raise ValueError(f"unsupported screencap pixel format {fmt}")
+    body = w * h * 4
+    if len(buf) == body + 16:
+        header = 16
+    elif len(buf) >= body + 12:
+        header = 12
+    else:
+        raise ValueError(f"truncated screencap frame ({len(buf)} bytes for {w}x{h})")
+    mode, rawmode = _RAW_FORMATS[fmt]
+    return Image.frombuffer(mode, (w, h), memoryview(buf)[header:header + body],
+                            "raw", rawmode, 0, 1)
+
+def _frame_signature(img: Image.Image, size: tuple[int, int] = (36, 64)) -> Image.Image:
+    """Tiny grayscale thumbnail used to compare consecutive frames cheaply."""
+    return img.resize(size, Image.Resampling.BOX).convert("L")
+
+
+def _signature_distance(a: Image.Image, b: Image.Image) -> float:
+    """Mean absolute per‑pixel difference (0‑255) between two signatures."""
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0]
 
 def _encode_text_for_adb(text: str) -> str:
     """Encode text for adb shell input.  URL‑encode spaces as %s."""
@@ -54,39 +141,148 @@ def _encode_ascii_for_adb(text: str) -> str:
     """Encode ASCII‑only string for `adb shell input text …` (spaces→%s)."""
     return text.replace(" ", "%s")
 
+# ---------------------------------------------------------------------------
+# Persistent shell channel
+# ---------------------------------------------------------------------------
+
+class AdbShellSession:
+    """One long‑lived `adb shell` process per device.
+
+    Commands are written to the shell's stdin as a quoted `sh -c` and framed
+    by a random sentinel line carrying the exit status, so each call costs a
+    pipe round trip instead of an adb client spawn + server handshake, and a
+    malformed command fails on its own instead of wedging the session.  The
+    process is restarted lazily on the next call after it dies.
+    """
+
+    RESTART_BACKOFF_SECONDS = 5.0
+
+    def __init__(self, serial: str | None):
+        self.serial = serial
+        self._proc: subprocess.Popen | None = None
+        self._chunks: queue.Queue[bytes] = queue.Queue()
+        self._buf = b""
+        self._lock = threading.Lock()
+        self._marker = f"__ADB_AGENT_{uuid.uuid4().hex}__".encode()
+        self._retry_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _start(self) -> None:
+        if time.monotonic() < self._retry_at:
+            raise AdbSessionError("adb shell session is backing off", delivered=False)
+        try:
+            proc = subprocess.Popen(
+                _adb_prefix(self.serial) + ["shell"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,
+            )
+        except OSError as exc:
+            self._retry_at = time.monotonic() + self.RESTART_BACKOFF_SECONDS
+            raise AdbSessionError(f"cannot start adb shell: {exc}", delivered=False) from exc
+        chunks: queue.Queue[bytes] = queue.Queue()
+
+        def _pump() -> None:
+            while True:
+                data = proc.stdout.read(65536)
+                chunks.put(data)
+                if not data:
+                    return
+
+        threading.Thread(target=_pump, name=f"adb-shell-{self.serial}", daemon=True).start()
+        self._proc, self._chunks, self._buf = proc, chunks, b""
+        logger.debug("adb shell session started for %s", self.serial or "<default>")
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    def run(self, command: str, timeout: float = 30) -> bytes:
+        """Run `command` in the shared shell and return its stdout+stderr.
+
+        Mirrors `subprocess.check_output`: raises `CalledProcessError` on a
+        non‑zero exit status and `TimeoutExpired` (after dropping the session)
+        when the sentinel does not arrive in time.
+        """
+        with self._lock:
+            if not self.alive:
+                self._start()
+            try:
+                self._proc.stdin.write(_frame_shell_command(command, self._marker))
+            except OSError as exc:
+                self.close()
+                raise AdbSessionError(f"adb shell pipe broken: {exc}", delivered=False) from exc
+
+            deadline = time.monotonic() + timeout
+            while True:
+                framed = _split_framed_output(self._buf, self._marker)
+                if framed is not None:
+                    out, code, self._buf = framed
+                    if code != 0:
+                        raise subprocess.CalledProcessError(code, command, output=out)
+                    return out
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.close()
+                    raise subprocess.TimeoutExpired(command, timeout, output=self._buf)
+                try:
+                    chunk = self._chunks.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if not chunk:
+                    self.close()
+                    raise AdbSessionError("adb shell session closed mid-command", delivered=True)
+                self._buf += chunk
+
 # ---------------------------------------------------------------------------
 # AndroidDevice class
 # ---------------------------------------------------------------------------
 
-class AndroidDevice:
-    """Encapsulates a single, already‑connected Android handset."""
+class _DeviceBase:
+    """Transport‑independent half of a device: action compilation and parsing.
+
+    Shared by the blocking `AndroidDevice` and the asyncio `AsyncAndroidDevice`
+    (`adb_async.py`); nothing here talks to the phone.
+    """
 
-    _yadb_pushed: bool = False
     _yadb_local: str = os.path.join(os.path.dirname(__file__), "yadb/yadb")
+    _yadb_remote: str = "/data/local/tmp/yadb"
+    # serial → md5 of the yadb jar known to be on that device
+    _yadb_pushed: Dict[str, str] = {}
+    _yadb_lock = threading.Lock()
+    _ADB_KEYBOARD_IME = "com.android.adbkeyboard/.AdbIME"
+    TEXT_BACKENDS = ("auto", "adbkeyboard", "yadb")
 
-    def __init__(self, serial: str | None):
+    def __init__(self, serial: str | None, capture_mode: str = "raw", text_backend: str = "auto"):
+        if capture_mode not in ("raw", "png"):
+            raise ValueError(f"Unknown capture_mode: {capture_mode}")
+        if text_backend not in self.TEXT_BACKENDS:
+            raise ValueError(f"Unknown text_backend: {text_backend}")
         self.serial: str | None = serial
         self.width: int = 0
         self.height: int = 0
         self.last_req_time: datetime.datetime = datetime.datetime.now()
+        self.capture_mode: str = capture_mode
+        self._last_action_at: float = 0.0
+        self.last_settle_seconds: float = 0.0
+        # "auto" is resolved to a concrete backend on first non‑ASCII TYPE
+        self.text_backend: str = text_backend
+        self._ime_ready: bool = False
 
-    # ---------- internal ----------
-    def _adb(self, *args: str, timeout: int = 30) -> bytes:
-        return _run(_adb_prefix(self.serial) + list(args), timeout)
-
-    def _ensure_yadb(self):
-        if AndroidDevice._yadb_pushed:
-            return
-        if not os.path.exists(AndroidDevice._yadb_local):
-            raise FileNotFoundError(f"yadb helper not found: {AndroidDevice._yadb_local}")
-        self._adb("push", AndroidDevice._yadb_local, "/data/local/tmp")
-        AndroidDevice._yadb_pushed = True
-        logger.info("yadb pushed to device for Unicode input support")
-
-    # ---------- public API ----------
-    def refresh_resolution(self) -> None:
-        """Query and cache `wm size` (sets .width / .height)."""
-        raw = self._adb("shell", "wm", "size").decode()
+    def _parse_wm_size(self, raw: str) -> None:
         try:
             size_line = raw.split("Physical size: ")[1].splitlines()[0]
             self.width, self.height = map(int, size_line.split("x"))
@@ -95,49 +291,79 @@ class AndroidDevice:
         except Exception as exc:
             raise RuntimeError(f"Failed to parse wm size output: {raw}") from exc
 
-    # -------------------------------------------------------------------
-    # Step: execute user action
-    # -------------------------------------------------------------------
-    def step(self, data: Dict[str, Any]) -> None:
-        """Execute a control step on the device (tap/swipe/key/text/clear)."""
-        logger.debug("Step: %s", data)
-        if "POINT" in data:
-            self._handle_point(data)
-        if "PRESS" in data:
-            self._handle_press(data["PRESS"])
-        if "TYPE" in data:
-            self._handle_type(data["TYPE"])
-        if "CLEAR" in data:
-            self._adb("shell", "input", "keyevent", "KEYCODE_CLEAR")
+    def _mark_action(self) -> None:
         self.last_req_time = datetime.datetime.now()
+        self._last_action_at = time.monotonic()
 
+    @staticmethod
+    def _is_finish(data: Dict[str, Any]) -> bool:
         if ("STATUS", "finish") in data.items() or ("STATUS", "impossible") in data.items():
             logger.info("Task finished")
             return True
         return False
 
-    # -------------------------------------------------------------------
-    # State snapshot
-    # -------------------------------------------------------------------
-    def state(self) -> Dict[str, Any]:
-        return {
-            "width": self.width,
-            "height": self.height,
-            "last_req_time": self.last_req_time.isoformat(),
-            "screenshot": self.screenshot(),
-        }
+    def _yadb_key(self) -> str:
+        return self.serial or "<default>"
 
-    # --- Device state ---------------------------------------------------
-    def screenshot(self, max_side: Optional[int] = None) -> Image.Image:
-        """Grab screen; return Pillow Image.  Optionally down‑scale with user rule."""
-        png_bytes = self._adb("exec-out", "screencap", "-p")
-        img = Image.open(io.BytesIO(png_bytes))
-        if max_side is not None:
-            img = _resize_pillow(img, max_side)
-        return img
+    @staticmethod
+    @functools.lru_cache(maxsize=4)
+    def _local_md5(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
 
-    # =================== private helpers ===================
-    def _handle_point(self, data: Dict[str, Any]) -> None:
+    # =================== action compilation ===================
+    _KEYS = {
+        "HOME": "KEYCODE_HOME",
+        "BACK": "KEYCODE_BACK",
+        "MENU": "KEYCODE_MENU",
+        "ENTER": "KEYCODE_ENTER",
+        "APPSELECT": "KEYCODE_APP_SWITCH",
+        "power": "KEYCODE_POWER",
+        "volume_up": "KEYCODE_VOLUME_UP",
+        "volume_down": "KEYCODE_VOLUME_DOWN",
+        "volume_mute": "KEYCODE_VOLUME_MUTE",
+    }
+    _KEYCODE = re.compile(r"KEYCODE_[A-Z0-9_]+")
+    _TIME_MARK = "__ADB_AGENT_T__"
+    _UI_DUMP_PATH = "/data/local/tmp/adb_agent_ui.xml"
+
+    def _compile_action(self, data: Dict[str, Any]) -> List[str]:
+        """Translate one action dict into device shell commands."""
+        cmds = []
+        if "POINT" in data:
+            cmds.append(self._point_command(data))
+        if "PRESS" in data:
+            cmds.append(self._press_command(data["PRESS"]))
+        if "TYPE" in data:
+            cmds.append(self._type_command(data["TYPE"]))
+        if "CLEAR" in data:
+            cmds.append("input keyevent KEYCODE_CLEAR")
+        if "KEYS" in data:
+            codes = [self._key_code(k) for k in data["KEYS"]] * int(data.get("repeat", 1))
+            if codes:
+                cmds.append("input keyevent " + " ".join(codes))
+        return cmds
+
+    def _script(self, groups: List[List[str]]) -> str:
+        """One shell script running command groups with uptime marks around each.
+
+        Runs in a subshell with `set -e` so a failure stops the script without
+        touching a persistent session's shell.
+        """
+        mark = f"read t _ </proc/uptime; echo {self._TIME_MARK} $t"
+        parts = ["set -e", mark]
+        for cmds in groups:
+            parts.extend(cmds)
+            parts.append(mark)
+        return "(" + "; ".join(parts) + ")"
+
+    def _script_timings(self, out: bytes) -> List[float]:
+        """Seconds per group from the output of `_script`."""
+        stamps = [float(line.split()[1]) for line in out.decode(errors="replace").splitlines()
+                  if line.startswith(self._TIME_MARK)]
+        return [b - a for a, b in zip(stamps, stamps[1:])]
+
+    def _point_command(self, data: Dict[str, Any]) -> str:
         x, y = data["POINT"]
         x = int(x / 1000 * self.width)
         y = int(y / 1000 * self.height)
@@ -158,59 +384,555 @@ class AndroidDevice:
                 dx_ratio, dy_ratio = dirs[data["to"]]
                 x2 = int(max(min(x + dx_ratio * self.width, self.width), 0))
                 y2 = int(max(min(y + dy_ratio * self.height, self.height), 0))
-            dur = str(data.get("duration", 150))
-            self._adb("shell", "input", "swipe", str(x), str(y), str(x2), str(y2), dur)
-        else:  # simple tap
-            self._adb("shell", "input", "tap", str(x), str(y))
+            dur = int(data.get("duration", 150))
+            return f"input swipe {x} {y} {x2} {y2} {dur}"
+        return f"input tap {x} {y}"  # simple tap
 
-    def _handle_press(self, key: str) -> None:
-        KEYS = {
-            "HOME": "KEYCODE_HOME",
-            "BACK": "KEYCODE_BACK",
-            "MENU": "KEYCODE_MENU",
-            "ENTER": "KEYCODE_ENTER",
-            "APPSELECT": "KEYCODE_APP_SWITCH",
-            "power": "KEYCODE_POWER",
-            "volume_up": "KEYCODE_VOLUME_UP",
-            "volume_down": "KEYCODE_VOLUME_DOWN",
-            "volume_mute": "KEYCODE_VOLUME_MUTE",
-        }
-        if key not in KEYS:
+    def _key_code(self, key: Any) -> str:
+        """A KEYS entry as an `input keyevent` argument: a PRESS name, a
+        KEYCODE_* name or a numeric key code; anything else is rejected
+        before it reaches the shell."""
+        if isinstance(key, int) and not isinstance(key, bool) and key >= 0:
+            return str(key)
+        if isinstance(key, str):
+            if key in self._KEYS:
+                return self._KEYS[key]
+            if self._KEYCODE.fullmatch(key):
+                return key
+        raise ValueError(f"Unknown KEYS value: {key!r}")
+
+    def _press_command(self, key: str) -> str:
+        if key not in self._KEYS:
             raise ValueError(f"Unknown PRESS value: {key}")
-        self._adb("shell", "input", "keyevent", KEYS[key])
+        return f"input keyevent {self._KEYS[key]}"
 
     # def _handle_type(self, raw):
     #     decoded = urllib.parse.unquote(raw)
     #     self._adb("shell", "am", "broadcast", '-a', 'ADB_INPUT_TEXT', '--es msg' , decoded)
     #     # self._adb("shell", "input", "text", decoded)
 
-    def _handle_type(self, raw):
+    def _type_command(self, raw: str) -> str:
+        """Command for TYPE; non‑ASCII text needs `text_backend` resolved first
+        (see `_needs_text_backend`)."""
         text = urllib.parse.unquote(raw)
         if all(ord(c) < 128 for c in text):  # quick ASCII path
-            self._adb("shell", "input", "text", _encode_ascii_for_adb(text))
-            return
+            return "input text " + shlex.quote(_encode_ascii_for_adb(text))
+        if self.text_backend == "adbkeyboard":
+            msg = base64.b64encode(text.encode("utf-8")).decode("ascii")
+            return f"am broadcast -a ADB_INPUT_B64 --es msg {msg} >/dev/null"
+        if self.text_backend != "yadb":
+            raise RuntimeError("Text backend not resolved before compiling Unicode input")
         # Unicode → yadb
-        self._ensure_yadb()
         safe = text.replace("'", "'\\''")  # escape single quotes for sh
-        cmd = (
+        return (
             "app_process -Djava.class.path=/data/local/tmp/yadb /data/local/tmp "
             "com.ysbing.yadb.Main -keyboard '%s'" % safe
         )
-        self._adb("shell", cmd)
+
+    @staticmethod
+    def _needs_text_backend(data: Dict[str, Any]) -> bool:
+        """Whether the action types non‑ASCII text (needs yadb / ADB Keyboard)."""
+        return "TYPE" in data and not all(ord(c) < 128 for c in urllib.parse.unquote(data["TYPE"]))
+
+
+class AndroidDevice(_DeviceBase):
+    """Encapsulates a single, already‑connected Android handset."""
+
+    TRANSPORTS = ("auto", "socket", "binary")
+
+    def __init__(self, serial: str | None, use_shell_session: bool = True,
+                 capture_mode: str = "raw", text_backend: str = "auto",
+                 transport: str | None = None, client: AdbClient | None = None):
+        super().__init__(serial, capture_mode, text_backend)
+        self._ui_cache: UITreeCache | None = None
+        self._stream: ScreenStream | None = None
+        self._pooled = use_shell_session
+        self._client = self._pick_client(transport or ADB_TRANSPORT, client)
+        self._session: AdbShellSession | None = (
+            AdbShellSession(serial) if use_shell_session and self._client is None else None
+        )
+
+    @staticmethod
+    def _pick_client(transport: str, client: AdbClient | None) -> AdbClient | None:
+        if transport not in AndroidDevice.TRANSPORTS:
+            raise ValueError(f"transport must be one of {AndroidDevice.TRANSPORTS}, got {transport!r}")
+        if transport == "binary":
+            return None
+        client = client or default_client()
+        if transport == "auto" and not client.reachable():
+            logger.info("No adb server on %s:%d; using the %s binary", client.host, client.port,
+                        ADB_BINARY)
+            return None
+        return client
+
+    # ---------- internal ----------
+    def _adb(self, *args: str, timeout: int = 30) -> bytes:
+        with span("adb", serial=self.serial, cmd=" ".join(args[:3])):
+            if self._client is not None and len(args) > 1 and args[0] in ("shell", "exec-out"):
+                command = " ".join(args[1:])
+                try:
+                    if args[0] == "shell":
+                        return self._client.shell(self.serial, command, timeout, self._pooled)
+                    return self._client.exec_out(self.serial, command, timeout)
+                except AdbSessionError as exc:
+                    if exc.delivered:
+                        raise
+                    logger.warning("adb server socket unavailable (%s); falling back to %s",
+                                   exc, ADB_BINARY)
+            elif self._session is not None and len(args) > 1 and args[0] == "shell":
+                try:
+                    return self._session.run(" ".join(args[1:]), timeout)
+                except AdbSessionError as exc:
+                    if exc.delivered:
+                        raise
+                    logger.warning("adb shell session unavailable (%s); falling back to subprocess", exc)
+            return _run(_adb_prefix(self.serial) + list(args), timeout)
+
+    def _push(self, local: str, remote_dir: str) -> None:
+        """`adb push local remote_dir` (the file keeps its name)."""
+        if self._client is not None:
+            with span("adb", serial=self.serial, cmd="push"):
+                try:
+                    self._client.push(self.serial, local,
+                                      posixpath.join(remote_dir, os.path.basename(local)))
+                    return
+                except AdbSessionError as exc:
+                    if exc.delivered:
+                        raise
+                    logger.warning("adb server socket unavailable (%s); falling back to %s",
+                                   exc, ADB_BINARY)
+        self._adb("push", local, remote_dir)
+
+    def close(self) -> None:
+        """Release the persistent shell channel (it is reopened on demand)."""
+        self.stop_stream()
+        if self._session is not None:
+            self._session.close()
+        if self._client is not None:
+            self._client.close_device(self.serial)
+
+    def _grab_frame(self) -> Image.Image:
+        if self.capture_mode == "raw":
+            buf = self._adb("exec-out", "screencap")
+            try:
+                return _decode_raw_screencap(buf)
+            except ValueError as exc:
+                logger.warning("Raw screencap unusable (%s); switching to PNG capture", exc)
+                self.capture_mode = "png"
+        png_bytes = self._adb("exec-out", "screencap", "-p")
+        return Image.open(io.BytesIO(png_bytes))
+
+    def _ensure_yadb(self):
+        """Push the yadb jar unless this device already has the same build."""
+        if not os.path.exists(AndroidDevice._yadb_local):
+            raise FileNotFoundError(f"yadb helper not found: {AndroidDevice._yadb_local}")
+        local = self._local_md5(AndroidDevice._yadb_local)
+        key = self._yadb_key()
+        with AndroidDevice._yadb_lock:
+            if AndroidDevice._yadb_pushed.get(key) == local:
+                return
+            try:
+                remote = self._adb("shell", f"md5sum {self._yadb_remote} 2>/dev/null").split()[:1]
+            except subprocess.CalledProcessError:
+                remote = []
+            if remote != [local.encode()]:
+                self._push(AndroidDevice._yadb_local, posixpath.dirname(self._yadb_remote))
+                logger.info("yadb pushed to %s for Unicode input support", key)
+            AndroidDevice._yadb_pushed[key] = local
+
+    def _resolve_text_backend(self) -> str:
+        """Pick the Unicode input backend once per device.
+
+        `auto` uses ADB Keyboard when it is already the active IME (a resident
+        service, so each input is one broadcast) and yadb otherwise.  An
+        explicit `adbkeyboard` enables and selects the IME on the device.
+        """
+        if self.text_backend == "auto":
+            current = self._adb("shell", "settings get secure default_input_method").strip()
+            self._ime_ready = current.decode(errors="replace") == self._ADB_KEYBOARD_IME
+            self.text_backend = "adbkeyboard" if self._ime_ready else "yadb"
+            logger.info("Text input backend for %s: %s", self.serial or "<default>",
+                        self.text_backend)
+        elif self.text_backend == "adbkeyboard" and not self._ime_ready:
+            self._adb("shell", f"ime enable {self._ADB_KEYBOARD_IME} >/dev/null; "
+                               f"ime set {self._ADB_KEYBOARD_IME} >/dev/null")
+            self._ime_ready = True
+        return self.text_backend
+
+    def _prepare_text_input(self, actions: List[Dict[str, Any]]) -> None:
+        """Resolve the Unicode backend (and push yadb) before compiling `actions`."""
+        if any(self._needs_text_backend(a) for a in actions):
+            if self._resolve_text_backend() == "yadb":
+                self._ensure_yadb()
+
+    # ---------- public API ----------
+    def refresh_resolution(self) -> None:
+        """Query and cache `wm size` (sets .width / .height)."""
+        self._parse_wm_size(self._adb("shell", "wm", "size").decode())
+
+    # -------------------------------------------------------------------
+    # Step: execute user action
+    # -------------------------------------------------------------------
+    def step(self, data: Dict[str, Any]) -> None:
+        """Execute a control step on the device (tap/swipe/key/text/clear).
+
+        All device commands of one action go out in a single round trip.
+        """
+        logger.debug("Step: %s", data)
+        self._prepare_text_input([data])
+        if self._ui_cache is not None:
+            self._ui_cache.note_action(data)
+        cmds = self._compile_action(data)
+        if len(cmds) == 1:
+            self._adb("shell", cmds[0])
+        elif cmds:
+            self._run_script([cmds])
+        self._mark_action()
+        return self._is_finish(data)
+
+    def run_batch(self, actions: List[Dict[str, Any]]) -> List[float]:
+        """Execute several actions in one device round trip.
+
+        Accepts everything `step` does plus `{"KEYS": [...], "repeat": n}`,
+        which sends the keycodes (PRESS names, KEYCODE_* names or numeric
+        codes) `repeat` times through a single `input keyevent`.  Returns the on‑device
+        duration of each action in seconds (10 ms resolution); a failing
+        action aborts the rest and raises like `_adb` does.
+        """
+        self._prepare_text_input(actions)
+        if self._ui_cache is not None:
+            for action in actions:
+                self._ui_cache.note_action(action)
+        timings = self._run_script([self._compile_action(a) for a in actions])
+        self._mark_action()
+        return timings
+
+    def _run_script(self, groups: List[List[str]]) -> List[float]:
+        """Run command groups as one shell script; returns seconds per group."""
+        return self._script_timings(self._adb("shell", self._script(groups)))
+
+    def clear_text(self, count: int = 50) -> None:
+        """Delete `count` characters before the cursor end, in one `input` call."""
+        self.run_batch([{"KEYS": ["KEYCODE_MOVE_END"]}, {"KEYS": ["KEYCODE_DEL"], "repeat": count}])
+
+    # -------------------------------------------------------------------
+    # State snapshot
+    # -------------------------------------------------------------------
+    def state(self) -> Dict[str, Any]:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "last_req_time": self.last_req_time.isoformat(),
+            "screenshot": self.screenshot(),
+        }
+
+    # --- Device state ---------------------------------------------------
+    def screenshot(self, max_side: Optional[int] = None) -> Image.Image:
+        """Grab screen; return Pillow Image.  Optionally down‑scale with user rule.
+
+        With a running stream (`start_stream`) the newest frame captured after
+        the last `step` is returned instead of issuing a fresh screencap.
+        """
+        with span("screenshot", serial=self.serial):
+            if self._stream is not None:
+                img = self._stream.latest(newer_than=self._last_action_at)
+            else:
+                img = self._grab_frame()
+        if max_side is not None:
+            img = _resize_pillow(img, max_side)
+        return img
+
+    def wait_for_settle(
+        self,
+        max_side: Optional[int] = None,
+        timeout: float = 5.0,
+        interval: float = 0.1,
+        threshold: float = 1.5,
+        stable_frames: int = 2,
+        min_wait: float = 0.2,
+        on_frame: Optional[Callable[[Image.Image], None]] = None,
+    ) -> Image.Image:
+        """Poll frames until the UI stops changing, then return the last one.
+
+        Frames count as unchanged when their 36x64 grayscale signatures differ
+        by at most `threshold` (mean, 0‑255).  Polling starts `min_wait` seconds
+        in, so an action that has not started animating yet is not mistaken
+        for a settled screen.  Returns after `stable_frames` consecutive
+        matching frames or `timeout` seconds, whichever is first; the elapsed
+        time is kept in `last_settle_seconds`.  `on_frame` sees
+        every full‑resolution frame as it is captured, so callers can start
+        processing candidates while the next poll is in flight.
+        """
+        with span("settle", serial=self.serial):
+            frame = self._poll_until_stable(timeout, interval, threshold, stable_frames,
+                                            min_wait, on_frame)
+        if max_side is not None:
+            frame = _resize_pillow(frame, max_side)
+        return frame
+
+    def _poll_until_stable(self, timeout, interval, threshold, stable_frames,
+                           min_wait, on_frame) -> Image.Image:
+        start = time.monotonic()
+        if min_wait:
+            time.sleep(min_wait)
+        prev_sig: Image.Image | None = None
+        matches = 0
+        while True:
+            captured_at = time.monotonic()
+            if self._stream is not None:
+                frame = self._stream.latest(newer_than=captured_at)
+            else:
+                frame = self._grab_frame()
+            if on_frame is not None:
+                on_frame(frame)
+            sig = _frame_signature(frame)
+            if prev_sig is not None and _signature_distance(prev_sig, sig) <= threshold:
+                matches += 1
+            else:
+                matches = 0
+            prev_sig = sig
+            if matches >= stable_frames - 1:
+                break
+            if time.monotonic() - start >= timeout:
+                logger.debug("Screen did not settle within %.1fs", timeout)
+                break
+            time.sleep(max(0.0, interval - (time.monotonic() - captured_at)))
+        self.last_settle_seconds = time.monotonic() - start
+        return frame
+
+    def ui_tree(self) -> UITree:
+        """Dump the accessibility hierarchy and return it parsed and indexed."""
+        with span("ui_dump", serial=self.serial):
+            xml = self._adb(
+                "shell",
+                f"uiautomator dump {self._UI_DUMP_PATH} >/dev/null && cat {self._UI_DUMP_PATH}",
+            )
+        with span("ui_parse"):
+            return parse_ui_xml(xml)
+
+    def current_activity(self) -> str:
+        """Focused window's component (e.g. `com.pkg/.MainActivity`), or ""."""
+        out = self._adb("shell", "dumpsys window | grep -m 1 mCurrentFocus || true")
+        text = out.decode(errors="replace").strip()
+        return text.rsplit(" ", 1)[-1].rstrip("}") if text else ""
+
+    def cached_ui_tree(self, frame: Optional[Image.Image] = None) -> UITree:
+        """`ui_tree()` through this device's `UITreeCache` (see `ui_cache`)."""
+        if self._ui_cache is None:
+            self._ui_cache = UITreeCache(self)
+        return self._ui_cache.get(frame)
+
+    @property
+    def ui_cache(self) -> "UITreeCache | None":
+        return self._ui_cache
+
+    def start_stream(self, interval: float = 0.0) -> "ScreenStream":
+        """Capture continuously in the background; `screenshot` then reads from it."""
+        if self._stream is None:
+            self._stream = ScreenStream(self, interval)
+            self._stream.start()
+        return self._stream
+
+    def stop_stream(self) -> None:
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.stop()
+
+    def _handle_point(self, data: Dict[str, Any]) -> None:
+        self._adb("shell", self._point_command(data))
+
+    def _handle_press(self, key: str) -> None:
+        self._adb("shell", self._press_command(key))
+
+    def _handle_type(self, raw):
+        self._prepare_text_input([{"TYPE": raw}])
+        self._adb("shell", self._type_command(raw))
+
+    def type_text(self, text: str) -> float:
+        """Type `text` (any script) and return how long it took in seconds."""
+        start = time.perf_counter()
+        with span("type_text", serial=self.serial):
+            self._handle_type(urllib.parse.quote(text))
+        self._mark_action()
+        return time.perf_counter() - start
+
+# ---------------------------------------------------------------------------
+# UI tree cache
+# ---------------------------------------------------------------------------
+
+def _ui_fingerprint(img: Image.Image) -> Image.Image:
+    """72×128 grayscale thumbnail; finer than the settle signature so a typed
+    character or a toggled switch still shows up."""
+    return _frame_signature(img, (72, 128))
+
+
+def _fingerprint_distance(a: Image.Image, b: Image.Image) -> int:
+    """Largest per‑cell difference (0‑255) between two fingerprints."""
+    return ImageChops.difference(a, b).getextrema()[1]
+
+
+class UITreeCache:
+    """Skip hierarchy dumps when the screen has not changed.
+
+    Entries are keyed by a cheap fingerprint: the focused activity plus a
+    72×128 grayscale thumbnail.  A frame whose every cell is within
+    `tolerance` of a cached one on the same activity reuses its tree, as long
+    as that tree is at most `max_age` seconds old; otherwise the tree is
+    dumped again.  Actions that change state the frame may barely show (TYPE,
+    CLEAR, a tap on a checkable or editable node) force a fresh dump through
+    `note_action`.  Whenever the current tree changes, `last_diff` holds the
+    structural diff against the previous one, which also tells whether an
+    action had any visible effect.
+    """
+
+    def __init__(self, device: AndroidDevice, max_entries: int = 16, tolerance: int = 12,
+                 max_age: float = 10.0):
+        self.device = device
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        self.max_age = max_age
+        # (activity, fingerprint, tree, dumped at), most recent first
+        self._entries: List[tuple[str, Image.Image, UITree, float]] = []
+        self._stale = False
+        self.current: UITree | None = None
+        self.last_diff: UITreeDiff | None = None
+        self.last_hit: bool = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, frame: Optional[Image.Image] = None) -> UITree:
+        activity = self.device.current_activity()
+        fp = _ui_fingerprint(frame if frame is not None else self.device.screenshot())
+        now = time.monotonic()
+        tree = None
+        if self._stale:
+            # the tree the last action was aimed at may no longer be right
+            self._entries = [e for e in self._entries if e[2] is not self.current]
+            self._stale = False
+        else:
+            self._entries = [e for e in self._entries if now - e[3] <= self.max_age]
+            for i, (act, cached_fp, cached_tree, _) in enumerate(self._entries):
+                if act == activity and _fingerprint_distance(fp, cached_fp) <= self.tolerance:
+                    self._entries.insert(0, self._entries.pop(i))
+                    tree = cached_tree
+                    break
+        self.last_hit = tree is not None
+        if tree is None:
+            self.misses += 1
+            tree = self.device.ui_tree()
+            self._entries.insert(0, (activity, fp, tree, now))
+            del self._entries[self.max_entries:]
+        else:
+            self.hits += 1
+        if tree is not self.current:
+            self.last_diff = diff_trees(self.current, tree) if self.current is not None else None
+            self.current = tree
+        else:
+            self.last_diff = UITreeDiff([], [], [])
+        return tree
+
+    def note_action(self, action: Dict[str, Any]) -> None:
+        """Force a fresh dump on the next `get` if `action` may change text or
+        checked state on the current tree."""
+        if "TYPE" in action or "CLEAR" in action:
+            self._stale = True
+        elif "POINT" in action and "to" not in action and self.current is not None:
+            x = int(action["POINT"][0] / 1000 * self.device.width)
+            y = int(action["POINT"][1] / 1000 * self.device.height)
+            self._stale = self._stale or any(
+                node.checkable or node.cls.endswith("EditText")
+                for node in self.current.nodes_at(x, y))
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._stale = False
+        self.current = None
+        self.last_diff = None
+        self.last_hit = False
+
+# ---------------------------------------------------------------------------
+# Continuous capture
+# ---------------------------------------------------------------------------
+
+class ScreenStream:
+    """Background thread that keeps grabbing frames and holds the newest one."""
+
+    def __init__(self, device: AndroidDevice, interval: float = 0.0):
+        self.device = device
+        self.interval = interval
+        self._frame: Image.Image | None = None
+        self._started_at: float = 0.0  # capture start time of `_frame`
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True,
+                                        name=f"screen-stream-{self.device.serial}")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                frame = self.device._grab_frame()
+            except Exception as exc:  # keep streaming through transient adb errors
+                logger.warning("Stream capture failed: %s", exc)
+                self._stop.wait(1.0)
+                continue
+            with self._cond:
+                self._frame, self._started_at = frame, started
+                self._cond.notify_all()
+            if self.interval:
+                self._stop.wait(self.interval)
+
+    def latest(self, newer_than: float = 0.0, timeout: float = 10.0) -> Image.Image:
+        """Newest frame whose capture began after `newer_than` (monotonic time)."""
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self._frame is not None and self._started_at > newer_than,
+                    timeout):
+                raise TimeoutError("No fresh frame from screen stream")
+            return self._frame
 
 # ---------------------------------------------------------------------------
 # Public utility function
 # ---------------------------------------------------------------------------
 
-def setup_device() -> AndroidDevice:
-    """Detect the first connected & authorised Android phone and return an object."""
-    lines = _run(["adb", "devices"]).decode().strip().splitlines()[1:]
-    serials = [l.split()[0] for l in lines if l.strip() and "device" in l]
-    if not serials:
-        raise RuntimeError("No authorised Android device found. Plug in & check adb.")
-    if len(serials) > 1:
-        logger.warning("Multiple devices detected; defaulting to the first (%s).", serials[0])
-    dev = AndroidDevice(serials[0])
+def list_devices() -> List[str]:
+    """Serials of all connected & authorised devices (state `device`)."""
+    if ADB_TRANSPORT != "binary":
+        try:
+            return default_client().serials()
+        except AdbSessionError as exc:
+            if ADB_TRANSPORT == "socket":
+                raise
+            logger.debug("adb server not reachable (%s); asking %s", exc, ADB_BINARY)
+    lines = _run(_adb_prefix(None) + ["devices"]).decode().strip().splitlines()[1:]
+    return [parts[0] for parts in (l.split() for l in lines)
+            if len(parts) >= 2 and parts[1] == "device"]
+
+
+def setup_device(serial: str | None = None) -> AndroidDevice:
+    """Detect the first connected & authorised Android phone and return an object.
+
+    Pass `serial` to pick a specific handset instead.
+    """
+    if serial is None:
+        serials = list_devices()
+        if not serials:
+            raise RuntimeError("No authorised Android device found. Plug in & check adb.")
+        if len(serials) > 1:
+            logger.warning("Multiple devices detected; defaulting to the first (%s).", serials[0])
+        serial = serials[0]
+    dev = AndroidDevice(serial)
     dev.refresh_resolution()
     return dev
 
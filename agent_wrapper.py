@@ -1,18 +1,35 @@
 import abc
+import asyncio
 import base64
+import inspect
 import io
+import logging
 import os
 import time
-from typing import Any, Optional
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
 from google.generativeai import types
 import numpy as np
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from jsonschema import Draft7Validator
+
+from action_schema import (ACTION_KEYS, ActionStreamParser, ActionValidationError, compile_schema,
+                           parse_action)
+from resilience import (Backoff, CircuitBreaker, CircuitOpenError, HedgedTransport, breaker_for,
+                        is_failure_status)
+from tracing import span
+
+try:  # 可选依赖，仅 apredict_mm 需要
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+logger = logging.getLogger(__name__)
 
 ERROR_CALLING_LLM = "Error calling LLM"
-END_POINT = "http://localhost:8000/v1/chat/completions"
+END_POINT = os.environ.get("MINICPM_ENDPOINT", "http://localhost:8000/v1/chat/completions")
 
 # 获取当前文件的绝对路径
 current_file_path = os.path.abspath(__file__)
@@ -26,12 +43,17 @@ def compact_json_dumps(obj):
 ACTION_SCHEMA = json.load(
     open(os.path.join(current_dir, "schema_thought.json"), encoding="utf-8")
 )
+# 无思考模式使用原始 Schema（不注入 required: ["thought"]），模型可以直接输出动作
+ACTION_SCHEMA_NO_THOUGHT = ACTION_SCHEMA
 items = list(ACTION_SCHEMA.items())
 insert_index = 3  # 假设要插入到索引1的位置
 items.insert(insert_index, ("required", ["thought"]))
 # items.insert(insert_index, ("optional", ["thought"]))
 ACTION_SCHEMA = dict(items)
-SYSTEM_PROMPT = f"""# Role
+
+
+def _system_prompt(schema: dict) -> str:
+    return f"""# Role
 你是一名熟悉安卓系统触屏GUI操作的智能体，将根据用户的问题，分析当前界面的GUI元素和布局，生成相应的操作。
 
 # Task
@@ -42,27 +64,114 @@ SYSTEM_PROMPT = f"""# Role
 - 输出操作必须遵循Schema约束
 
 # Schema
-{json.dumps(ACTION_SCHEMA, indent=None, ensure_ascii=False, separators=(',', ':'))}"""
+{json.dumps(schema, indent=None, ensure_ascii=False, separators=(',', ':'))}"""
+
+
+SYSTEM_PROMPT = _system_prompt(ACTION_SCHEMA)
+SYSTEM_PROMPT_NO_THOUGHT = _system_prompt(ACTION_SCHEMA_NO_THOUGHT)
 
 EXTRACT_SCHEMA = json.load(
     open(os.path.join(current_dir, "schema_for_extraction.json"), encoding="utf-8")
 )
-validator = Draft7Validator(EXTRACT_SCHEMA)
+# 启动时把 Schema 编译成校验函数，避免每次响应都重新解析 Schema
+check_action = compile_schema(EXTRACT_SCHEMA)
 
+# 输出不符合 Schema 时立即追问（不走退避重试）
+REASK_PROMPT = "上一条输出不是合法的操作：{reason}。请重新输出，只输出一个符合 Schema 的紧凑 JSON。"
+
+
+ImageLike = Union[Image.Image, np.ndarray]
+
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
 
-def array_to_jpeg_bytes(image: np.ndarray) -> bytes:
-    """Converts a numpy array into a byte string for a JPEG image."""
-    image = Image.fromarray(image)
-    return image_to_jpeg_bytes(image)
 
+@dataclass
+class EncodedImage:
+    """Compressed screenshot plus what it cost to produce."""
 
-def image_to_jpeg_bytes(image: Image.Image) -> bytes:
+    data: bytes
+    mime_type: str
+    encode_ms: float
+    source: Optional[Image.Image] = None  # 编码前的图像（缩略图历史需要）
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def encode_image_bytes(
+    image: ImageLike, image_format: str = "JPEG", quality: int = 85
+) -> EncodedImage:
+    """Compress a PIL image or numpy array as JPEG / WebP / PNG."""
+    image_format = image_format.upper()
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    start = time.perf_counter()
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")  # JPEG has no alpha channel
     in_mem_file = io.BytesIO()
-    image.save(in_mem_file, format="PNG")
-    # Reset file pointer to start
-    in_mem_file.seek(0)
-    img_bytes = in_mem_file.read()
-    return img_bytes
+    if image_format == "PNG":
+        image.save(in_mem_file, format="PNG")
+    else:
+        image.save(in_mem_file, format=image_format, quality=quality)
+    return EncodedImage(
+        in_mem_file.getvalue(),
+        IMAGE_MIME_TYPES[image_format],
+        (time.perf_counter() - start) * 1000,
+        image,
+    )
+
+
+def array_to_jpeg_bytes(image: np.ndarray, quality: int = 85) -> bytes:
+    """Converts a numpy array into a byte string for a JPEG image."""
+    return encode_image_bytes(image, "JPEG", quality).data
+
+
+def image_to_jpeg_bytes(image: Image.Image, quality: int = 85) -> bytes:
+    return encode_image_bytes(image, "JPEG", quality).data
+
+
+@dataclass
+class Prediction:
+    """一次预测的结果。
+
+    兼容旧的元组用法：`text, is_safe, raw, action = prediction`、
+    `prediction[3]`。失败时 text 为 ERROR_CALLING_LLM，action 为 None，
+    error 记录最后一次的错误。
+
+    流式模式下 action 始终是已经执行的动作；它与完整输出不一致时，
+    完整输出的解析结果记在 mismatch 中。
+    """
+    text: str
+    is_safe: Optional[bool]
+    raw: Any
+    action: Optional[dict]
+    endpoint: Optional[str] = None
+    attempts: int = 0  # 发出的请求数（含失败重试，不含追问）
+    latency_ms: float = 0.0
+    error: Optional[str] = None
+    mismatch: Optional[dict] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.action is not None
+
+    def _fields(self) -> tuple:
+        return self.text, self.is_safe, self.raw, self.action
+
+    def __iter__(self):
+        return iter(self._fields())
+
+    def __getitem__(self, index):
+        return self._fields()[index]
+
+    def __len__(self) -> int:
+        return 4
 
 
 class LlmWrapper(abc.ABC):
@@ -72,7 +181,7 @@ class LlmWrapper(abc.ABC):
     def predict(
         self,
         text_prompt: str,
-    ) -> tuple[str, Optional[bool], Any]:
+    ) -> Prediction:
         """Calling multimodal LLM with a prompt and a list of images.
 
         Args:
@@ -88,13 +197,13 @@ class MultimodalLlmWrapper(abc.ABC):
 
     @abc.abstractmethod
     def predict_mm(
-        self, text_prompt: str, images: list[np.ndarray]
-    ) -> tuple[str, Optional[bool], Any]:
+        self, text_prompt: str, images: list[ImageLike]
+    ) -> Prediction:
         """Calling multimodal LLM with a prompt and a list of images.
 
         Args:
           text_prompt: Text prompt.
-          images: List of images as numpy ndarray.
+          images: List of images as PIL images or numpy ndarray.
 
         Returns:
           Text output and raw output.
@@ -113,9 +222,215 @@ SAFETY_SETTINGS_BLOCK_NONE = {
 }
 
 
+def _sse_event(line: Union[str, bytes], parts: list, on_delta: Callable[[str], None]) -> Optional[str]:
+    """处理一行 SSE；返回 finish_reason（若有）。"""
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if not data or data == "[DONE]":
+        return None
+    choices = json.loads(data).get("choices") or [{}]
+    delta = (choices[0].get("delta") or {}).get("content")
+    if delta:
+        parts.append(delta)
+        on_delta(delta)
+    return choices[0].get("finish_reason")
+
+
+def _sse_body(parts: list, finish: Optional[str]) -> dict:
+    """把流式片段拼成与非流式响应相同结构的 body。"""
+    return {"choices": [{"index": 0, "finish_reason": finish,
+                         "message": {"role": "assistant", "content": "".join(parts)}}]}
+
+
+def _collect_sse(lines, on_delta: Callable[[str], None]) -> dict:
+    parts, finish = [], None
+    for line in lines:
+        finish = _sse_event(line, parts, on_delta) or finish
+    return _sse_body(parts, finish)
+
+
+def _json_body(response: Any) -> Any:
+    """解析响应体；错误响应可能不是 JSON（如网关的 502 页面），原样返回文本。"""
+    try:
+        return response.json()
+    except ValueError:
+        if response.status_code < 400:
+            raise
+        return response.text
+
+
+def _error_message(response: Any, data: Any) -> str:
+    """服务端错误响应的说明；响应体不一定带 error 字段。"""
+    status = getattr(response, "status_code", None)
+    if isinstance(data, dict):
+        error = data.get("error")
+        if isinstance(error, dict) and error.get("message"):
+            return f"HTTP {status}: {error['message']}"
+        if isinstance(error, str):
+            return f"HTTP {status}: {error}"
+    return f"HTTP {status}: {str(data)[:200]}"
+
+
+def _action_fields(action: dict) -> dict:
+    return {k: v for k, v in action.items() if k in ACTION_KEYS}
+
+
+class _ActionCallbackError(Exception):
+    """on_action 本身出错（如设备异常）：直接抛给调用方，不当作请求失败重试。"""
+
+
+class ChatTransport:
+    """Keep-alive, pooled HTTP transport to an OpenAI-compatible chat endpoint.
+
+    One instance is thread-safe and meant to be shared by every wrapper that
+    talks to the same server, so concurrent agents reuse TCP connections
+    instead of opening one per request.  Calls go through the endpoint's
+    circuit breaker (`resilience.breaker_for`) and raise `CircuitOpenError`
+    without touching the network while it is open.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = END_POINT,
+        pool_size: int = 32,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.endpoint = endpoint
+        self.breaker = breaker or breaker_for(endpoint)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/json"
+        self._async_client = None
+
+    def post(self, payload: dict) -> tuple[requests.Response, Any]:
+        """POST `payload`; returns the response and its body parsed once."""
+        self.breaker.check()
+        with span("http_post", endpoint=self.endpoint):
+            response = self._guard(lambda: self.session.post(
+                self.endpoint,
+                data=compact_json_dumps(payload).encode("utf-8"),
+                timeout=(self.connect_timeout, self.read_timeout),
+            ))
+            return response, _json_body(response)
+
+    def _guard(self, send):
+        """Run `send()` and report the outcome to the breaker."""
+        try:
+            response = send()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()  # cancelled, e.g. the losing hedge
+            raise
+        self._record(response.status_code)
+        return response
+
+    async def _aguard(self, send):
+        try:
+            response = await send()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self._record(response.status_code)
+        return response
+
+    def _record(self, status: int) -> None:
+        if is_failure_status(status):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def post_stream(self, payload: dict, on_delta: Callable[[str], None]) -> tuple[Any, Any]:
+        """POST `payload` with `stream: true`; `on_delta` gets each piece of
+        content as it arrives.  Returns the response and a non‑streaming style
+        body (`choices[0].message.content` holds the whole answer)."""
+        self.breaker.check()
+        with span("http_post", endpoint=self.endpoint, stream=True):
+            response = self._guard(lambda: self.session.post(
+                self.endpoint,
+                data=compact_json_dumps({**payload, "stream": True}).encode("utf-8"),
+                timeout=(self.connect_timeout, self.read_timeout),
+                stream=True,
+            ))
+            with response:
+                if response.status_code >= 400:
+                    return response, _json_body(response)
+                return response, _collect_sse(response.iter_lines(), on_delta)
+
+    async def apost_stream(self, payload: dict, on_delta: Callable[[str], None]) -> tuple[Any, Any]:
+        client = self._get_async_client()
+        self.breaker.check()
+        with span("http_post", endpoint=self.endpoint, stream=True):
+            request = client.build_request(
+                "POST", self.endpoint,
+                content=compact_json_dumps({**payload, "stream": True}).encode("utf-8"),
+            )
+            response = await self._aguard(lambda: client.send(request, stream=True))
+            try:
+                if response.status_code >= 400:
+                    await response.aread()
+                    return response, _json_body(response)
+                parts, finish = [], None
+                async for line in response.aiter_lines():
+                    finish = _sse_event(line, parts, on_delta) or finish
+                return response, _sse_body(parts, finish)
+            finally:
+                await response.aclose()
+
+    def _get_async_client(self):
+        if httpx is None:
+            raise RuntimeError("Async calls require httpx: pip install httpx")
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._async_client
+
+    async def apost(self, payload: dict) -> tuple[Any, Any]:
+        client = self._get_async_client()
+        self.breaker.check()
+        with span("http_post", endpoint=self.endpoint):
+            response = await self._aguard(lambda: client.post(
+                self.endpoint, content=compact_json_dumps(payload).encode("utf-8")
+            ))
+            return response, _json_body(response)
+
+    def close(self) -> None:
+        self.session.close()
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
 class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
 
-    RETRY_WAITING_SECONDS = 20
+    # 失败重试的退避：0.2s 起指数增长、全随机抖动，最长 5s
+    RETRY_BASE_SECONDS = 0.2
+    RETRY_MAX_SECONDS = 5.0
+    # 服务熔断时，一次预测最多用这么久（从开始算起）等熔断器半开后再试
+    RETRY_BUDGET_SECONDS = 30.0
+    HISTORY_MODES = ("full", "thumbnail", "text")
 
     def __init__(
         self,
@@ -124,6 +439,20 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
         temperature: float = 0.1,
         use_history: bool = False,
         history_size: int = 10,  # 最多保留最近 history_size 轮
+        image_format: str = "JPEG",
+        image_quality: int = 85,
+        endpoint: Optional[str] = None,
+        transport: Optional[ChatTransport] = None,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        history_mode: str = "full",
+        history_thumbnail_side: int = 320,
+        history_max_bytes: Optional[int] = None,
+        max_reask: int = 2,
+        stream: bool = False,
+        thought: bool = True,
+        action_first: bool = False,
+        hedge_endpoint: Optional[str] = None,
     ):
         if max_retry <= 0:
             max_retry = 3
@@ -131,16 +460,64 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
         self.max_retry = min(max_retry, 5)
         self.temperature = temperature
         self.model = model_name
+        # 输出不合法时的追问次数上限
+        self.max_reask = max(max_reask, 0)
+        # stream: 流式接收输出，动作一旦完整即可回调 on_action，不必等整段输出结束
+        self.stream = stream
+        # action_first: 模型被约束为先输出全部动作字段、再输出 thought（如引导解码）时，
+        # 流式模式下 thought 一开始就执行动作；否则要等整个 JSON 对象结束
+        self.action_first = action_first
+        # thought=False: 不要求模型输出思考过程，输出更短
+        self.thought = thought
+        self.system_prompt = SYSTEM_PROMPT if thought else SYSTEM_PROMPT_NO_THOUGHT
 
         # ---------- 新增 ----------
         self.use_history  = use_history
         self.history_size = max(history_size, 1)
         # history 以「单条消息」为粒度： [{'role': .., 'content': ..}, ...]
         self.history: list[dict] = []
-
-    @classmethod
-    def encode_image(cls, image: np.ndarray) -> str:
-        return base64.b64encode(array_to_jpeg_bytes(image)).decode("utf-8")
+        # full: 保留原图；thumbnail: 保留缩略图；text: 只保留文字
+        if history_mode not in self.HISTORY_MODES:
+            raise ValueError(f"Unknown history_mode: {history_mode}")
+        self.history_mode = history_mode
+        self.history_thumbnail_side = history_thumbnail_side
+        # 历史消息的总字节上限（None 表示不限制）
+        self.history_max_bytes = history_max_bytes
+
+        self.image_format = image_format.upper()
+        if self.image_format not in IMAGE_MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.image_quality = image_quality
+        # 最近一次编码的截图（大小、耗时）
+        self.last_encoded: Optional[EncodedImage] = None
+
+        # 多个 wrapper 可共享同一个 transport（连接池）
+        if transport is None:
+            transport = ChatTransport(
+                endpoint or END_POINT,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+            )
+            # hedge_endpoint: 主服务慢于其近期 p95 或熔断时，同一请求发往备用服务
+            if hedge_endpoint:
+                transport = HedgedTransport(transport, ChatTransport(
+                    hedge_endpoint,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                ))
+        self.transport = transport
+        self.backoff = Backoff(self.RETRY_BASE_SECONDS, self.RETRY_MAX_SECONDS)
+        self.retry_budget = self.RETRY_BUDGET_SECONDS
+        # 最近一次失败的原因，失败结果的 error 字段
+        self.last_error: Optional[str] = None
+
+    def encode_image(self, image: Union[ImageLike, EncodedImage]) -> EncodedImage:
+        """编码截图；已编码的 EncodedImage 原样返回（供流水线提前编码）。"""
+        if not isinstance(image, EncodedImage):
+            with span("encode_image", format=self.image_format):
+                image = encode_image_bytes(image, self.image_format, self.image_quality)
+        self.last_encoded = image
+        return image
 
     def _push_history(self, role: str, content: Any):
         """把一条消息写入历史，并自动裁剪长度。"""
@@ -151,6 +528,51 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
         max_msgs = self.history_size * 2
         if len(self.history) > max_msgs:
             self.history = self.history[-max_msgs:]
+        if self.history_max_bytes is not None:
+            # 超出字节上限时按轮（两条消息）丢弃最早的历史
+            while len(self.history) > 2 and self.history_bytes() > self.history_max_bytes:
+                del self.history[:2]
+
+    @staticmethod
+    def _message_bytes(content: Any) -> int:
+        if isinstance(content, str):
+            return len(content)
+        total = 0
+        for part in content:
+            if part.get("type") == "image_url":
+                total += len(part["image_url"]["url"])
+            else:
+                total += len(part.get("text", ""))
+        return total
+
+    def history_bytes(self) -> int:
+        """历史消息中文本与 base64 图片的大致字节数。"""
+        return sum(self._message_bytes(m["content"]) for m in self.history)
+
+    def _history_user_content(
+        self,
+        question: str,
+        image: Optional[Union[ImageLike, EncodedImage]],
+        image_url: Optional[str],
+    ) -> list:
+        """按 history_mode 生成写入历史的 user 消息（每帧只编码一次）。"""
+        if self.history_mode == "text" or image is None:
+            return [{"type": "text", "text": question}]
+        if self.history_mode == "thumbnail":
+            if isinstance(image, EncodedImage):
+                image = image.source or Image.open(io.BytesIO(image.data))
+            if isinstance(image, np.ndarray):
+                image = Image.fromarray(image)
+            thumb = image.copy()
+            side = self.history_thumbnail_side
+            thumb.thumbnail((side, side), Image.Resampling.BILINEAR)
+            image_url = encode_image_bytes(
+                thumb, self.image_format, self.image_quality
+            ).to_data_url()
+        return [
+            {"type": "text", "text": f"{question}\n当前屏幕截图：(<image>./</image>)"},
+            {"type": "image_url", "image_url": {"url": image_url}},
+        ]
 
     def clear_history(self):
         """外部可手动清空记忆。"""
@@ -158,33 +580,48 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
 
 
     def extract_and_validate_json(self, input_string):
-        try:
-            json_obj = json.loads(input_string)
-            validator.validate(json_obj, EXTRACT_SCHEMA)
-            return json_obj
-        except json.JSONDecodeError as e:
-            print("Error, JSON is NOT valid.")
-            return input_string
-        except Exception as e:
-            print(f"Error, JSON is NOT valid according to the schema.{input_string}", e)
-            return input_string
+        with span("validate_json"):
+            return self._extract_and_validate_json(input_string)
+
+    def _extract_and_validate_json(self, input_string):
+        """提取并校验操作 JSON（允许前后夹杂文字）；不合法时抛出 ActionValidationError。"""
+        return parse_action(input_string, check_action)
+
+    @staticmethod
+    def _reask_payload(payload: dict, error: ActionValidationError) -> dict:
+        """在原请求后追加模型的错误输出和一条纠正提示。"""
+        messages = payload["messages"] + [
+            {"role": "assistant", "content": error.raw},
+            {"role": "user", "content": [
+                {"type": "text", "text": REASK_PROMPT.format(reason=error.reason)}
+            ]},
+        ]
+        return {**payload, "messages": messages}
 
     def predict(
         self,
         text_prompt: str,
-    ) -> tuple[str, Optional[bool], Any]:
+    ) -> Prediction:
         return self.predict_mm(text_prompt, [])
 
-    def predict_mm(
-        self, text_prompt: str, images: list[np.ndarray]
-    ) -> tuple[str, Optional[bool], Any]:
-        assert len(images) == 1
+    def _build_request(
+        self,
+        text_prompt: str,
+        images: list[Union[ImageLike, EncodedImage]],
+        elements: Optional[str] = None,
+    ) -> tuple[dict, list]:
+        """构造请求体，并返回写入历史用的 user 消息。
+
+        elements 为界面可交互元素列表（ui_tree.format_elements 的输出），
+        可与截图同时发送，也可代替截图（images 为空）。
+        """
+        assert len(images) <= 1
 
         # -------- 构造 messages --------
         messages: list[dict] = [
             {
                 "role": "system",
-                "content": [{"type": "text", "text": SYSTEM_PROMPT}],
+                "content": [{"type": "text", "text": self.system_prompt}],
             }
         ]
 
@@ -193,18 +630,17 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
             messages.extend(self.history)
 
         # 2) 当前 user 消息
-        user_content = [
-            {
-                "type": "text",
-                "text": f"<Question>{text_prompt}</Question>\n当前屏幕截图：(<image>./</image>)",
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{self.encode_image(images[0])}"
-                },
-            },
-        ]
+        question = f"<Question>{text_prompt}</Question>"
+        text = question
+        if elements is not None:
+            text += f"\n当前界面可交互元素（编号 类型 \"文本\" #id [x1,y1,x2,y2] @[中心点] 属性，坐标已缩放到0～1000）：\n{elements}"
+        image_url = None
+        if images:
+            image_url = self.encode_image(images[0]).to_data_url()
+            text += "\n当前屏幕截图：(<image>./</image>)"
+        user_content = [{"type": "text", "text": text}]
+        if image_url is not None:
+            user_content.append({"type": "image_url", "image_url": {"url": image_url}})
         messages.append({"role": "user", "content": user_content})
 
         payload = {
@@ -213,41 +649,246 @@ class MiniCPMWrapper(LlmWrapper, MultimodalLlmWrapper):
             "messages": messages,
             "max_tokens": 2048,
         }
+        history_content = None
+        if self.use_history:
+            history_content = self._history_user_content(
+                question, images[0] if images else None, image_url
+            )
+        return payload, history_content
+
+    def _handle_response(self, response: Any, data: Any, history_content: Any,
+                         dispatched: Optional[dict] = None) -> Optional[Prediction]:
+        """解析一次响应体；成功返回 Prediction，服务端出错返回 None。
+
+        输出不是合法操作时抛出 ActionValidationError，且不写入历史。
+        dispatched 为流式输出中途已交给 on_action 的动作，与完整输出对账后作为结果。
+        """
+        mismatch = None
+        if dispatched is not None or (
+            response.status_code < 400 and isinstance(data, dict) and "choices" in data
+        ):
+            assistant_msg = data["choices"][0]["message"]
+            assistant_text = assistant_msg["content"]
+            if dispatched is not None:
+                action, mismatch = self._reconcile(dispatched, assistant_text)
+            else:
+                action = self.extract_and_validate_json(assistant_text)
+
+            # -------- 写回历史 --------
+            self._push_history("user",  history_content)
+            self._push_history("assistant", assistant_msg["content"])
+
+            return Prediction(assistant_text, None, response, action,
+                              endpoint=self.transport.endpoint, mismatch=mismatch)
+        self.last_error = _error_message(response, data)
+        print("Error calling OpenAI API with error message: " + self.last_error)
+        return None
+
+    def _reconcile(self, dispatched: dict, text: str) -> tuple[dict, Optional[dict]]:
+        """用完整输出核对提前执行的动作，返回 (动作, 不一致时完整输出的解析结果)。
+
+        返回的动作总是与已执行的一致：两者一致时取完整输出（带 thought 等字段），
+        不一致或完整输出解析不了（如流在动作执行后中断）时沿用已执行的动作。
+        """
+        try:
+            action = self.extract_and_validate_json(text)
+        except ActionValidationError:
+            return dispatched, None
+        if _action_fields(action) != _action_fields(dispatched):
+            logger.warning("Dispatched action %s differs from the full answer %s",
+                           dispatched, action)
+            return dispatched, action
+        return action, None
+
+    def _request(self, payload: dict, on_action: Optional[Callable[[dict], Any]]):
+        """发送一次请求，返回 (response, body, 已提前执行的动作)。"""
+        if not self.stream:
+            return (*self.transport.post(payload), None)
+        parser = ActionStreamParser(check_action, self.action_first)
+
+        def on_delta(delta: str) -> None:
+            action = parser.feed(delta)
+            if action is not None and on_action is not None:
+                try:
+                    on_action(action)
+                except Exception as e:
+                    raise _ActionCallbackError() from e
 
-        headers = {
-            "Content-Type": "application/json",
-        }
+        try:
+            response, data = self.transport.post_stream(payload, on_delta)
+        except _ActionCallbackError:
+            raise
+        except Exception:
+            if parser.action is None:
+                raise
+            # 动作已经执行，不能再重试；以已收到的内容作为结果
+            print("流式输出在动作执行后中断，使用已收到的内容")
+            response, data = None, _sse_body([parser.text], None)
+        return response, data, parser.action
+
+    async def _arequest(self, payload: dict, on_action: Optional[Callable[[dict], Any]]):
+        """_request 的异步版本；on_action 返回协程时与剩余输出并发执行。"""
+        if not self.stream:
+            return (*await self.transport.apost(payload), None)
+        parser = ActionStreamParser(check_action, self.action_first)
+        pending = []
+
+        def on_delta(delta: str) -> None:
+            action = parser.feed(delta)
+            if action is not None and on_action is not None:
+                try:
+                    result = on_action(action)
+                except Exception as e:
+                    raise _ActionCallbackError() from e
+                if inspect.isawaitable(result):
+                    pending.append(asyncio.ensure_future(result))
 
-        counter = self.max_retry
-        wait_seconds = self.RETRY_WAITING_SECONDS
-        while counter > 0:
+        try:
+            response, data = await self.transport.apost_stream(payload, on_delta)
+        except _ActionCallbackError:
+            raise
+        except Exception:
+            if parser.action is None:
+                raise
+            print("流式输出在动作执行后中断，使用已收到的内容")
+            response, data = None, _sse_body([parser.text], None)
+        finally:
+            for task in pending:
+                try:
+                    await task
+                except Exception as e:
+                    raise _ActionCallbackError() from e
+        return response, data, parser.action
+
+    @staticmethod
+    def _finish(result: Prediction, attempts: int, start: float) -> Prediction:
+        result.attempts = attempts
+        result.latency_ms = (time.perf_counter() - start) * 1000
+        return result
+
+    def _invalid(self, error: ActionValidationError, response: Any, attempts: int,
+                 start: float) -> Prediction:
+        """追问次数用完仍不合法：返回失败结果（text 为模型原文），不抛异常。"""
+        print(f"模型输出不合法（{error.reason}），追问次数已用完")
+        return Prediction(error.raw or ERROR_CALLING_LLM, None, response, None,
+                          endpoint=self.transport.endpoint, attempts=attempts,
+                          latency_ms=(time.perf_counter() - start) * 1000,
+                          error=f"invalid output: {error.reason}")
+
+    def _can_wait(self, error: CircuitOpenError, start: float) -> bool:
+        """熔断器半开前的等待是否还在本次预测的预算内。"""
+        return time.perf_counter() - start + error.retry_after <= self.retry_budget
+
+    def _failed(self, attempts: int, start: float) -> Prediction:
+        return Prediction(ERROR_CALLING_LLM, None, None, None, endpoint=self.transport.endpoint,
+                          attempts=attempts, latency_ms=(time.perf_counter() - start) * 1000,
+                          error=self.last_error or ERROR_CALLING_LLM)
+
+    def predict_mm(
+        self,
+        text_prompt: str,
+        images: list[Union[ImageLike, EncodedImage]],
+        elements: Optional[str] = None,
+        on_action: Optional[Callable[[dict], Any]] = None,
+    ) -> Prediction:
+        """预测下一步操作。
+
+        流式模式下，动作一旦完整就调用 on_action(action)（每次预测最多一次），
+        调用方可以在输出结束前开始执行动作；返回值中的动作就是已执行的动作，
+        与完整输出不一致时完整输出的解析结果记在 mismatch 中。
+        请求失败或追问后输出仍不合法时不抛异常，返回 ok 为 False 的 Prediction。
+        """
+        payload, history_content = self._build_request(text_prompt, images, elements)
+
+        request = payload
+        reasks = self.max_reask
+        attempts = 0
+        response = None
+        start = time.perf_counter()
+        while attempts < self.max_retry:
+            attempts += 1
             try:
-                response = requests.post(
-                    END_POINT,
-                    headers=headers,
-                    json=payload,
-                )
-                if response.ok and "choices" in response.json():
-                    assistant_msg = response.json()["choices"][0]["message"]
-                    assistant_text = assistant_msg["content"]
-                    action = self.extract_and_validate_json(assistant_text)
-
-                    # -------- 写回历史 --------
-                    self._push_history("user",  user_content)
-                    self._push_history("assistant", assistant_msg["content"])
-
-                    return assistant_text, None, response, action
-                print(
-                    "Error calling OpenAI API with error message: "
-                    + response.json()["error"]["message"]
-                )
-                time.sleep(wait_seconds)
-                wait_seconds *= 2
+                response, data, dispatched = self._request(payload, on_action)
+                result = self._handle_response(response, data, history_content, dispatched)
+                if result is not None:
+                    return self._finish(result, attempts, start)
+            except ActionValidationError as e:
+                if reasks <= 0:
+                    return self._invalid(e, response, attempts, start)
+                reasks -= 1
+                attempts -= 1  # 追问不算失败重试
+                print(f"模型输出不合法（{e.reason}），立即追问")
+                payload = self._reask_payload(request, e)
+                continue
+            except _ActionCallbackError as e:
+                raise e.__cause__ from None
+            except CircuitOpenError as e:
+                # 服务已熔断：预算内等到熔断器半开再试，等不到就直接返回失败
+                self.last_error = str(e)
+                attempts -= 1  # 没有发出请求
+                if not self._can_wait(e, start):
+                    print(e)
+                    break
+                print(f"{e}，{e.retry_after:.1f}s 后重试")
+                time.sleep(e.retry_after)
+                continue
             except Exception as e:  # pylint: disable=broad-exception-caught
                 # Want to catch all exceptions happened during LLM calls.
-                time.sleep(wait_seconds)
-                wait_seconds *= 2
-                counter -= 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                print("Error calling LLM, will retry soon...")
+                print(e)
+            if attempts < self.max_retry:
+                time.sleep(self.backoff.delay(attempts - 1))
+        return self._failed(attempts, start)
+
+    async def apredict_mm(
+        self,
+        text_prompt: str,
+        images: list[Union[ImageLike, EncodedImage]],
+        elements: Optional[str] = None,
+        on_action: Optional[Callable[[dict], Any]] = None,
+    ) -> Prediction:
+        """predict_mm 的异步版本，通过共享的 httpx 连接池发送请求。
+
+        on_action 可以是协程函数：动作在输出结束前开始执行，返回前等待其完成。
+        """
+        payload, history_content = self._build_request(text_prompt, images, elements)
+
+        request = payload
+        reasks = self.max_reask
+        attempts = 0
+        response = None
+        start = time.perf_counter()
+        while attempts < self.max_retry:
+            attempts += 1
+            try:
+                response, data, dispatched = await self._arequest(payload, on_action)
+                result = self._handle_response(response, data, history_content, dispatched)
+                if result is not None:
+                    return self._finish(result, attempts, start)
+            except ActionValidationError as e:
+                if reasks <= 0:
+                    return self._invalid(e, response, attempts, start)
+                reasks -= 1
+                attempts -= 1
+                print(f"模型输出不合法（{e.reason}），立即追问")
+                payload = self._reask_payload(request, e)
+                continue
+            except _ActionCallbackError as e:
+                raise e.__cause__ from None
+            except CircuitOpenError as e:
+                self.last_error = str(e)
+                attempts -= 1
+                if not self._can_wait(e, start):
+                    print(e)
+                    break
+                print(f"{e}，{e.retry_after:.1f}s 后重试")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.last_error = f"{type(e).__name__}: {e}"
                 print("Error calling LLM, will retry soon...")
                 print(e)
-        return ERROR_CALLING_LLM, None, None
+            if attempts < self.max_retry:
+                await asyncio.sleep(self.backoff.delay(attempts - 1))
+        return self._failed(attempts, start)
@@ -0,0 +1,187 @@
+"""Request batching in front of a `ChatTransport`.
+
+    transport = BatchingTransport(ChatTransport(endpoint), window=0.01, max_concurrency=8)
+    agents = [MiniCPMWrapper(model, transport=transport) for _ in range(n)]
+    ...
+    print(transport.stats.summary())
+
+Concurrent `post` / `apost` calls are held for up to `window` seconds (or
+until `max_batch` callers are waiting) and then released together, with at
+most `max_concurrency` requests in flight, so the inference server admits a
+burst of agents into the same scheduling step instead of one by one as each
+finishes its adb work.  OpenAI‑compatible servers (vLLM, SGLang, ...) expose
+no batched chat endpoint and batch concurrent requests themselves, so a
+batch goes out as concurrent requests over the shared connection pool.  Each
+caller gets its own response (or exception) back.
+
+`stats` records batch sizes and the queue delay of every request (time from
+the call to the request leaving, including the wait for a free slot).
+"""
+import asyncio
+import collections
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from tracing import Histogram
+
+
+class BatchStats:
+    """Batch‑size distribution and queue‑delay histogram; thread‑safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.sizes: collections.Counter = collections.Counter()
+        self.queue_delay = Histogram()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _batch(self, size: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.requests += size
+            self.sizes[size] += 1
+
+    def _start(self, queued_at: float) -> None:
+        with self._lock:
+            self.queue_delay.add((time.monotonic() - queued_at) * 1000)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "max_batch_size": max(self.sizes, default=0),
+                "batch_sizes": dict(sorted(self.sizes.items())),
+                "max_in_flight": self.max_in_flight,
+                "queue_delay": self.queue_delay.as_dict(),
+            }
+
+    def summary(self) -> str:
+        s = self.as_dict()
+        d = s["queue_delay"]
+        return (f"{s['requests']} requests in {s['batches']} batches "
+                f"(mean size {s['mean_batch_size']:.2f}, max {s['max_batch_size']}, "
+                f"max in flight {s['max_in_flight']}); queue delay mean {d['mean_ms']:.1f} ms "
+                f"p50 {d['p50_ms']:.1f} ms p95 {d['p95_ms']:.1f} ms")
+
+
+class _Batch:
+    __slots__ = ("opened", "size", "released")
+
+    def __init__(self, released):
+        self.opened = time.monotonic()
+        self.size = 0
+        self.released = released
+
+
+class BatchingTransport:
+    """Drop‑in for `ChatTransport` (`post`, `apost`, their `_stream` variants,
+    `close`, `aclose`).
+
+    `window=0` disables the hold and only keeps the concurrency limit.  The
+    limit applies separately to blocking and asyncio callers.
+    """
+
+    def __init__(self, transport, window: float = 0.01, max_batch: int = 16,
+                 max_concurrency: int = 8):
+        if max_batch < 1 or max_concurrency < 1:
+            raise ValueError("max_batch and max_concurrency must be positive")
+        self.transport = transport
+        self.window = window
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.stats = BatchStats()
+        self._lock = threading.Lock()
+        self._batch: Optional[_Batch] = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._abatch: Optional[_Batch] = None
+        self._aslots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def endpoint(self) -> str:
+        return self.transport.endpoint
+
+    def _release(self, batch: _Batch) -> None:
+        # caller holds the lock (sync) or runs on the loop (async)
+        if batch.released.is_set():
+            return
+        if batch is self._batch:
+            self._batch = None
+        elif batch is self._abatch:
+            self._abatch = None
+        self.stats._batch(batch.size)
+        batch.released.set()
+
+    # ---------- blocking ----------
+    def _wait_turn(self) -> None:
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch(threading.Event())
+            batch.size += 1
+            if batch.size >= self.max_batch or self.window <= 0:
+                self._release(batch)
+        if not batch.released.wait(max(0.0, batch.opened + self.window - time.monotonic())):
+            with self._lock:
+                self._release(batch)
+
+    def _submit(self, send, *args):
+        queued_at = time.monotonic()
+        self._wait_turn()
+        with self._slots:
+            self.stats._start(queued_at)
+            try:
+                return send(*args)
+            finally:
+                self.stats._done()
+
+    def post(self, payload: dict):
+        return self._submit(self.transport.post, payload)
+
+    def post_stream(self, payload: dict, on_delta):
+        return self._submit(self.transport.post_stream, payload, on_delta)
+
+    # ---------- asyncio ----------
+    async def _await_turn(self) -> None:
+        batch = self._abatch
+        if batch is None:
+            batch = self._abatch = _Batch(asyncio.Event())
+            asyncio.get_running_loop().call_later(self.window, self._release, batch)
+        batch.size += 1
+        if batch.size >= self.max_batch or self.window <= 0:
+            self._release(batch)
+        await batch.released.wait()
+
+    async def _asubmit(self, send, *args):
+        queued_at = time.monotonic()
+        if self._aslots is None:
+            self._aslots = asyncio.Semaphore(self.max_concurrency)
+        await self._await_turn()
+        async with self._aslots:
+            self.stats._start(queued_at)
+            try:
+                return await send(*args)
+            finally:
+                self.stats._done()
+
+    async def apost(self, payload: dict):
+        return await self._asubmit(self.transport.apost, payload)
+
+    async def apost_stream(self, payload: dict, on_delta):
+        return await self._asubmit(self.transport.apost_stream, payload, on_delta)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
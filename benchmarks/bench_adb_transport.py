@@ -0,0 +1,107 @@
+"""Per‑action latency: one adb process per call vs. the persistent shell vs.
+the in‑process socket client.
+
+    python benchmarks/bench_adb_transport.py [--n 200]
+
+Runs against `fake_adb.py` and `fake_adb_server.py`, so the numbers are
+transport overhead only; a real `adb` client adds its server handshake to
+every subprocess call.  Before timing, the socket client is checked against
+the fake server (exit status, exec‑out bytes, push, pooling); a failed check
+exits with status 1.
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_adb import ROOT, use_fake_adb
+from fake_adb_server import FakeAdbServer
+
+use_fake_adb()
+from adb_client import AdbClient, AdbServerError  # noqa: E402
+from adb_utils import AndroidDevice, _decode_raw_screencap  # noqa: E402
+
+
+def _check_client(client: AdbClient) -> list[str]:
+    """Protocol smoke checks; returns the failures."""
+    failures = []
+
+    def expect(ok: bool, what: str) -> None:
+        if not ok:
+            failures.append(what)
+
+    expect(client.serials() == ["fake-0"], "host:devices lists fake-0")
+    expect(client.shell("fake-0", "echo hi") == b"hi\n", "pooled shell output")
+    try:
+        client.shell("fake-0", "echo oops; (exit 3)")
+        expect(False, "non-zero exit raises CalledProcessError")
+    except subprocess.CalledProcessError as exc:
+        expect(exc.returncode == 3 and exc.output == b"oops\n", "exit status and output kept")
+    expect(client.shell("fake-0", "echo once", pooled=False) == b"once\n", "unpooled shell")
+    expect(client.shell_once("fake-0", "echo legacy") == b"legacy\n", "legacy shell: service")
+    frame = _decode_raw_screencap(client.exec_out("fake-0", "screencap"))
+    expect(frame.size[0] > 0, "exec:screencap decodes as a raw frame")
+    try:
+        client.shell("nope", "true")
+        expect(False, "unknown serial fails")
+    except AdbServerError:
+        pass
+
+    payload = os.urandom(200_000)
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(payload)
+    try:
+        client.push("fake-0", f.name, "/data/local/tmp/bench-push.bin", mode=0o600)
+    finally:
+        os.unlink(f.name)
+    remote = client.shell("fake-0", "md5sum /data/local/tmp/bench-push.bin").split()[:1]
+    expect(remote == [hashlib.md5(payload).hexdigest().encode()], "sync push round trip")
+    expect(os.stat(ROOT + "/data/local/tmp/bench-push.bin").st_mode & 0o777 == 0o600,
+           "push keeps the mode")
+    expect(len(client._idle.get("fake-0", [])) == 1, "one pooled stream reused")
+    return failures
+
+
+def _bench(device: AndroidDevice, n: int) -> list[float]:
+    device.refresh_resolution()
+    samples = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        device.step({"POINT": [i % 1000, 500]})
+        samples.append((time.perf_counter() - t0) * 1000)
+    device.close()
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200)
+    args = parser.parse_args()
+    with FakeAdbServer() as server:
+        client = AdbClient(port=server.port)
+        failures = _check_client(client)
+        for what in failures:
+            print(f"FAILED: {what}")
+        if failures:
+            sys.exit(1)
+        print(f"socket client checks passed ({server.requests} server requests)")
+
+        runs = (
+            ("subprocess", dict(use_shell_session=False, transport="binary")),
+            ("shell session", dict(transport="binary")),
+            ("socket", dict(use_shell_session=False, transport="socket", client=client)),
+            ("socket pooled", dict(transport="socket", client=client)),
+        )
+        for name, kwargs in runs:
+            ms = sorted(_bench(AndroidDevice("fake-0", **kwargs), args.n))
+            print(f"{name:<14} mean {statistics.mean(ms):7.2f} ms  "
+                  f"p50 {ms[len(ms) // 2]:7.2f} ms  p95 {ms[int(len(ms) * 0.95)]:7.2f} ms")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""End‑to‑end agent loop overhead against a fake device and a stub model.
+
+    python benchmarks/bench_agent_loop.py [--steps 20] [--tasks 5]
+        [--observation screenshot|hybrid|elements] [--trajectory run.traj]
+        [--latency 0] [--output result.json] [--baseline old.json --tolerance 0.2]
+
+Runs `run_agent.run_steps` on `FakeAndroidDevice` (frames from
+`screencap.png` or a recorded trajectory) with `StubChatServer` answering
+canned actions, so what is measured is the loop's own cost: encode, HTTP,
+validation, action compilation.  Per‑span timings come from `tracing`.
+With `--baseline`, exits non‑zero when the mean step overhead regressed by
+more than `--tolerance` (fraction).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from fake_device import FakeAndroidDevice  # noqa: E402
+from stub_server import DEFAULT_ACTIONS, StubChatServer, load_actions  # noqa: E402
+
+import tracing  # noqa: E402
+from agent_wrapper import MiniCPMWrapper  # noqa: E402
+from run_agent import run_steps  # noqa: E402
+
+FAKE_UI_XML = os.path.join(ROOT, "fakebin", "uiautomator")
+
+
+def _ui_xml() -> bytes:
+    # reuse the synthetic hierarchy embedded in the fake uiautomator script
+    with open(FAKE_UI_XML, "rb") as f:
+        script = f.read()
+    return script[script.index(b"<?xml"):script.index(b"</hierarchy>") + len(b"</hierarchy>")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20, help="steps per task")
+    parser.add_argument("--tasks", type=int, default=5)
+    parser.add_argument("--observation", default="screenshot",
+                        choices=("screenshot", "hybrid", "elements"))
+    parser.add_argument("--image", default=os.path.join(os.path.dirname(ROOT), "screencap.png"))
+    parser.add_argument("--trajectory", help="drive frames and canned actions from a .traj")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub model latency, seconds")
+    parser.add_argument("--stream", action="store_true", help="stream answers, dispatch early")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.getLogger("run_agent").setLevel(logging.WARNING)
+
+    if args.trajectory:
+        actions = load_actions(args.trajectory)
+        make_device = lambda: FakeAndroidDevice.from_trajectory(args.trajectory, ui_xml=_ui_xml())  # noqa: E731
+    else:
+        actions = DEFAULT_ACTIONS
+        make_device = lambda: FakeAndroidDevice.from_images([args.image], ui_xml=_ui_xml())  # noqa: E731
+    # the loop length is set by --steps, not by a canned finish
+    actions = [a for a in actions if "STATUS" not in a] or DEFAULT_ACTIONS[:-1]
+
+    tracing.enable()
+    step_ms = []
+    with StubChatServer(actions, latency=args.latency) as server:
+        minicpm = MiniCPMWrapper(model_name="stub", use_history=True, history_size=2,
+                                 endpoint=server.endpoint, stream=args.stream)
+        # warm up connections, codecs and caches outside the measurement
+        run_steps(make_device(), minicpm, "benchmark", max_steps=2, observation=args.observation)
+        tracing.TRACER.reset()
+        request_bytes = server.request_bytes
+        for _ in range(args.tasks):
+            minicpm.clear_history()
+            device = make_device()
+            t0 = time.perf_counter()
+            _, steps = run_steps(device, minicpm, "benchmark", max_steps=args.steps,
+                                 observation=args.observation)
+            step_ms.append((time.perf_counter() - t0) * 1000 / steps - args.latency * 1000)
+        request_bytes = (server.request_bytes - request_bytes) / max(server.requests - 2, 1)
+        minicpm.transport.close()
+
+    result = {
+        "observation": args.observation,
+        "steps": args.steps,
+        "tasks": args.tasks,
+        "latency_s": args.latency,
+        "python": platform.python_version(),
+        "step_overhead_ms": {"mean": statistics.mean(step_ms), "min": min(step_ms),
+                             "max": max(step_ms)},
+        "request_bytes": request_bytes,
+        "spans": tracing.TRACER.stats(),
+    }
+    print(f"{args.observation}: step overhead mean {result['step_overhead_ms']['mean']:.2f} ms "
+          f"(min {min(step_ms):.2f}, max {max(step_ms):.2f}), {request_bytes / 1024:.1f} KiB/request")
+    print(tracing.TRACER.summary())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)["step_overhead_ms"]["mean"]
+        now = result["step_overhead_ms"]["mean"]
+        change = (now - base) / base
+        print(f"vs baseline {base:.2f} ms: {change:+.1%}")
+        if change > args.tolerance:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Concurrent agents through `BatchingTransport` vs. the plain pooled transport.
+
+    python benchmarks/bench_batching.py [--agents 16] [--calls 10] [--window 10]
+                                        [--latency 0.05] [--concurrency 8] [--async]
+
+Each agent is a `MiniCPMWrapper` with its own model name, looping
+`predict_mm` with a random pause (its "adb work") between calls against the
+stub server.  Reports per‑call latency, batch sizes and queue delay, and
+checks that every caller got the response to its own request (the stub
+echoes the model name); a mix‑up exits with status 1.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+from stub_server import StubChatServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_wrapper import ChatTransport, MiniCPMWrapper  # noqa: E402
+from batching import BatchingTransport  # noqa: E402
+
+ACTIONS = [{"thought": "点击", "POINT": [500, 500]}]
+
+
+def _run_threads(transport, agents: int, calls: int, pause: float) -> tuple[list, int]:
+    latencies, mixups, lock = [], [0], threading.Lock()
+
+    def agent(i: int) -> None:
+        rng = random.Random(i)
+        wrapper = MiniCPMWrapper(f"agent-{i}", transport=transport)
+        for _ in range(calls):
+            time.sleep(rng.uniform(0, pause))
+            t0 = time.perf_counter()
+            _, _, response, _ = wrapper.predict_mm("q", [])
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencies.append(ms)
+                mixups[0] += response.json()["model"] != wrapper.model
+
+    threads = [threading.Thread(target=agent, args=(i,)) for i in range(agents)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, mixups[0]
+
+
+async def _run_async(transport, agents: int, calls: int, pause: float) -> tuple[list, int]:
+    latencies, mixups = [], 0
+
+    async def agent(i: int) -> None:
+        nonlocal mixups
+        rng = random.Random(i)
+        wrapper = MiniCPMWrapper(f"agent-{i}", transport=transport)
+        for _ in range(calls):
+            await asyncio.sleep(rng.uniform(0, pause))
+            t0 = time.perf_counter()
+            _, _, response, _ = await wrapper.apredict_mm("q", [])
+            latencies.append((time.perf_counter() - t0) * 1000)
+            mixups += response.json()["model"] != wrapper.model
+
+    await asyncio.gather(*(agent(i) for i in range(agents)))
+    await transport.aclose()
+    return latencies, mixups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--window", type=float, default=10.0, help="batch window, ms")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency, s")
+    parser.add_argument("--pause", type=float, default=0.1, help="max agent pause, s")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    args = parser.parse_args()
+
+    failed = False
+    with StubChatServer(ACTIONS, latency=args.latency) as server:
+        for name in ("direct", "batched"):
+            transport = ChatTransport(server.endpoint, pool_size=args.agents)
+            if name == "batched":
+                transport = BatchingTransport(transport, window=args.window / 1000,
+                                              max_batch=args.agents,
+                                              max_concurrency=args.concurrency)
+            start = time.perf_counter()
+            if args.use_async:
+                ms, mixups = asyncio.run(_run_async(transport, args.agents, args.calls,
+                                                    args.pause))
+            else:
+                ms, mixups = _run_threads(transport, args.agents, args.calls, args.pause)
+            wall = time.perf_counter() - start
+            transport.close()
+            ms.sort()
+            print(f"{name:<8} {len(ms)} calls in {wall:5.2f}s  mean {statistics.mean(ms):7.1f} ms"
+                  f"  p50 {ms[len(ms) // 2]:7.1f} ms  p95 {ms[int(len(ms) * 0.95)]:7.1f} ms"
+                  f"  mix-ups {mixups}")
+            if isinstance(transport, BatchingTransport):
+                print(f"         {transport.stats.summary()}")
+                print(f"         batch sizes {transport.stats.as_dict()['batch_sizes']}")
+            failed |= mixups > 0
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
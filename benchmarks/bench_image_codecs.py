@@ -0,0 +1,45 @@
+"""Payload size and encode time per codec over the bundled `screencap.png`.
+
+    python benchmarks/bench_image_codecs.py [--max-side 1120] [--repeat 10]
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from adb_utils import _resize_pillow  # noqa: E402
+from agent_wrapper import encode_image_bytes  # noqa: E402
+
+CODECS = [("PNG", 0)] + [("JPEG", q) for q in (60, 75, 85, 95)] + [("WEBP", q) for q in (60, 75, 85)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", default=os.path.join(ROOT, "screencap.png"))
+    parser.add_argument("--max-side", type=int, default=1120)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    img = Image.open(args.image)
+    img.load()
+    if args.max_side:
+        img = _resize_pillow(img, args.max_side)
+    print(f"input {img.size[0]}x{img.size[1]} {img.mode}")
+    print(f"{'codec':<10}{'bytes':>10}{'base64':>10}{'encode ms':>12}")
+    for fmt, quality in CODECS:
+        runs = [encode_image_bytes(img, fmt, quality) for _ in range(args.repeat)]
+        size = runs[0].size
+        b64 = len(base64.b64encode(runs[0].data))
+        ms = statistics.median(r.encode_ms for r in runs)
+        label = fmt if fmt == "PNG" else f"{fmt}/{quality}"
+        print(f"{label:<10}{size:>10}{b64:>10}{ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
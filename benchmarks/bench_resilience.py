@@ -0,0 +1,138 @@
+"""Cost of failures: a transient 500, a dead server, a slow tail.
+
+    python benchmarks/bench_resilience.py [--n 300] [--latency 0.02] [--slow-every 50]
+
+* transient 500 – the first request fails, the retry succeeds; reports what
+  the failure added to `predict_mm` (it used to sleep 20 s before retrying).
+* server down – repeated `predict_mm` calls to a closed port, with no budget
+  for waiting out the breaker; once the endpoint's breaker opens, calls fail
+  fast with an error `Prediction`.
+* slow tail – every `--slow-every`‑th request of the primary stub takes
+  `--slow-latency` longer; p50 / p99 with and without a second endpoint to
+  hedge to.
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import time
+
+from stub_server import StubChatServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_wrapper import ERROR_CALLING_LLM, ChatTransport, MiniCPMWrapper  # noqa: E402
+from resilience import HedgedTransport, breaker_for  # noqa: E402
+
+ACTIONS = [{"thought": "点击", "POINT": [500, 500]}]
+
+
+def _ms(samples: list) -> str:
+    ordered = sorted(samples)
+    return (f"p50 {ordered[len(ordered) // 2]:7.1f} ms  "
+            f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]:7.1f} ms")
+
+
+def _timed_call(endpoint: str) -> tuple[float, object]:
+    wrapper = MiniCPMWrapper("bench", endpoint=endpoint)
+    t0 = time.perf_counter()
+    result = wrapper.predict_mm("q", [])
+    took = (time.perf_counter() - t0) * 1000
+    wrapper.transport.close()
+    return took, result
+
+
+def _transient(latency: float, trials: int) -> list[str]:
+    failures, extra = [], []
+    for _ in range(trials):
+        with StubChatServer(ACTIONS, latency=latency) as clean, \
+                StubChatServer(ACTIONS, latency=latency, fail_first=1) as flaky:
+            base, _ = _timed_call(clean.endpoint)
+            took, result = _timed_call(flaky.endpoint)
+        if not result.ok or result.attempts != 2:
+            failures.append(f"transient 500 not retried once: {result.error}")
+        extra.append(took - base)
+    mean = statistics.mean(extra)
+    print(f"transient 500   retry adds mean {mean:6.1f} ms, max {max(extra):6.1f} ms "
+          f"(fixed 20 s sleep before)")
+    if mean > MiniCPMWrapper.RETRY_BASE_SECONDS * 1000 + 50:
+        failures.append(f"transient 500 costs {mean:.0f} ms")
+    return failures
+
+
+def _down(calls: int) -> list[str]:
+    with socket.socket() as s:  # a port nobody listens on
+        s.bind(("127.0.0.1", 0))
+        endpoint = f"http://127.0.0.1:{s.getsockname()[1]}/v1/chat/completions"
+    wrapper = MiniCPMWrapper("bench", endpoint=endpoint)
+    wrapper.retry_budget = 0
+    breaker = breaker_for(endpoint)
+    failures, took = [], []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        result = wrapper.predict_mm("q", [])
+        took.append((time.perf_counter() - t0) * 1000)
+        if result.ok or result.text != ERROR_CALLING_LLM:
+            failures.append("call to a dead server succeeded")
+    wrapper.transport.close()
+    print(f"server down     calls {', '.join(f'{t:.0f}' for t in took)} ms; "
+          f"breaker {breaker.state}, {breaker.rejected} rejected")
+    if breaker.state != breaker.OPEN or took[-1] > 5:
+        failures.append("breaker did not open / fail fast")
+    return failures
+
+
+def _tail(args) -> list[str]:
+    failures = []
+    kwargs = dict(latency=args.latency, slow_every=args.slow_every,
+                  slow_latency=args.slow_latency)
+    with StubChatServer(ACTIONS, **kwargs) as primary, \
+            StubChatServer(ACTIONS, latency=args.latency) as secondary:
+        results = {}
+        for name in ("single", "hedged"):
+            transport = ChatTransport(primary.endpoint)
+            if name == "hedged":
+                transport = HedgedTransport(transport, ChatTransport(secondary.endpoint),
+                                            min_samples=20)
+            wrapper = MiniCPMWrapper("bench", transport=transport)
+            samples = []
+            for _ in range(args.n):
+                t0 = time.perf_counter()
+                if not wrapper.predict_mm("q", []).ok:
+                    failures.append(f"{name} call failed")
+                samples.append((time.perf_counter() - t0) * 1000)
+            transport.close()
+            results[name] = sorted(samples)
+            extra = ""
+            if isinstance(transport, HedgedTransport):
+                extra = (f"  hedged {transport.hedged}, won {transport.hedges_won}, "
+                         f"delay {transport.hedge_delay() * 1000:.0f} ms")
+            print(f"slow tail       {name:<7}{_ms(samples)}{extra}")
+    p99 = {k: v[min(len(v) - 1, int(len(v) * 0.99))] for k, v in results.items()}
+    if p99["hedged"] >= p99["single"]:
+        failures.append("hedging did not cut p99")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=300, help="calls in the slow-tail run")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency, s")
+    parser.add_argument("--slow-every", type=int, default=50)
+    parser.add_argument("--slow-latency", type=float, default=0.5)
+    parser.add_argument("--transient", type=int, default=5, help="transient-500 trials")
+    args = parser.parse_args()
+
+    failures = _transient(args.latency, args.transient)
+    failures += _down(8)
+    failures += _tail(args)
+    for what in failures:
+        print(f"FAILED: {what}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Screenshot downscaling: Lanczos‑only vs. reduce‑then‑Lanczos, per resolution.
+
+    python benchmarks/bench_resize.py [--max-side 1120] [--repeat 10]
+
+Frames are the bundled `screencap.png` scaled to common phone resolutions
+and wrapped like raw screencap output (zero‑copy RGBA).
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from adb_utils import _resize_pillow  # noqa: E402
+
+RESOLUTIONS = [(720, 1600), (1080, 1920), (1080, 2400), (1440, 3120), (1440, 3200)]
+
+
+def _best_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-side", type=int, default=1120)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    base = Image.open(os.path.join(ROOT, "screencap.png")).convert("RGBA")
+    print(f"{'resolution':<12}{'lanczos ms':>12}{'fast ms':>10}{'speedup':>9}")
+    for size in RESOLUTIONS:
+        frame = Image.frombuffer("RGBA", size, base.resize(size).tobytes(), "raw", "RGBA", 0, 1)
+        slow = _best_ms(lambda: _resize_pillow(frame, args.max_side, fast=False), args.repeat)
+        fast = _best_ms(lambda: _resize_pillow(frame, args.max_side), args.repeat)
+        print(f"{size[0]}x{size[1]:<7}{slow:>12.2f}{fast:>10.2f}{slow / fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
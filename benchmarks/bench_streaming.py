@@ -0,0 +1,83 @@
+"""Time to action: whole completion vs. streaming with early dispatch.
+
+    python benchmarks/bench_streaming.py [--n 5] [--token-latency 0.02] [--chunk-chars 4]
+
+The stub server streams each canned answer in `--chunk-chars` pieces,
+`--token-latency` seconds apart.  For each answer shape (thought first,
+action first, action first with `action_first=True`, no thought) it reports when the action was available to the
+caller (`on_action` in streaming mode, the return of `predict_mm` otherwise)
+and when `predict_mm` returned.  Exits with status 1 if a streamed action
+differs from the complete answer.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from stub_server import StubChatServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_wrapper import MiniCPMWrapper  # noqa: E402
+
+THOUGHT = "当前页面是视频详情页，点赞按钮位于视频下方右侧，需要点击它来完成点赞操作，然后任务就完成了"
+# answer, thought mode, action_first (model constrained to put the action first)
+SHAPES = {
+    "thought first": ('{"thought":"%s","POINT":[812,455]}' % THOUGHT, True, False),
+    "action first": ('{"POINT":[812,455],"thought":"%s"}' % THOUGHT, True, False),
+    "action first*": ('{"POINT":[812,455],"thought":"%s"}' % THOUGHT, True, True),
+    "no thought": ('{"POINT":[812,455]}', False, False),
+}
+
+
+def _fields(action: dict) -> dict:
+    return {k: v for k, v in action.items() if k != "thought"}
+
+
+def _measure(endpoint: str, stream: bool, thought: bool, action_first: bool,
+             n: int) -> tuple[list, list, list]:
+    wrapper = MiniCPMWrapper("bench", endpoint=endpoint, stream=stream, thought=thought,
+                             action_first=action_first)
+    to_action, total, actions = [], [], []
+    for _ in range(n):
+        seen = {}
+        t0 = time.perf_counter()
+        response = wrapper.predict_mm("点赞", [], on_action=lambda a: seen.setdefault(
+            "t", time.perf_counter()))
+        t1 = time.perf_counter()
+        to_action.append((seen.get("t", t1) - t0) * 1000)
+        total.append((t1 - t0) * 1000)
+        actions.append(response[3])
+    wrapper.transport.close()
+    return to_action, total, actions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="time to first token, s")
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--chunk-chars", type=int, default=4)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'answer':<15}{'mode':<10}{'to action':>12}{'returned':>12}")
+    for name, (answer, thought, action_first) in SHAPES.items():
+        with StubChatServer([answer], latency=args.latency, token_latency=args.token_latency,
+                            chunk_chars=args.chunk_chars) as server:
+            reference = None
+            for stream in (False, True):
+                to_action, total, actions = _measure(server.endpoint, stream, thought,
+                                                     action_first, args.n)
+                reference = reference or actions[0]
+                # compare the action fields only; thought handling differs by mode
+                failed |= any(_fields(a) != _fields(reference) for a in actions)
+                print(f"{name:<15}{'stream' if stream else 'complete':<10}"
+                      f"{statistics.median(to_action):>10.0f}ms{statistics.median(total):>10.0f}ms")
+    if failed:
+        print("streamed action differs from the complete answer")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
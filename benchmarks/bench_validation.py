@@ -0,0 +1,140 @@
+"""Action validation: `jsonschema` as before vs. the compiled checker.
+
+    python benchmarks/bench_validation.py [--n 5000] [--seed 0]
+
+Generates `--n` synthetic model answers (valid actions of every kind,
+actions wrapped in prose / code fences, and schema violations), checks that
+the compiled checker agrees with `jsonschema.Draft7Validator` on every
+extracted object, and times both.  The old path cannot read wrapped answers
+at all; those count as rejections for it.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jsonschema import Draft7Validator  # noqa: E402
+
+from action_schema import ActionValidationError, extract_json, parse_action  # noqa: E402
+from agent_wrapper import EXTRACT_SCHEMA, check_action  # noqa: E402
+
+THOUGHTS = ["点击搜索框", "输入关键词", "向上滑动查看更多", "返回上一页", "任务已完成"]
+
+
+def _valid(rng: random.Random) -> dict:
+    loc = lambda: [rng.randint(0, 1000), rng.randint(0, 1000)]  # noqa: E731
+    kind = rng.choice(["tap", "swipe", "drag", "press", "type", "clear", "link", "wait", "status"])
+    action = {"thought": rng.choice(THOUGHTS)}
+    if kind == "tap":
+        action["POINT"] = loc()
+    elif kind == "swipe":
+        action.update(POINT=loc(), to=rng.choice(["up", "down", "left", "right"]))
+    elif kind == "drag":
+        action.update(POINT=loc(), to=loc(), duration=rng.randint(100, 800))
+    elif kind == "press":
+        action["PRESS"] = rng.choice(["HOME", "BACK", "ENTER", "APPSELECT"])
+    elif kind == "type":
+        action["TYPE"] = rng.choice(["李子柒", "hello world", "天气 北京"])
+    elif kind == "clear":
+        action["CLEAR"] = None
+    elif kind == "link":
+        action["DEEP_LINK"] = None
+    elif kind == "wait":
+        action["duration"] = rng.randint(200, 3000)
+    else:
+        action["STATUS"] = rng.choice(["finish", "satisfied", "impossible", "need_feedback"])
+    return action
+
+
+def _invalid(rng: random.Random) -> dict:
+    action = _valid(rng)
+    mutation = rng.choice(["range", "extra", "two", "enum", "type", "arity", "empty", "to"])
+    if mutation == "range":
+        action["POINT"] = [rng.randint(1001, 3000), rng.randint(0, 1000)]
+    elif mutation == "extra":
+        action["click"] = True
+    elif mutation == "two":
+        action.update(POINT=[1, 2], PRESS="BACK")
+    elif mutation == "enum":
+        action["PRESS"] = "VOLUME_UP"
+    elif mutation == "type":
+        action["POINT"] = ["500", "500"]
+    elif mutation == "arity":
+        action["POINT"] = [500]
+    elif mutation == "empty":
+        action = {"thought": "想一想"}
+    else:
+        action = {"thought": "滑动", "to": "up"}
+    return action
+
+
+def _samples(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        roll = rng.random()
+        obj = _valid(rng) if roll < 0.6 else _invalid(rng)
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        wrapped = rng.random() < 0.2
+        if wrapped:
+            text = rng.choice(["好的，下一步：\n```json\n{}\n```", "{}\n以上是操作。",
+                               "Action: {} (done)"]).format(text)
+        out.append((text, wrapped))
+    return out
+
+
+def _old(text: str, validator: Draft7Validator) -> bool:
+    # the previous implementation: json.loads + validate(obj, schema) per call
+    try:
+        validator.validate(json.loads(text), EXTRACT_SCHEMA)
+        return True
+    except Exception:  # pylint: disable=broad-exception-caught
+        return False
+
+
+def _new(text: str) -> bool:
+    try:
+        parse_action(text, check_action)
+        return True
+    except ActionValidationError:
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = _samples(args.n, args.seed)
+    validator = Draft7Validator(EXTRACT_SCHEMA)
+
+    start = time.perf_counter()
+    old = [_old(t, validator) for t, _ in samples]
+    old_s = time.perf_counter() - start
+    start = time.perf_counter()
+    new = [_new(t) for t, _ in samples]
+    new_s = time.perf_counter() - start
+
+    reference = [validator.is_valid(extract_json(t)) for t, _ in samples]
+    mismatches = [t for (t, _), ok, ref in zip(samples, new, reference) if ok != ref]
+    recovered = sum(1 for (_, wrapped), o, n in zip(samples, old, new) if wrapped and n and not o)
+
+    print(f"{args.n} answers, {sum(reference)} valid, {sum(w for _, w in samples)} wrapped in text")
+    print(f"jsonschema  {old_s / args.n * 1e6:8.1f} us/answer  accepted {sum(old)}")
+    print(f"compiled    {new_s / args.n * 1e6:8.1f} us/answer  accepted {sum(new)}"
+          f"  ({old_s / new_s:.0f}x faster, {recovered} wrapped answers recovered)")
+    print(f"disagreements with jsonschema: {len(mismatches)}")
+    for text in mismatches[:5]:
+        print("  ", text)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Stand‑in for the `adb` client, used by the benchmarks.
+
+Device‑side commands (`input`, `wm`, `screencap`, ...) are the tiny scripts in
+`fakebin/`, executed by the local /bin/sh, so timings measure the transport
+and not what a real handset does with the command.  On‑device paths under
+/data/local/tmp and /sdcard are mapped into `FAKE_ADB_ROOT` (a temp dir by
+default).  Point `adb_utils` at it with `ADB_BINARY=benchmarks/fake_adb.py`
+or `use_fake_adb()`.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKEBIN = os.path.join(HERE, "fakebin")
+ROOT = os.environ.get("FAKE_ADB_ROOT") or os.path.join(
+    tempfile.gettempdir(), f"fake-adb-{os.getuid() if hasattr(os, 'getuid') else 0}")
+DEVICE_DIRS = ("/data/local/tmp", "/sdcard")
+
+
+def use_fake_adb() -> str:
+    """Route `adb_utils` through this script; returns the binary path."""
+    sys.path.insert(0, os.path.dirname(HERE))
+    import adb_utils
+
+    adb_utils.ADB_BINARY = os.path.abspath(__file__)
+    adb_utils.ADB_TRANSPORT = "binary"
+    return adb_utils.ADB_BINARY
+
+
+def _map_paths(text: str) -> str:
+    for d in DEVICE_DIRS:
+        text = text.replace(d, ROOT + d)
+    return text
+
+
+def _sh(argv) -> None:
+    for d in DEVICE_DIRS:
+        os.makedirs(ROOT + d, exist_ok=True)
+    os.environ["PATH"] = FAKEBIN + os.pathsep + os.environ.get("PATH", "")
+    if argv:
+        os.execvp("sh", ["sh", "-c", _map_paths(" ".join(argv))])
+    # interactive session: rewrite device paths line by line on the way in
+    sh = subprocess.Popen(["sh"], stdin=subprocess.PIPE, bufsize=0)
+    for line in sys.stdin.buffer:
+        try:
+            sh.stdin.write(_map_paths(line.decode("utf-8", "surrogateescape"))
+                           .encode("utf-8", "surrogateescape"))
+        except BrokenPipeError:
+            break
+    sh.stdin.close()
+    sys.exit(sh.wait())
+
+
+def main(argv) -> int:
+    if argv[:1] == ["-s"]:
+        argv = argv[2:]
+    if not argv:
+        return 1
+    cmd, rest = argv[0], argv[1:]
+    if cmd == "devices":
+        serials = os.environ.get("FAKE_ADB_SERIALS", "fake-0").split(",")
+        sys.stdout.write("List of devices attached\n")
+        sys.stdout.write("".join(f"{s}\tdevice\n" for s in serials if s) + "\n")
+        return 0
+    if cmd in ("shell", "exec-out"):
+        _sh(rest)
+    if cmd == "push":
+        target = _map_paths(rest[1])
+        os.makedirs(target if not os.path.splitext(target)[1] else os.path.dirname(target),
+                    exist_ok=True)
+        shutil.copy(rest[0], target)
+        sys.stdout.write(f"{rest[0]}: 1 file pushed.\n")
+        return 0
+    sys.stderr.write(f"fake adb: unsupported command {cmd}\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
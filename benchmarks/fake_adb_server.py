@@ -0,0 +1,219 @@
+"""Fake adb server speaking the smart‑socket subset `adb_client` uses.
+
+    python benchmarks/fake_adb_server.py --port 5037 [--serials fake-0,fake-1]
+
+or in‑process:
+
+    with FakeAdbServer() as server:
+        AdbClient(port=server.port)
+
+Implements `host:version`, `host:devices`, `host:transport:<serial>`,
+`host:transport-any`, then `shell:`/`exec:` (stdin and stdout streamed both
+ways, so `exec:sh` works as a persistent shell) and `sync:` SEND/QUIT.
+Device commands run like in `fake_adb.py`: the `fakebin/` scripts through
+the local /bin/sh, with on‑device paths mapped into `FAKE_ADB_ROOT`.
+"""
+import argparse
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+from typing import Optional, Sequence
+
+from fake_adb import DEVICE_DIRS, FAKEBIN, ROOT, _map_paths
+
+SERVER_VERSION = 41
+
+
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _prefixed(data: bytes) -> bytes:
+    return b"%04x" % len(data) + data
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "_Server"
+
+    def _okay(self, reply: bytes = b"") -> None:
+        self.request.sendall(b"OKAY" + reply)
+
+    def _fail(self, message: str) -> None:
+        self.request.sendall(b"FAIL" + _prefixed(message.encode()))
+
+    def handle(self) -> None:
+        sock: socket.socket = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        fake = self.server.fake
+        serial = None
+        while True:
+            head = _recv_exact(sock, 4)
+            if head is None:
+                return
+            payload = _recv_exact(sock, int(head, 16))
+            if payload is None:
+                return
+            req = payload.decode(errors="replace")
+            fake._count(req)
+            if req == "host:version":
+                return self._okay(_prefixed(b"%04x" % SERVER_VERSION))
+            if req == "host:devices":
+                return self._okay(_prefixed("".join(f"{s}\tdevice\n" for s in fake.serials)
+                                            .encode()))
+            if req == "host:transport-any" or req.startswith("host:transport:"):
+                serial = fake.serials[0] if req.endswith("-any") else req.split(":", 2)[2]
+                if serial not in fake.serials:
+                    return self._fail(f"device '{serial}' not found")
+                self._okay()
+                continue
+            if serial is None:
+                return self._fail(f"unknown host service {req!r}")
+            if req.startswith(("shell:", "exec:")):
+                self._okay()
+                return self._exec(req.split(":", 1)[1], merge_stderr=req.startswith("shell:"))
+            if req == "sync:":
+                self._okay()
+                return self._sync()
+            return self._fail(f"unsupported service {req!r}")
+
+    def _exec(self, command: str, merge_stderr: bool) -> None:
+        for d in DEVICE_DIRS:
+            os.makedirs(ROOT + d, exist_ok=True)
+        env = dict(os.environ, PATH=FAKEBIN + os.pathsep + os.environ.get("PATH", ""))
+        argv = ["sh", "-c", _map_paths(command)] if command.strip() else ["sh"]
+        proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL,
+                                env=env, bufsize=0)
+        sock: socket.socket = self.request
+
+        def _feed() -> None:
+            # device paths are rewritten line by line on the way in
+            try:
+                for line in sock.makefile("rb", buffering=0):
+                    proc.stdin.write(_map_paths(line.decode("utf-8", "surrogateescape"))
+                                     .encode("utf-8", "surrogateescape"))
+            except OSError:
+                pass
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+        threading.Thread(target=_feed, daemon=True, name="fake-adb-stdin").start()
+        try:
+            while True:
+                data = proc.stdout.read(65536)
+                if not data:
+                    break
+                sock.sendall(data)
+        except OSError:
+            proc.kill()
+        proc.wait()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _sync(self) -> None:
+        sock: socket.socket = self.request
+        while True:
+            head = _recv_exact(sock, 8)
+            if head is None:
+                return
+            cmd, n = struct.unpack("<4sI", head)
+            if cmd == b"QUIT":
+                return
+            if cmd != b"SEND":
+                sock.sendall(b"FAIL" + struct.pack("<I", 21) + b"unsupported sync call")
+                return
+            path, _, mode = _recv_exact(sock, n).decode().rpartition(",")
+            target = _map_paths(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                while True:
+                    cmd, n = struct.unpack("<4sI", _recv_exact(sock, 8))
+                    if cmd == b"DONE":
+                        break
+                    f.write(_recv_exact(sock, n))
+            os.chmod(target, int(mode) & 0o777)
+            self.server.fake.pushed.append(path)
+            sock.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    fake: "FakeAdbServer"
+
+
+class FakeAdbServer:
+    """Threaded fake adb server; `port=0` picks a free port."""
+
+    def __init__(self, serials: Sequence[str] = ("fake-0",), host: str = "127.0.0.1",
+                 port: int = 0):
+        self.serials = list(serials)
+        self.requests = 0
+        self.services = 0
+        self.pushed: list[str] = []
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def _count(self, request: str) -> None:
+        with self._lock:
+            self.requests += 1
+            if not request.startswith("host:"):
+                self.services += 1
+
+    def start(self) -> "FakeAdbServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True,
+                                        name="fake-adb-server")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeAdbServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> bool:
+        self.stop()
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--serials", default="fake-0", help="comma‑separated device serials")
+    args = parser.parse_args()
+    server = FakeAdbServer(args.serials.split(","), args.host, args.port)
+    print(f"Fake adb server on {server.host}:{server.port} ({', '.join(server.serials)})")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""In‑process stand‑in for `adb_utils.AndroidDevice`.
+
+Serves frames from a recorded trajectory (`trajectory.py`) or from static
+images such as `screencap.png`, and records the actions it is given instead
+of touching a phone, so `run_agent.run_steps` can be driven end to end on
+a plain Linux box:
+
+    device = FakeAndroidDevice.from_images(["screencap.png"])
+    device = FakeAndroidDevice.from_trajectory("run.traj")
+
+Each `step` advances to the next frame (the last one repeats).  Unlike
+`fake_adb.py` there is no transport at all, so timings isolate the agent
+loop itself: encoding, HTTP, validation and action compilation.
+"""
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import PIL.Image as Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adb_utils import _DeviceBase, _resize_pillow  # noqa: E402
+from trajectory import load_trajectory  # noqa: E402
+from ui_tree import UITree, parse_ui_xml  # noqa: E402
+
+_EMPTY_HIERARCHY = b"<?xml version='1.0' ?><hierarchy rotation=\"0\"></hierarchy>"
+
+
+class FakeAndroidDevice(_DeviceBase):
+    """`AndroidDevice` surface over a fixed list of frames.
+
+    Actions are compiled exactly as on a phone (coordinate scaling, key
+    mapping, text encoding via the ADB Keyboard path) and kept in
+    `commands`, never sent.
+
+    Args:
+      frames: screens returned in order, one per step.
+      ui_xml: `uiautomator dump` output served by `ui_tree`/`cached_ui_tree`.
+      settle_seconds: simulated time `wait_for_settle` takes.
+    """
+
+    def __init__(self, frames: Sequence[Image.Image], serial: str = "fake-0",
+                 ui_xml: Optional[bytes] = None, settle_seconds: float = 0.0):
+        if not frames:
+            raise ValueError("FakeAndroidDevice needs at least one frame")
+        super().__init__(serial, text_backend="adbkeyboard")
+        self.frames: List[Image.Image] = [f.convert("RGB") for f in frames]
+        self.ui_xml = ui_xml or _EMPTY_HIERARCHY
+        self.settle_seconds = settle_seconds
+        self.position = 0
+        self.actions: List[Dict[str, Any]] = []
+        self.commands: List[List[str]] = []
+        self.width, self.height = self.frames[0].size
+        self._tree: Optional[UITree] = None
+
+    @classmethod
+    def from_images(cls, paths: Sequence[str], **kwargs) -> "FakeAndroidDevice":
+        frames = []
+        for path in paths:
+            with Image.open(path) as img:
+                frames.append(img.convert("RGB"))
+        return cls(frames, **kwargs)
+
+    @classmethod
+    def from_trajectory(cls, path: str, full_resolution: bool = True,
+                        **kwargs) -> "FakeAndroidDevice":
+        """Frames of a recorded run, upscaled back to the device resolution
+        (recordings are stored downscaled) so encode costs match a real run."""
+        frames = []
+        for step in load_trajectory(path).steps:
+            frame = step.frame().convert("RGB")
+            if full_resolution and frame.size != tuple(step.resolution):
+                frame = frame.resize(tuple(step.resolution), Image.Resampling.BILINEAR)
+            frames.append(frame)
+        return cls(frames, **kwargs)
+
+    # --- AndroidDevice surface ------------------------------------------
+    def refresh_resolution(self) -> None:
+        self.width, self.height = self.frames[self.position].size
+
+    def step(self, data: Dict[str, Any]) -> bool:
+        self.commands.append(self._compile_action(data))
+        self.actions.append(data)
+        self._mark_action()
+        self.position = min(self.position + 1, len(self.frames) - 1)
+        self._tree = None
+        return self._is_finish(data)
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "last_req_time": self.last_req_time.isoformat(),
+            "screenshot": self.screenshot(),
+        }
+
+    def screenshot(self, max_side: Optional[int] = None) -> Image.Image:
+        img = self.frames[self.position]
+        if max_side is not None:
+            img = _resize_pillow(img, max_side)
+        return img
+
+    def wait_for_settle(self, max_side: Optional[int] = None,
+                        on_frame: Optional[Callable[[Image.Image], None]] = None,
+                        **_: Any) -> Image.Image:
+        if self.settle_seconds:
+            time.sleep(self.settle_seconds)
+        self.last_settle_seconds = self.settle_seconds
+        frame = self.frames[self.position]
+        if on_frame is not None:
+            on_frame(frame)
+        return _resize_pillow(frame, max_side) if max_side is not None else frame
+
+    def ui_tree(self) -> UITree:
+        return parse_ui_xml(self.ui_xml)
+
+    def cached_ui_tree(self, frame: Optional[Image.Image] = None) -> UITree:
+        if self._tree is None:
+            self._tree = self.ui_tree()
+        return self._tree
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,186 @@
+"""Micro‑benchmark suite for the adb_utils / agent_wrapper hot paths.
+
+    python benchmarks/run_suite.py [-k resize] [--samples 7] [--output BENCH.json]
+                                   [--compare OLD.json]
+
+Every case is timed like `timeit`: the loop count is calibrated so one
+sample takes at least `--min-time` seconds, then `--samples` samples are
+taken and per‑call statistics reported.  Results (plus commit, Python and
+Pillow versions) are written as JSON; `--compare` prints the ratio against
+an earlier file, so numbers can be taken before and after every change.
+
+Device dispatch runs over `fake_adb.py`, i.e. it measures the host side of
+the transport, not a handset.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from typing import Callable, Dict, List, Tuple
+
+from fake_adb import use_fake_adb
+
+use_fake_adb()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np  # noqa: E402
+import PIL  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from action_schema import ActionValidationError  # noqa: E402
+from adb_utils import AndroidDevice, _encode_text_for_adb, _resize_pillow  # noqa: E402
+from agent_wrapper import (MiniCPMWrapper, array_to_jpeg_bytes,  # noqa: E402
+                           compact_json_dumps, encode_image_bytes)
+
+Case = Tuple[str, Callable[[], object]]
+
+VALID_RESPONSE = '{"thought":"点击搜索框并输入关键词","POINT":[512,88]}'
+EMBEDDED_RESPONSE = '好的，下一步操作如下：\n```json\n{"thought":"返回上一页","PRESS":"BACK"}\n```'
+INVALID_RESPONSE = '{"thought":"滑动","POINT":[500,1200],"to":"sideways"}'
+ASCII_TEXT = "hello world, this is a plain ascii query 123"
+UNICODE_TEXT = "去哔哩哔哩看李子柒的最新视频，并且点赞 ok"
+
+
+def _raw_frame(size: Tuple[int, int]) -> Image.Image:
+    """`screencap.png` scaled to `size`, wrapped like raw screencap output."""
+    base = Image.open(os.path.join(ROOT, "screencap.png")).convert("RGBA")
+    return Image.frombuffer("RGBA", size, base.resize(size).tobytes(), "raw", "RGBA", 0, 1)
+
+
+def build_cases() -> List[Case]:
+    cases: List[Case] = []
+    for size in ((1080, 2400), (1440, 3200)):
+        frame = _raw_frame(size)
+        cases.append((f"resize/{size[0]}x{size[1]}->1120",
+                      lambda f=frame: _resize_pillow(f, 1120)))
+
+    small = _resize_pillow(_raw_frame((1080, 2400)), 1120)
+    array = np.asarray(small)
+    cases += [
+        ("encode/array_to_jpeg_bytes", lambda: array_to_jpeg_bytes(array)),
+        ("encode/jpeg85", lambda: encode_image_bytes(small, "JPEG", 85)),
+        ("encode/webp75", lambda: encode_image_bytes(small, "WEBP", 75)),
+        ("encode/png", lambda: encode_image_bytes(small, "PNG")),
+    ]
+    jpeg = encode_image_bytes(small, "JPEG", 85)
+    cases += [
+        ("base64/b64encode", lambda: base64.b64encode(jpeg.data)),
+        ("base64/to_data_url", jpeg.to_data_url),
+    ]
+
+    wrapper = MiniCPMWrapper("bench", use_history=True, history_size=2,
+                             endpoint="http://127.0.0.1:9/v1/chat/completions")
+
+    def _validate(text: str) -> Callable[[], object]:
+        def run():
+            try:
+                return wrapper.extract_and_validate_json(text)
+            except ActionValidationError as e:
+                return e
+        return run
+
+    cases += [
+        ("validate/valid", _validate(VALID_RESPONSE)),
+        ("validate/embedded", _validate(EMBEDDED_RESPONSE)),
+        ("validate/invalid", _validate(INVALID_RESPONSE)),
+        ("adb_text/ascii", lambda: _encode_text_for_adb(ASCII_TEXT)),
+        ("adb_text/unicode", lambda: _encode_text_for_adb(UNICODE_TEXT)),
+    ]
+
+    # payload construction: history of two earlier turns, pre‑encoded image
+    for _ in range(2):
+        wrapper._push_history("user", wrapper._history_user_content("<Question>q</Question>",
+                                                                    jpeg, jpeg.to_data_url()))
+        wrapper._push_history("assistant", VALID_RESPONSE)
+    cases += [
+        ("payload/build", lambda: wrapper._build_request("去哔哩哔哩看李子柒的最新视频", [jpeg])),
+        ("payload/build+serialize", lambda: compact_json_dumps(
+            wrapper._build_request("去哔哩哔哩看李子柒的最新视频", [jpeg])[0]).encode()),
+    ]
+
+    device = AndroidDevice("fake-0", text_backend="adbkeyboard")
+    device.refresh_resolution()
+    cases += [
+        ("dispatch/tap", lambda: device.step({"POINT": [500, 500]})),
+        ("dispatch/swipe", lambda: device.step({"POINT": [500, 600], "to": "up"})),
+        ("dispatch/type_ascii", lambda: device.step({"TYPE": ASCII_TEXT})),
+        ("dispatch/type_unicode", lambda: device.step({"TYPE": UNICODE_TEXT})),
+    ]
+    return cases
+
+
+def measure(fn: Callable[[], object], samples: int, min_time: float) -> Dict[str, float]:
+    fn()  # warm‑up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+    per_call = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - start) / loops * 1e6)
+    return {
+        "median_us": statistics.median(per_call),
+        "mean_us": statistics.mean(per_call),
+        "min_us": min(per_call),
+        "stdev_us": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        "loops": loops,
+        "samples": samples,
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", dest="filter", default="", help="only cases containing this")
+    parser.add_argument("--samples", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results: Dict[str, Dict[str, float]] = {}
+    header = f"{'case':<28}{'median':>12}{'min':>12}{'stdev':>10}"
+    print(header + ("   vs base" if baseline else ""))
+    for name, fn in build_cases():
+        if args.filter not in name:
+            continue
+        r = results[name] = measure(fn, args.samples, args.min_time)
+        line = f"{name:<28}{r['median_us']:>10.1f}us{r['min_us']:>10.1f}us{r['stdev_us']:>10.1f}"
+        if name in baseline:
+            line += f"{r['median_us'] / baseline[name]['median_us']:>9.2f}x"
+        print(line)
+
+    if args.output:
+        meta = {"commit": _commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "pillow": PIL.__version__,
+                "platform": platform.platform()}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
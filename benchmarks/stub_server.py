@@ -0,0 +1,225 @@
+"""Stub OpenAI‑compatible chat server returning canned actions.
+
+    python benchmarks/stub_server.py --port 8000 [--latency 0.05] [--actions actions.jsonl]
+
+or in‑process:
+
+    with StubChatServer(actions) as server:
+        MiniCPMWrapper(..., endpoint=server.endpoint)
+
+Every POST to `/v1/chat/completions` answers with the next canned action
+(cycling) as the assistant message, after an optional fixed `latency`.
+Requests with `stream: true` get the answer as SSE chunks of `chunk_chars`
+characters, `token_latency` seconds apart, like a model generating it
+(non‑streaming answers wait as long before they are sent).
+For resilience tests the first `fail_first` requests get an HTTP 500, and
+every `slow_every`‑th request is held `slow_latency` extra seconds.
+Request sizes are counted so benchmarks can report bytes on the wire.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+DEFAULT_ACTIONS: List[Dict[str, Any]] = [
+    {"thought": "打开搜索框", "POINT": [500, 75]},
+    {"thought": "输入关键词", "TYPE": "李子柒"},
+    {"thought": "向下滑动查看结果", "POINT": [500, 600], "to": "up"},
+    {"thought": "返回", "PRESS": "BACK"},
+    {"thought": "任务完成", "STATUS": "finish"},
+]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; without TCP_NODELAY the
+    # second one waits on the client's delayed ACK (~40 ms per request)
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/v1/models":
+            self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send(404, {"error": {"message": f"no route {self.path}"}})
+
+    def _chunk(self, event: Any) -> None:
+        data = b"data: " + (event if isinstance(event, bytes) else json.dumps(
+            event, ensure_ascii=False).encode()) + b"\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _stream(self, content: str, base: Dict[str, Any]) -> None:
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {**base, "object": "chat.completion.chunk"}
+        step = max(stub.chunk_chars, 1)
+        for i in range(0, len(content), step):
+            if i and stub.token_latency:
+                time.sleep(stub.token_latency)
+            self._chunk({**base, "choices": [{"index": 0, "finish_reason": None,
+                                              "delta": {"content": content[i:i + step]}}]})
+        self._chunk({**base, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]})
+        self._chunk(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send(404, {"error": {"message": f"no route {self.path}"}})
+            return
+        stub = self.server.stub
+        n, action = stub._next(len(body))
+        request = json.loads(body)
+        if n <= stub.fail_first:
+            self._send(500, {"error": {"message": f"injected failure {n}/{stub.fail_first}"}})
+            return
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.slow_every and n % stub.slow_every == 0:
+            time.sleep(stub.slow_latency)
+        # canned strings are sent verbatim (e.g. malformed answers)
+        content = action if isinstance(action, str) else json.dumps(
+            action, ensure_ascii=False, separators=(",", ":"))
+        base = {
+            "id": f"chatcmpl-stub-{n}",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+        }
+        if request.get("stream"):
+            self._stream(content, base)
+            return
+        if stub.token_latency:  # same generation time as the streamed answer
+            time.sleep(stub.token_latency * ((len(content) - 1) // max(stub.chunk_chars, 1)))
+        self._send(200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # many agents connecting at once overflow the default 5
+    stub: "StubChatServer"
+
+    def handle_error(self, request, client_address) -> None:
+        # clients may hang up mid‑stream once they have their action
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubChatServer:
+    """Threaded stub server; `port=0` picks a free port."""
+
+    def __init__(self, actions: Optional[Sequence[Union[Dict[str, Any], str]]] = None,
+                 latency: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 token_latency: float = 0.0, chunk_chars: int = 4, fail_first: int = 0,
+                 slow_every: int = 0, slow_latency: float = 0.0):
+        self.actions = list(actions or DEFAULT_ACTIONS)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.fail_first = fail_first
+        self.slow_every = slow_every
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self.request_bytes = 0
+        self._cycle = itertools.cycle(self.actions)
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def _next(self, size: int) -> Tuple[int, Union[Dict[str, Any], str]]:
+        """The request's 1‑based number and its canned answer."""
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += size
+            if self.requests <= self.fail_first:
+                return self.requests, ""
+            return self.requests, next(self._cycle)
+
+    def start(self) -> "StubChatServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True,
+                                        name="stub-chat-server")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubChatServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> bool:
+        self.stop()
+        return False
+
+
+def load_actions(path: str) -> List[Dict[str, Any]]:
+    """Actions from a JSON list, JSONL, or a recorded trajectory (`.traj`)."""
+    if path.endswith(".traj"):
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from trajectory import load_trajectory
+
+        return [s.action for s in load_trajectory(path).steps if isinstance(s.action, dict)]
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per response")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="seconds between streamed chunks")
+    parser.add_argument("--actions", help="JSON / JSONL / .traj file of canned actions")
+    parser.add_argument("--fail-first", type=int, default=0,
+                        help="answer the first N requests with HTTP 500")
+    parser.add_argument("--slow-every", type=int, default=0)
+    parser.add_argument("--slow-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    actions = load_actions(args.actions) if args.actions else None
+    server = StubChatServer(actions, args.latency, args.host, args.port, args.token_latency,
+                            fail_first=args.fail_first, slow_every=args.slow_every,
+                            slow_latency=args.slow_latency)
+    print(f"Serving {server.endpoint}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
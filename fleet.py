@@ -0,0 +1,244 @@
+"""Run a queue of tasks across every connected phone in parallel.
+
+One worker thread per device pulls tasks from a shared queue; all workers
+share a single pooled `ChatTransport`, so N phones cost one connection pool
+rather than N processes.  With `--async` the workers are coroutines on one
+event loop instead (`adb_async.AsyncAndroidDevice`, `apredict_mm`).
+`--batch-window MS` puts a `batching.BatchingTransport` in front of the pool
+so model calls from different phones reach the server together.
+
+    python fleet.py --tasks tasks.txt [--serial A --serial B] [--max-steps 50] [--async]
+                    [--batch-window 10 --max-concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from adb_async import alist_devices, asetup_device
+from adb_utils import list_devices, setup_device
+from agent_wrapper import ChatTransport, END_POINT, MiniCPMWrapper
+from batching import BatchingTransport
+from run_agent import arun_steps, run_steps
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaskResult:
+    task: str
+    serial: str
+    finished: bool
+    steps: int
+    seconds: float
+    error: Optional[str] = None
+
+
+@dataclass
+class FleetReport:
+    results: list[TaskResult] = field(default_factory=list)
+    wall_seconds: float = 0.0
+    batching: Optional[str] = None  # BatchStats.summary() when batching was on
+
+    @property
+    def tasks_per_hour(self) -> float:
+        return len(self.results) * 3600 / self.wall_seconds if self.wall_seconds else 0.0
+
+    def per_device(self) -> dict[str, dict[str, float]]:
+        """Tasks, steps and steps/sec (over busy time) for each serial."""
+        stats: dict[str, dict[str, float]] = {}
+        for r in self.results:
+            s = stats.setdefault(r.serial, {"tasks": 0, "steps": 0, "busy_seconds": 0.0})
+            s["tasks"] += 1
+            s["steps"] += r.steps
+            s["busy_seconds"] += r.seconds
+        for s in stats.values():
+            s["steps_per_sec"] = s["steps"] / s["busy_seconds"] if s["busy_seconds"] else 0.0
+        return stats
+
+    def summary(self) -> str:
+        done = sum(r.finished for r in self.results)
+        lines = [f"{len(self.results)} tasks ({done} finished) in {self.wall_seconds:.1f}s "
+                 f"→ {self.tasks_per_hour:.1f} tasks/hour"]
+        for serial, s in sorted(self.per_device().items()):
+            lines.append(f"  {serial}: {s['tasks']} tasks, {s['steps']} steps, "
+                         f"{s['steps_per_sec']:.3f} steps/s")
+        if self.batching:
+            lines.append(f"  batching: {self.batching}")
+        return "\n".join(lines)
+
+
+def load_tasks(path: str) -> list[str]:
+    """Tasks from a file: a JSON list, JSON lines with a `task` key, or plain lines."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return [str(t) for t in json.loads(text)]
+    tasks = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        tasks.append(json.loads(line)["task"] if line.startswith("{") else line)
+    return tasks
+
+
+def _transport(endpoint: str, serials: list[str], batch_window: float,
+               max_concurrency: Optional[int]):
+    transport = ChatTransport(endpoint, pool_size=max(len(serials), 1))
+    if batch_window <= 0:
+        return transport
+    return BatchingTransport(transport, window=batch_window / 1000,
+                             max_batch=max(len(serials), 1),
+                             max_concurrency=max_concurrency or max(len(serials), 1))
+
+
+def run_fleet(
+    tasks: list[str],
+    serials: Optional[list[str]] = None,
+    model_name: str = "AgentCPM-GUI",
+    endpoint: str = END_POINT,
+    max_steps: Optional[int] = 50,
+    batch_window: float = 0.0,
+    max_concurrency: Optional[int] = None,
+    **wrapper_kwargs,
+) -> FleetReport:
+    """Run `tasks` on all authorised devices (or `serials`), one thread per device.
+
+    `batch_window` (ms) > 0 batches concurrent model calls, at most
+    `max_concurrency` (default: one per device) in flight.
+    """
+    serials = serials or list_devices()
+    if not serials:
+        raise RuntimeError("No authorised Android device found. Plug in & check adb.")
+    transport = _transport(endpoint, serials, batch_window, max_concurrency)
+    pending: queue.Queue[str] = queue.Queue()
+    for task in tasks:
+        pending.put(task)
+    report = FleetReport()
+    lock = threading.Lock()
+
+    def _worker(serial: str) -> None:
+        try:
+            device = setup_device(serial)
+        except Exception as exc:  # a broken phone should not stop the others
+            logger.error("Device %s unavailable: %s", serial, exc)
+            return
+        try:
+            while True:
+                try:
+                    task = pending.get_nowait()
+                except queue.Empty:
+                    return
+                minicpm = MiniCPMWrapper(model_name, transport=transport, **wrapper_kwargs)
+                start = time.monotonic()
+                try:
+                    finished, steps = run_steps(device, minicpm, task, max_steps)
+                    result = TaskResult(task, serial, finished, steps, time.monotonic() - start)
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    logger.exception("Task failed on %s: %s", serial, task)
+                    result = TaskResult(task, serial, False, 0, time.monotonic() - start, str(exc))
+                with lock:
+                    report.results.append(result)
+                logger.info("[%s] %s → finished=%s steps=%d %.1fs", serial, task,
+                            result.finished, result.steps, result.seconds)
+        finally:
+            device.close()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=_worker, args=(s,), name=f"fleet-{s}") for s in serials]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report.wall_seconds = time.monotonic() - start
+    if isinstance(transport, BatchingTransport):
+        report.batching = transport.stats.summary()
+    transport.close()
+    return report
+
+
+async def arun_fleet(
+    tasks: list[str],
+    serials: Optional[list[str]] = None,
+    model_name: str = "AgentCPM-GUI",
+    endpoint: str = END_POINT,
+    max_steps: Optional[int] = 50,
+    batch_window: float = 0.0,
+    max_concurrency: Optional[int] = None,
+    **wrapper_kwargs,
+) -> FleetReport:
+    """`run_fleet` on a single event loop: one coroutine per device."""
+    serials = serials or await alist_devices()
+    if not serials:
+        raise RuntimeError("No authorised Android device found. Plug in & check adb.")
+    transport = _transport(endpoint, serials, batch_window, max_concurrency)
+    pending: asyncio.Queue[str] = asyncio.Queue()
+    for task in tasks:
+        pending.put_nowait(task)
+    report = FleetReport()
+
+    async def _worker(serial: str) -> None:
+        try:
+            device = await asetup_device(serial)
+        except Exception as exc:  # a broken phone should not stop the others
+            logger.error("Device %s unavailable: %s", serial, exc)
+            return
+        try:
+            while not pending.empty():
+                task = pending.get_nowait()
+                minicpm = MiniCPMWrapper(model_name, transport=transport, **wrapper_kwargs)
+                start = time.monotonic()
+                try:
+                    finished, steps = await arun_steps(device, minicpm, task, max_steps)
+                    result = TaskResult(task, serial, finished, steps, time.monotonic() - start)
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    logger.exception("Task failed on %s: %s", serial, task)
+                    result = TaskResult(task, serial, False, 0, time.monotonic() - start, str(exc))
+                report.results.append(result)
+                logger.info("[%s] %s → finished=%s steps=%d %.1fs", serial, task,
+                            result.finished, result.steps, result.seconds)
+        finally:
+            await device.close()
+
+    start = time.monotonic()
+    await asyncio.gather(*(_worker(s) for s in serials))
+    report.wall_seconds = time.monotonic() - start
+    if isinstance(transport, BatchingTransport):
+        report.batching = transport.stats.summary()
+    await transport.aclose()
+    transport.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", required=True, help="task file (txt / json / jsonl)")
+    parser.add_argument("--serial", action="append", help="limit to these devices")
+    parser.add_argument("--endpoint", default=END_POINT)
+    parser.add_argument("--model", default="AgentCPM-GUI")
+    parser.add_argument("--max-steps", type=int, default=50)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="drive all devices from one asyncio event loop")
+    parser.add_argument("--batch-window", type=float, default=0.0,
+                        help="ms to hold model calls so concurrent ones go out together")
+    parser.add_argument("--max-concurrency", type=int,
+                        help="model calls in flight when batching (default: one per device)")
+    args = parser.parse_args()
+    fleet_args = (load_tasks(args.tasks), args.serial, args.model, args.endpoint, args.max_steps,
+                  args.batch_window, args.max_concurrency)
+    wrapper_kwargs = dict(temperature=1, use_history=True, history_size=2)
+    if args.use_async:
+        report = asyncio.run(arun_fleet(*fleet_args, **wrapper_kwargs))
+    else:
+        report = run_fleet(*fleet_args, **wrapper_kwargs)
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Retry, circuit‑breaking and hedging for model calls.
+
+* `Backoff` – short exponential backoff with full jitter, so a transient
+  error costs a fraction of a second and many agents do not retry in step.
+* `CircuitBreaker` – one per endpoint (`breaker_for`), shared by every
+  transport talking to it.  After `failure_threshold` consecutive failures
+  (connection errors, 5xx, 429) calls fail fast with `CircuitOpenError` for
+  `reset_timeout` seconds (its `retry_after` says how long is left); then a
+  single trial call decides whether to close it again.
+* `HedgedTransport` – wraps a primary and a secondary transport (anything
+  with `post` / `apost`, e.g. `ChatTransport`).  When the primary has not
+  answered within its recent latency percentile the same request also goes to
+  the secondary and the first good answer wins; when the primary's breaker
+  is open the secondary is used straight away.
+"""
+import asyncio
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """The endpoint's circuit breaker is open; the call was not attempted.
+
+    `retry_after` is how long until the breaker lets a trial call through.
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_failure_status(status: int) -> bool:
+    """Statuses that say the endpoint, not the request, is in trouble."""
+    return status >= 500 or status == 429
+
+
+class Backoff:
+    """`delay(attempt)` is uniform in [0, min(cap, base * 2**attempt)]."""
+
+    def __init__(self, base: float = 0.2, cap: float = 5.0, rng: Optional[random.Random] = None):
+        self.base = base
+        self.cap = cap
+        self._rng = rng or random.Random()
+
+    def delay(self, attempt: int) -> float:
+        return self._rng.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Closed → open after consecutive failures → half‑open after a pause."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    TRIAL_POLL_SECONDS = 0.1
+
+    def __init__(self, name: str = "", failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"CircuitBreaker({self.name!r}, {self.state}, failures={self.failures})"
+
+    def check(self) -> None:
+        """Raise `CircuitOpenError` unless a call may go out now."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state, self._trial = self.HALF_OPEN, False
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True  # exactly one trial call while half‑open
+                return
+            self.rejected += 1
+            if self.state == self.OPEN:
+                retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            else:
+                retry_after = self.TRIAL_POLL_SECONDS  # the trial call is still out
+        raise CircuitOpenError(f"circuit open for {self.name or 'endpoint'}",
+                               max(retry_after, 0.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self.failures, self._trial = self.CLOSED, 0, False
+
+    def release(self) -> None:
+        """The call was abandoned without an outcome; free the trial slot."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state, self.opened_at, self._trial = self.OPEN, time.monotonic(), False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(endpoint: str) -> CircuitBreaker:
+    """The process‑wide breaker of `endpoint`."""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+class LatencyWindow:
+    """Recent latencies of successful calls, for percentile thresholds."""
+
+    def __init__(self, size: int = 200):
+        self._samples: collections.deque = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _most_retryable(errors: list) -> BaseException:
+    """A `CircuitOpenError` only if every endpoint refused (the one that
+    reopens first); otherwise the error of an endpoint that was actually tried."""
+    tried = [e for e in errors if not isinstance(e, CircuitOpenError)]
+    return tried[0] if tried else min(errors, key=lambda e: e.retry_after)
+
+
+def _good(result: Any) -> bool:
+    response, _ = result
+    return not is_failure_status(response.status_code)
+
+
+class HedgedTransport:
+    """Send to `primary`; hedge to `secondary` when the primary is slow.
+
+    The hedge delay is the primary's `percentile` latency over its last calls
+    (at least `min_delay`; `initial_delay` until `min_samples` are known).
+    Streaming calls are not duplicated – two streams cannot feed one parser –
+    they only fall back to the secondary when the primary fails (error, 5xx,
+    open breaker) before its first delta.
+    """
+
+    def __init__(self, primary, secondary, percentile: float = 95.0, min_delay: float = 0.05,
+                 initial_delay: float = 2.0, min_samples: int = 20, max_workers: int = 32):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latency = LatencyWindow()
+        self.hedged = 0
+        self.hedges_won = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self) -> str:
+        return self.primary.endpoint
+
+    def hedge_delay(self) -> float:
+        if len(self.latency) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    def _timed(self, payload: dict):
+        start = time.monotonic()
+        result = self.primary.post(payload)
+        if _good(result):
+            self.latency.add(time.monotonic() - start)
+        return result
+
+    def _count(self, won: bool) -> None:
+        with self._lock:
+            self.hedged += 1
+            self.hedges_won += won
+
+    def post(self, payload: dict):
+        first = self._pool.submit(self._timed, payload)
+        done, _ = wait([first], timeout=self.hedge_delay())
+        if done and first.exception() is None and _good(first.result()):
+            return first.result()
+        second = self._pool.submit(self.secondary.post, payload)
+        pending, fallback, errors = {first, second}, None, []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    errors.append(f.exception())
+                elif _good(f.result()):
+                    self._count(f is second)
+                    return f.result()
+                else:
+                    fallback = fallback or f.result()
+        self._count(False)
+        if fallback is not None:
+            return fallback
+        raise _most_retryable(errors)
+
+    async def _atimed(self, payload: dict):
+        start = time.monotonic()
+        result = await self.primary.apost(payload)
+        if _good(result):
+            self.latency.add(time.monotonic() - start)
+        return result
+
+    async def apost(self, payload: dict):
+        first = asyncio.ensure_future(self._atimed(payload))
+        done, _ = await asyncio.wait([first], timeout=self.hedge_delay())
+        if done and first.exception() is None and _good(first.result()):
+            return first.result()
+        second = asyncio.ensure_future(self.secondary.apost(payload))
+        pending, fallback, errors = {first, second}, None, []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    errors.append(f.exception())
+                elif _good(f.result()):
+                    for other in pending:
+                        other.cancel()
+                    self._count(f is second)
+                    return f.result()
+                else:
+                    fallback = fallback or f.result()
+        self._count(False)
+        if fallback is not None:
+            return fallback
+        raise _most_retryable(errors)
+
+    def post_stream(self, payload: dict, on_delta):
+        started = []
+
+        def relay(delta: str) -> None:
+            started.append(True)
+            on_delta(delta)
+
+        try:
+            result = self.primary.post_stream(payload, relay)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if started:
+                raise
+            try:
+                return self.secondary.post_stream(payload, on_delta)
+            except CircuitOpenError as refused:
+                raise _most_retryable([error, refused]) from None
+        if started or _good(result):
+            return result
+        try:
+            return self.secondary.post_stream(payload, on_delta)
+        except CircuitOpenError:
+            return result  # the primary's error response is the one worth retrying
+
+    async def apost_stream(self, payload: dict, on_delta):
+        started = []
+
+        def relay(delta: str) -> None:
+            started.append(True)
+            on_delta(delta)
+
+        try:
+            result = await self.primary.apost_stream(payload, relay)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if started:
+                raise
+            try:
+                return await self.secondary.apost_stream(payload, on_delta)
+            except CircuitOpenError as refused:
+                raise _most_retryable([error, refused]) from None
+        if started or _good(result):
+            return result
+        try:
+            return await self.secondary.apost_stream(payload, on_delta)
+        except CircuitOpenError:
+            return result
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+        self.primary.close()
+        self.secondary.close()
+
+    async def aclose(self) -> None:
+        await self.primary.aclose()
+        await self.secondary.aclose()
@@ -1,31 +1,351 @@
+import asyncio
 import time
-from adb_utils import setup_device
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from action_cache import ActionCache
+from adb_async import AsyncAndroidDevice
+from adb_utils import (AndroidDevice, _frame_signature, _resize_pillow, _signature_distance,
+                       setup_device)
+from trajectory import Trajectory, TrajectoryWriter, load_trajectory
+from ui_tree import format_elements
 import logging
 import os
 from agent_wrapper import MiniCPMWrapper
-import numpy as np
-from PIL import Image
+import tracing
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 
-def run_task(query):
+OBSERVATIONS = ("screenshot", "hybrid", "elements")
+
+
+def run_steps(device: AndroidDevice, minicpm: MiniCPMWrapper, query: str,
+              max_steps: Optional[int] = None, max_side: int = 1120,
+              observation: str = "screenshot", hybrid_max_side: int = 560,
+              action_cache: Optional[ActionCache] = None,
+              recorder: Optional[TrajectoryWriter] = None) -> tuple[bool, int]:
+    """在已就绪的设备上执行一个任务，返回 (是否完成, 执行步数)。
+
+    截图的缩放与编码在后台线程完成：等待界面稳定时每抓到一帧就提交编码，
+    与下一帧的抓取重叠，界面稳定后对应的请求图片通常已经编码完毕。
+
+    observation 决定发给模型的内容：screenshot 只发截图；hybrid 发可交互
+    元素列表和一张更小的截图（hybrid_max_side）；elements 只发元素列表。
+
+    传入 action_cache 时，命中缓存的界面直接重放记录的动作、跳过模型推理；
+    动作执行后界面是否发生变化会回写到缓存，无效的缓存条目会被剔除。
+    重放的步骤不会进入模型的对话历史。
+
+    传入 recorder 时，每一步的截图、动作和耗时都会追加写入轨迹文件。
+
+    minicpm 为流式模式（stream=True）时，动作在模型输出结束前就开始执行，
+    infer 耗时记为「拿到动作」的时间。
+    """
+    return _run_steps(device, minicpm, query, max_steps, max_side, observation,
+                      hybrid_max_side, action_cache, recorder)[:2]
+
+
+def _run_steps(device: AndroidDevice, minicpm: MiniCPMWrapper, query: str,
+               max_steps: Optional[int] = None, max_side: int = 1120,
+               observation: str = "screenshot", hybrid_max_side: int = 560,
+               action_cache: Optional[ActionCache] = None,
+               recorder: Optional[TrajectoryWriter] = None) -> tuple[bool, int, bool]:
+    """run_steps 的实现，多返回一项：是否因模型调用失败而提前结束。"""
+    if observation not in OBSERVATIONS:
+        raise ValueError(f"Unknown observation mode: {observation}")
+    if observation == "hybrid":
+        max_side = hybrid_max_side
+    encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+
+    def _prepare(frame):
+        if observation == "elements":
+            return None
+        return minicpm.encode_image(_resize_pillow(frame, max_side))
+
+    def _observe(frame):
+        # 返回 (UI 树, 元素列表文本)；纯截图模式下不抓取 UI 树
+        if observation == "screenshot":
+            return None, None
+        tree = device.cached_ui_tree(frame)
+        return tree, format_elements(tree.interactive_elements(device.width, device.height))
+
+    is_finish = failed = False
+    step_no = 0
+    try:
+        frame = device.screenshot()
+        pending = encoder.submit(_prepare, frame)
+        tree, elements = _observe(frame)
+        while not is_finish and (max_steps is None or step_no < max_steps):
+            t0 = time.perf_counter()
+            observed = frame
+            key = hit = None
+            early: dict = {}
+
+            def _dispatch_early(action):
+                # 流式模式：动作一完整就执行，剩余输出的接收与执行重叠
+                early["t2"] = time.perf_counter()
+                with tracing.span("dispatch", serial=device.serial, early=True):
+                    early["finish"] = device.step(action)
+                early["t3"] = time.perf_counter()
+
+            if action_cache is not None:
+                sig = _frame_signature(frame)
+                key = action_cache.key(query, sig, tree)
+                hit = action_cache.lookup(key)
+            if hit is not None:
+                action = dict(hit.action)
+                t1 = time.perf_counter()
+                print(f"cache hit: {action}")
+            else:
+                encoded = pending.result()
+                t1 = time.perf_counter()
+                images = [encoded] if encoded is not None else []
+                response = minicpm.predict_mm(query, images, elements,
+                                              on_action=_dispatch_early if minicpm.stream else None)
+                if not response.ok:
+                    # 重试耗尽或熔断：任务以未完成结束，不拿空动作去操作设备
+                    logger.error("Model call failed after %d attempts: %s",
+                                 response.attempts, response.error)
+                    failed = True
+                    break
+                action = response.action
+                print(action)
+            if "finish" in early:
+                t2, t3, is_finish = early["t2"], early["t3"], early["finish"]
+            else:
+                t2 = time.perf_counter()
+                with tracing.span("dispatch", serial=device.serial):
+                    is_finish = device.step(action)
+                t3 = time.perf_counter()
+            step_no += 1
+            if not is_finish:
+                candidates: list[Future] = []
+
+                def _on_frame(frame):
+                    # 只有最后一帧会被使用，尚未开始的旧编码任务直接取消
+                    if candidates:
+                        candidates[-1].cancel()
+                    candidates.append(encoder.submit(_prepare, frame))
+
+                frame = device.wait_for_settle(on_frame=_on_frame)
+                pending = candidates[-1]
+                if key is not None:
+                    changed = _signature_distance(sig, _frame_signature(frame)) > 1.5
+                    action_cache.record(key, action, changed, hit)
+                tree, elements = _observe(frame)
+            timings = {
+                "encode_wait_ms": (t1 - t0) * 1000, "infer_ms": (t2 - t1) * 1000,
+                "dispatch_ms": (t3 - t2) * 1000,
+                "settle_ms": (time.perf_counter() - t3) * 1000 if not is_finish else 0.0,
+            }
+            logger.info(
+                "Step %d: encode-wait %.0fms, infer %.0fms, dispatch %.0fms, settle %.0fms",
+                step_no, *timings.values(),
+            )
+            if recorder is not None:
+                recorder.write_step(observed, action, timings, (device.width, device.height))
+    finally:
+        encoder.shutdown(wait=False, cancel_futures=True)
+    return is_finish, step_no, failed
+
+
+async def arun_steps(device: AsyncAndroidDevice, minicpm: MiniCPMWrapper, query: str,
+                     max_steps: Optional[int] = None, max_side: int = 1120,
+                     observation: str = "screenshot",
+                     action_cache: Optional[ActionCache] = None,
+                     recorder: Optional[TrajectoryWriter] = None) -> tuple[bool, int]:
+    """run_steps 的 asyncio 版本，返回 (是否完成, 执行步数)。
+
+    设备 I/O 和模型请求都在事件循环上等待，多台设备可以在同一个循环里
+    并发执行；缩放和编码放到单线程池，与等待界面稳定时的抓帧重叠。
+    action_cache、recorder 的含义同 run_steps。
+
+    observation 目前只支持 screenshot：AsyncAndroidDevice 没有 UI 树抓取，
+    传入 hybrid / elements 会直接报错，而不是悄悄退化成纯截图。
+    """
+    if observation not in OBSERVATIONS:
+        raise ValueError(f"Unknown observation mode: {observation}")
+    if observation != "screenshot":
+        raise ValueError(f"arun_steps does not support observation={observation!r}; "
+                         "use run_steps with AndroidDevice")
+    loop = asyncio.get_running_loop()
+    encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+
+    def _prepare(frame):
+        return minicpm.encode_image(_resize_pillow(frame, max_side))
+
+    is_finish = False
+    step_no = 0
+    try:
+        frame = await device.screenshot()
+        pending = loop.run_in_executor(encoder, _prepare, frame)
+        while not is_finish and (max_steps is None or step_no < max_steps):
+            t0 = time.perf_counter()
+            observed = frame
+            key = hit = None
+            early: dict = {}
+
+            async def _dispatch_early(action):
+                early["t2"] = time.perf_counter()
+                with tracing.span("dispatch", serial=device.serial, early=True):
+                    early["finish"] = await device.step(action)
+                early["t3"] = time.perf_counter()
+
+            if action_cache is not None:
+                sig = _frame_signature(frame)
+                key = action_cache.key(query, sig, None)
+                hit = action_cache.lookup(key)
+            if hit is not None:
+                action = dict(hit.action)
+                t1 = time.perf_counter()
+                print(f"cache hit: {action}")
+            else:
+                encoded = await pending
+                t1 = time.perf_counter()
+                response = await minicpm.apredict_mm(
+                    query, [encoded], on_action=_dispatch_early if minicpm.stream else None)
+                if not response.ok:
+                    logger.error("[%s] Model call failed after %d attempts: %s",
+                                 device.serial, response.attempts, response.error)
+                    break
+                action = response.action
+                print(action)
+            if "finish" in early:
+                t2, t3, is_finish = early["t2"], early["t3"], early["finish"]
+            else:
+                t2 = time.perf_counter()
+                with tracing.span("dispatch", serial=device.serial):
+                    is_finish = await device.step(action)
+                t3 = time.perf_counter()
+            step_no += 1
+            if not is_finish:
+                candidates: list = []
+
+                def _on_frame(frame):
+                    # 只有最后一帧会被使用，尚未开始的旧编码任务直接取消
+                    if candidates:
+                        candidates[-1].cancel()
+                    candidates.append(loop.run_in_executor(encoder, _prepare, frame))
+
+                frame = await device.wait_for_settle(on_frame=_on_frame)
+                pending = candidates[-1]
+                for stale in candidates[:-1]:
+                    stale.cancel()
+                if key is not None:
+                    changed = _signature_distance(sig, _frame_signature(frame)) > 1.5
+                    action_cache.record(key, action, changed, hit)
+            timings = {
+                "encode_wait_ms": (t1 - t0) * 1000, "infer_ms": (t2 - t1) * 1000,
+                "dispatch_ms": (t3 - t2) * 1000,
+                "settle_ms": (time.perf_counter() - t3) * 1000 if not is_finish else 0.0,
+            }
+            logger.info(
+                "[%s] Step %d: encode-wait %.0fms, infer %.0fms, dispatch %.0fms, settle %.0fms",
+                device.serial, step_no, *timings.values(),
+            )
+            if recorder is not None:
+                await asyncio.to_thread(recorder.write_step, observed, action, timings,
+                                        (device.width, device.height))
+    finally:
+        encoder.shutdown(wait=False, cancel_futures=True)
+    return is_finish, step_no
+
+
+def replay_steps(device: AndroidDevice, trajectory: Trajectory,
+                 minicpm: Optional[MiniCPMWrapper] = None, threshold: float = 4.0,
+                 max_model_steps: int = 20) -> tuple[bool, int, int]:
+    """按录制的轨迹重放动作，返回 (是否完成, 重放步数, 模型步数)。
+
+    每一步执行前先把当前画面与录制时的画面比较（36×64 灰度签名），一致才
+    直接执行录制的动作；不一致时先在后续步骤里找能对上的检查点并跳过去，
+    都对不上才交给模型走一步，然后再尝试对齐。没有 minicpm 时遇到偏离即停止。
+    """
+    steps = trajectory.steps
+    i = replayed = model_steps = 0
+    is_finish = False
+    frame = device.screenshot()
+    while not is_finish and i < len(steps):
+        sig = _frame_signature(frame)
+        if _signature_distance(sig, steps[i].signature()) <= threshold:
+            with tracing.span("dispatch", serial=device.serial):
+                is_finish = device.step(steps[i].action)
+            replayed += 1
+            i += 1
+            if not is_finish:
+                frame = device.wait_for_settle()
+            continue
+        resync = next((k for k in range(i + 1, len(steps))
+                       if _signature_distance(sig, steps[k].signature()) <= threshold), None)
+        if resync is not None:
+            logger.info("Replay: skipping steps %d-%d, screen matches step %d", i, resync - 1, resync)
+            i = resync
+            continue
+        if minicpm is None or model_steps >= max_model_steps:
+            logger.warning("Replay diverged at step %d", i)
+            return False, replayed, model_steps
+        logger.info("Replay diverged at step %d, asking the model", i)
+        is_finish, n, failed = _run_steps(device, minicpm, trajectory.query, max_steps=1)
+        model_steps += n
+        if failed:
+            # 模型不可用：不再反复请求同一个偏离的步骤
+            logger.warning("Replay stopped at step %d: model call failed", i)
+            return False, replayed, model_steps
+        if not is_finish:
+            frame = device.screenshot()
+    if not is_finish and minicpm is not None and model_steps < max_model_steps:
+        # 轨迹已经放完但任务没结束（录制时被截断），剩下的交给模型
+        is_finish, n, _ = _run_steps(device, minicpm, trajectory.query,
+                                     max_steps=max_model_steps - model_steps)
+        model_steps += n
+    return is_finish, replayed, model_steps
+
+
+def run_task(query, trace_path: Optional[str] = None, cache_path: Optional[str] = None,
+             record_path: Optional[str] = None):
+    """执行任务；开启 tracing（ADB_AGENT_TRACE=1）时可导出本次任务的耗时数据。
+
+    trace_path 以 .csv 结尾时导出 CSV，否则导出 Chrome trace-event JSON。
+    cache_path 指定动作缓存文件，任务结束后写回。
+    record_path 指定轨迹文件，可用 replay_task 重放。
+    """
     device = setup_device()
     minicpm = MiniCPMWrapper(model_name='AgentCPM-GUI', temperature=1, use_history=True, history_size=2)
-    
-    is_finish = False
-    while not is_finish:
-        text_prompt = query
-        screenshot = device.screenshot(1120)
-        response = minicpm.predict_mm(text_prompt, [np.array(screenshot)])
-        action = response[3]
-        print(action)
-        is_finish = device.step(action)
-        time.sleep(2.5)
+    action_cache = ActionCache(cache_path) if cache_path else None
+    recorder = (TrajectoryWriter(record_path, query, device.serial, (device.width, device.height))
+                if record_path else None)
+    tracing.TRACER.reset()
+    try:
+        return run_steps(device, minicpm, query, action_cache=action_cache, recorder=recorder)[0]
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if action_cache is not None:
+            logger.info("Action cache: %d hits, %d misses, %d entries",
+                        action_cache.hits, action_cache.misses, len(action_cache))
+            action_cache.save()
+        if tracing.TRACER.enabled:
+            logger.info("Timing summary (ms):\n%s", tracing.TRACER.summary())
+            if trace_path:
+                if trace_path.endswith(".csv"):
+                    tracing.TRACER.export_csv(trace_path)
+                else:
+                    tracing.TRACER.export_chrome_trace(trace_path)
+
+def replay_task(record_path: str, use_model: bool = True) -> bool:
+    """重放 run_task 录制的轨迹；use_model 为 False 时偏离即停止。"""
+    trajectory = load_trajectory(record_path)
+    device = setup_device()
+    minicpm = (MiniCPMWrapper(model_name='AgentCPM-GUI', temperature=1, use_history=True, history_size=2)
+               if use_model else None)
+    start = time.perf_counter()
+    is_finish, replayed, model_steps = replay_steps(device, trajectory, minicpm)
+    logger.info("Replay of %s: finished=%s, %d replayed, %d model steps, %.1fs",
+                record_path, is_finish, replayed, model_steps, time.perf_counter() - start)
     return is_finish
 
+
 if __name__ == "__main__":
     run_task("去哔哩哔哩看李子柒的最新视频，并且点赞。")
 
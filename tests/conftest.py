@@ -0,0 +1,6 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the fake adb server and client live next to the benchmarks that use them
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
@@ -0,0 +1,113 @@
+"""`ActionCache`: perceptual matching, LRU capacity, eviction and persistence."""
+import PIL.Image as Image
+import PIL.ImageDraw as ImageDraw
+import pytest
+
+from action_cache import ActionCache, screen_hash
+
+TAP = {"POINT": [500, 500]}
+
+
+def _gradient() -> Image.Image:
+    return Image.linear_gradient("L").rotate(90).resize((360, 640)).convert("RGB")
+
+
+def _with_badge(img: Image.Image) -> Image.Image:
+    """`img` with a small white square, a few bits away in the hash."""
+    img = img.copy()
+    ImageDraw.Draw(img).rectangle((100, 100, 140, 140), fill="white")
+    return img
+
+
+def _flat(colour: str) -> Image.Image:
+    return Image.new("RGB", (360, 640), colour)
+
+
+def test_similar_screen_hits():
+    cache = ActionCache()
+    cache.record(cache.key("open mail", _gradient()), TAP, changed=True)
+    badged = _with_badge(_gradient())
+    assert 0 < (screen_hash(badged) ^ screen_hash(_gradient())).bit_count() <= cache.max_distance
+    hit = cache.lookup(cache.key("open mail", badged))
+    assert hit is not None and hit.action == TAP
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_other_task_or_screen_misses():
+    cache = ActionCache()
+    cache.record(cache.key("open mail", _gradient()), TAP, changed=True)
+    assert cache.lookup(cache.key("open maps", _gradient())) is None
+    assert cache.lookup(cache.key("open mail", _gradient().rotate(180))) is None
+    assert cache.misses == 2
+
+
+def test_brightness_separates_flat_screens():
+    # no gradients at all: only the brightness half of the hash differs
+    dark, light = screen_hash(_flat("black")), screen_hash(_flat("white"))
+    assert (dark ^ light).bit_count() == 256
+    cache = ActionCache()
+    cache.record(cache.key("q", _flat("black")), TAP, changed=True)
+    assert cache.lookup(cache.key("q", _flat("white"))) is None
+    assert cache.lookup(cache.key("q", _flat("black"))) is not None
+
+
+def test_least_recently_used_goes_first():
+    cache = ActionCache(capacity=2)
+    frame = _gradient()
+    keys = {task: cache.key(task, frame) for task in "abc"}
+    cache.record(keys["a"], TAP, changed=True)
+    cache.record(keys["b"], TAP, changed=True)
+    assert cache.lookup(keys["a"]) is not None  # a is now the most recent
+    cache.record(keys["c"], TAP, changed=True)
+    assert len(cache) == 2
+    assert cache.lookup(keys["b"]) is None
+    assert cache.lookup(keys["a"]) is not None and cache.lookup(keys["c"]) is not None
+
+
+def test_only_actions_that_changed_the_screen_are_kept():
+    cache = ActionCache()
+    key = cache.key("q", _gradient())
+    cache.record(key, TAP, changed=False)
+    cache.record(key, {"STATUS": "finish"}, changed=True)
+    assert len(cache) == 0
+    cache.record(key, TAP, changed=True)
+    hit = cache.lookup(key)
+    cache.record(key, TAP, changed=False, hit=hit)  # replay had no effect
+    assert len(cache) == 0 and cache.lookup(key) is None
+
+
+def test_min_confirmations():
+    cache = ActionCache(min_confirmations=2)
+    key = cache.key("q", _gradient())
+    cache.record(key, TAP, changed=True)
+    assert cache.lookup(key) is None
+    cache.record(key, TAP, changed=True)
+    assert cache.lookup(key).confirmations == 2
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ActionCache(path)
+    keys = [cache.key(task, _gradient()) for task in ("a", "b")]
+    for key in keys:
+        cache.record(key, TAP, changed=True)
+    cache.record(keys[0], {"POINT": [1, 2]}, changed=True)
+    cache.save()
+
+    loaded = ActionCache(path)
+    assert len(loaded) == 2
+    entry = loaded.lookup(keys[0])
+    assert entry.key == keys[0] and entry.action == {"POINT": [1, 2]}
+    assert entry.confirmations == 2
+    assert loaded.lookup(keys[1]).action == TAP
+
+
+@pytest.mark.parametrize("content", ["{not json", '{"entries": [{"task": "a"}]}', "[]"])
+def test_corrupted_file_starts_empty(tmp_path, content):
+    path = tmp_path / "cache.json"
+    path.write_text(content, encoding="utf-8")
+    cache = ActionCache(str(path))
+    assert len(cache) == 0
+    cache.record(cache.key("q", _gradient()), TAP, changed=True)
+    cache.save()
+    assert len(ActionCache(str(path))) == 1
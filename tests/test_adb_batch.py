@@ -0,0 +1,80 @@
+"""`AndroidDevice.run_batch` and its script framing, through the fake adb binary."""
+import os
+import subprocess
+
+import pytest
+
+from fake_adb import ROOT, use_fake_adb
+
+use_fake_adb()
+from adb_utils import AndroidDevice  # noqa: E402
+
+
+@pytest.fixture
+def device():
+    device = AndroidDevice("fake-0", transport="binary")
+    device.refresh_resolution()
+    yield device
+    device.close()
+
+
+@pytest.fixture
+def scripts(device, monkeypatch):
+    """Shell scripts the device sends, in order."""
+    sent = []
+    adb = device._adb
+
+    def spy(*args, **kwargs):
+        if args[:1] == ("shell",):
+            sent.append(args[1])
+        return adb(*args, **kwargs)
+
+    monkeypatch.setattr(device, "_adb", spy)
+    return sent
+
+
+def test_script_marks_every_group(device):
+    script = device._script([["echo a", "echo b"], ["echo c"]])
+    assert script.startswith("(set -e; ") and script.endswith(")")
+    assert script.count(device._TIME_MARK) == 3
+    assert script.index("echo b") < script.index("echo c")
+
+
+def test_script_timings(device):
+    mark = device._TIME_MARK
+    out = f"{mark} 100.00 5.0\nnoise\n{mark} 100.25 5.0\n{mark} 101.00 5.0\n".encode()
+    assert device._script_timings(out) == pytest.approx([0.25, 0.75])
+    assert device._script_timings(b"") == []
+
+
+def test_run_batch_is_one_round_trip(device, scripts):
+    timings = device.run_batch([{"POINT": [500, 500]}, {"PRESS": "BACK"},
+                                {"KEYS": ["ENTER", "KEYCODE_TAB", 61], "repeat": 2}])
+    assert len(timings) == 3 and all(t >= 0 for t in timings)
+    assert len(scripts) == 1
+    assert "input tap 540 1200" in scripts[0]
+    assert "input keyevent KEYCODE_BACK" in scripts[0]
+    assert "input keyevent KEYCODE_ENTER KEYCODE_TAB 61 KEYCODE_ENTER KEYCODE_TAB 61" in scripts[0]
+
+
+def test_failing_group_aborts_the_rest(device):
+    marker = os.path.join(ROOT + "/data/local/tmp", "batch-never")
+    if os.path.exists(marker):
+        os.remove(marker)
+    with pytest.raises(subprocess.CalledProcessError):
+        device._run_script([["true"], ["false"], ["touch /data/local/tmp/batch-never"]])
+    assert not os.path.exists(marker)
+
+
+@pytest.mark.parametrize("key", ["KEYCODE_DEL; reboot", "keycode_del", "$(id)", "", -1, True, 1.5])
+def test_unknown_keys_are_rejected(device, scripts, key):
+    with pytest.raises(ValueError, match="Unknown KEYS value"):
+        device.run_batch([{"POINT": [500, 500]}, {"KEYS": [key]}])
+    assert scripts == []
+
+
+def test_clear_text(device, scripts):
+    device.clear_text(count=3)
+    assert len(scripts) == 1
+    assert "input keyevent KEYCODE_MOVE_END;" in scripts[0]
+    assert "input keyevent KEYCODE_DEL KEYCODE_DEL KEYCODE_DEL;" in scripts[0]
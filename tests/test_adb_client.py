@@ -0,0 +1,76 @@
+"""`adb_client` against the fake smart‑socket server in benchmarks/."""
+import hashlib
+import os
+import subprocess
+import time
+
+import pytest
+
+from adb_client import AdbClient, AdbServerError
+from fake_adb import ROOT
+from fake_adb_server import FakeAdbServer
+
+
+@pytest.fixture(scope="module")
+def server():
+    with FakeAdbServer() as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    client = AdbClient(port=server.port)
+    yield client
+    client.close()
+
+
+def test_host_services(client):
+    assert client.reachable()
+    assert client.serials() == ["fake-0"]
+    assert client.device_states() == {"fake-0": "device"}
+
+
+def test_shell_output_and_exit_status(client):
+    assert client.shell("fake-0", "echo hi") == b"hi\n"
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        client.shell("fake-0", "echo oops; exit 3")
+    assert exc.value.returncode == 3
+    assert exc.value.output == b"oops\n"
+    # the pooled stream survives the failed command
+    assert client.shell("fake-0", "echo again") == b"again\n"
+    assert len(client._idle["fake-0"]) == 1
+
+
+def test_malformed_command_fails_fast(client):
+    t0 = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError):
+        client.shell("fake-0", "echo it's", timeout=3)
+    assert time.monotonic() - t0 < 1
+    assert client.shell("fake-0", "echo 'quoted \"text\"'") == b'quoted "text"\n'
+
+
+def test_device_shell_does_not_raise(client):
+    device = client.device("fake-0")
+    out = device.shell("input text 'it's'", timeout=3)
+    assert isinstance(out, str)
+    assert device.shell("echo fine") == "fine\n"
+
+
+def test_unpooled_and_legacy_shell(client):
+    assert client.shell("fake-0", "echo once", pooled=False) == b"once\n"
+    assert client.shell_once("fake-0", "echo legacy") == b"legacy\n"
+
+
+def test_unknown_serial(client):
+    with pytest.raises(AdbServerError):
+        client.shell("nope", "true")
+
+
+def test_push(client, tmp_path):
+    payload = os.urandom(200_000)  # several sync DATA chunks
+    local = tmp_path / "payload.bin"
+    local.write_bytes(payload)
+    client.push("fake-0", str(local), "/data/local/tmp/test-push.bin", mode=0o600)
+    remote = client.shell("fake-0", "md5sum /data/local/tmp/test-push.bin").split()[0]
+    assert remote == hashlib.md5(payload).hexdigest().encode()
+    assert os.stat(ROOT + "/data/local/tmp/test-push.bin").st_mode & 0o777 == 0o600
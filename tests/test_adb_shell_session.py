@@ -0,0 +1,36 @@
+"""`adb_utils.AdbShellSession` through the fake `adb` binary in benchmarks/."""
+import subprocess
+import time
+
+import pytest
+
+from fake_adb import use_fake_adb
+
+use_fake_adb()
+from adb_utils import AdbShellSession  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    session = AdbShellSession("fake-0")
+    yield session
+    session.close()
+
+
+def test_output_and_exit_status(session):
+    assert session.run("echo hi") == b"hi\n"
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        session.run("echo oops; exit 3")
+    assert (exc.value.returncode, exc.value.output) == (3, b"oops\n")
+    assert session.run("echo again") == b"again\n"
+
+
+def test_malformed_command_does_not_wedge_session(session):
+    session.run("true")
+    proc = session._proc
+    t0 = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError):
+        session.run("input text 'it's'", timeout=3)
+    assert time.monotonic() - t0 < 1
+    assert session.run("echo still here") == b"still here\n"
+    assert session._proc is proc
@@ -0,0 +1,62 @@
+"""`run_agent.arun_steps` and `AsyncAndroidDevice` over the fake adb binary."""
+import asyncio
+
+import pytest
+
+from fake_adb import use_fake_adb
+
+use_fake_adb()
+from action_cache import ActionCache  # noqa: E402
+from adb_async import AsyncAndroidDevice, asetup_device  # noqa: E402
+from agent_wrapper import MiniCPMWrapper  # noqa: E402
+from run_agent import arun_steps  # noqa: E402
+from stub_server import StubChatServer  # noqa: E402
+from trajectory import TrajectoryWriter, load_trajectory  # noqa: E402
+
+pytest.importorskip("httpx")
+
+ACTIONS = [{"thought": "点击", "POINT": [500, 500]}, {"thought": "完成", "STATUS": "finish"}]
+
+
+async def _run(endpoint: str, **kwargs):
+    device = await asetup_device("fake-0")
+    minicpm = MiniCPMWrapper("test", endpoint=endpoint)
+    try:
+        return await arun_steps(device, minicpm, "q", max_steps=5, **kwargs)
+    finally:
+        await device.close()
+        await minicpm.transport.aclose()
+
+
+def test_arun_steps_records_and_caches(tmp_path):
+    cache = ActionCache()
+    path = str(tmp_path / "run.traj")
+    recorder = TrajectoryWriter(path, "q", "fake-0", (1080, 2400))
+    with StubChatServer(ACTIONS) as server:
+        finished, steps = asyncio.run(_run(server.endpoint, action_cache=cache,
+                                           recorder=recorder))
+    recorder.close()
+    assert (finished, steps) == (True, 2)
+    assert [s.action for s in load_trajectory(path).steps] == ACTIONS
+    assert cache.misses == 2  # consulted before every model step
+
+
+def test_arun_steps_rejects_tree_observations():
+    with pytest.raises(ValueError, match="observation"):
+        asyncio.run(_run("http://127.0.0.1:9/v1/chat/completions", observation="elements"))
+
+
+def test_yadb_locks_survive_a_second_event_loop(tmp_path):
+    jar = tmp_path / "yadb"
+    jar.write_bytes(b"not really a jar")
+
+    async def push_twice():
+        devices = [AsyncAndroidDevice("fake-0", use_shell_session=False) for _ in range(2)]
+        for device in devices:
+            device._yadb_local = str(jar)
+        AsyncAndroidDevice._yadb_pushed.clear()
+        # two concurrent pushes to one serial contend for the same lock
+        await asyncio.gather(*(d._ensure_yadb() for d in devices))
+
+    asyncio.run(push_twice())
+    asyncio.run(push_twice())
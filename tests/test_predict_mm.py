@@ -0,0 +1,106 @@
+"""`MiniCPMWrapper.predict_mm` result contract against the stub chat server."""
+import asyncio
+
+import pytest
+
+from agent_wrapper import ERROR_CALLING_LLM, ChatTransport, MiniCPMWrapper
+from resilience import CircuitBreaker
+from stub_server import StubChatServer
+
+GOOD = {"thought": "点击", "POINT": [500, 500]}
+
+
+@pytest.fixture
+def wrapper_for():
+    wrappers = []
+
+    def make(server, **kwargs):
+        wrapper = MiniCPMWrapper("test", endpoint=server.endpoint, **kwargs)
+        wrappers.append(wrapper)
+        return wrapper
+
+    yield make
+    for wrapper in wrappers:
+        wrapper.transport.close()
+
+
+def test_valid_answer(wrapper_for):
+    with StubChatServer([GOOD]) as server:
+        result = wrapper_for(server).predict_mm("q", [])
+    assert result.ok and result.action == GOOD and result.attempts == 1
+    text, is_safe, raw, action = result
+    assert action == result[3] == GOOD
+
+
+def test_invalid_output_after_reasks_returns_failed_prediction(wrapper_for):
+    with StubChatServer(["not json", "still not", "nope"]) as server:
+        result = wrapper_for(server, max_reask=2).predict_mm("q", [])
+        assert server.requests == 3
+    assert not result.ok
+    assert result.action is None
+    assert result.error.startswith("invalid output: ")
+
+
+def test_invalid_output_async(wrapper_for):
+    pytest.importorskip("httpx")
+    with StubChatServer(["not json"]) as server:
+        result = asyncio.run(wrapper_for(server, max_reask=0).apredict_mm("q", []))
+    assert not result.ok and result.error.startswith("invalid output: ")
+
+
+def test_transient_500_is_retried(wrapper_for):
+    with StubChatServer([GOOD], fail_first=1) as server:
+        result = wrapper_for(server).predict_mm("q", [])
+    assert result.ok and result.attempts == 2
+
+
+def test_exhausted_retries(wrapper_for):
+    with StubChatServer([GOOD], fail_first=10) as server:
+        result = wrapper_for(server, max_retry=2).predict_mm("q", [])
+    assert not result.ok and result.text == ERROR_CALLING_LLM and result.attempts == 2
+
+
+def _tripped(server, budget: float, **kwargs) -> MiniCPMWrapper:
+    """A wrapper whose breaker opens on the first failure and half-opens 0.3 s later."""
+    breaker = CircuitBreaker(server.endpoint, failure_threshold=1, reset_timeout=0.3)
+    wrapper = MiniCPMWrapper("test", transport=ChatTransport(server.endpoint, breaker=breaker),
+                             **kwargs)
+    wrapper.retry_budget = budget
+    return wrapper
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_open_breaker_is_waited_out(use_async):
+    if use_async:
+        pytest.importorskip("httpx")
+    with StubChatServer([GOOD], fail_first=1) as server:
+        wrapper = _tripped(server, budget=5.0)
+        call = wrapper.apredict_mm("q", []) if use_async else None
+        result = asyncio.run(call) if use_async else wrapper.predict_mm("q", [])
+        wrapper.transport.close()
+        assert server.requests == 2
+    assert result.ok and result.attempts == 2
+    assert result.latency_ms >= 300
+
+
+def test_open_breaker_beyond_budget_fails_fast():
+    with StubChatServer([GOOD], fail_first=1) as server:
+        wrapper = _tripped(server, budget=0.1)
+        result = wrapper.predict_mm("q", [])
+        wrapper.transport.close()
+        assert server.requests == 1
+    assert not result.ok and result.attempts == 1
+    assert result.error.startswith("circuit open") and result.latency_ms < 300
+
+
+def test_run_steps_ends_unfinished_on_invalid_output(wrapper_for):
+    from PIL import Image
+
+    from fake_device import FakeAndroidDevice
+    from run_agent import run_steps
+
+    device = FakeAndroidDevice([Image.new("RGB", (1080, 2400), "white")])
+    with StubChatServer(["not json", "still not", "nope"]) as server:
+        finished, steps = run_steps(device, wrapper_for(server), "q", max_steps=3)
+    assert (finished, steps) == (False, 0)
+    assert device.actions == []
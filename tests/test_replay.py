@@ -0,0 +1,63 @@
+"""`run_agent.replay_steps` over a recorded trajectory and a fake device."""
+import socket
+import time
+
+import PIL.Image as Image
+
+from agent_wrapper import MiniCPMWrapper
+from fake_device import FakeAndroidDevice
+from run_agent import replay_steps
+from trajectory import TrajectoryWriter, load_trajectory
+
+BLACK = Image.new("RGB", (360, 640), "black")
+GRAY = Image.new("RGB", (360, 640), "gray")
+WHITE = Image.new("RGB", (360, 640), "white")
+
+
+def _record(path, frames):
+    with TrajectoryWriter(str(path), "q", "fake-0", (360, 640)) as writer:
+        for i, frame in enumerate(frames):
+            writer.write_step(frame, {"POINT": [100 * (i + 1), 500]}, {}, (360, 640))
+    return load_trajectory(str(path))
+
+
+def test_replays_matching_steps(tmp_path):
+    trajectory = _record(tmp_path / "run.traj", [BLACK, GRAY, WHITE])
+    device = FakeAndroidDevice([BLACK, GRAY, WHITE])
+    assert replay_steps(device, trajectory) == (False, 3, 0)
+    assert device.actions == [s.action for s in trajectory.steps]
+
+
+def test_resyncs_to_a_later_matching_step(tmp_path):
+    # the device is already past the first recorded screen
+    trajectory = _record(tmp_path / "run.traj", [BLACK, GRAY, WHITE])
+    device = FakeAndroidDevice([GRAY, WHITE])
+    assert replay_steps(device, trajectory) == (False, 2, 0)
+    assert device.actions == [s.action for s in trajectory.steps[1:]]
+
+
+def test_stops_on_divergence_without_a_model(tmp_path):
+    trajectory = _record(tmp_path / "run.traj", [BLACK, GRAY])
+    device = FakeAndroidDevice([BLACK, WHITE])
+    assert replay_steps(device, trajectory) == (False, 1, 0)
+    assert device.actions == [trajectory.steps[0].action]
+
+
+def _dead_endpoint() -> str:
+    with socket.socket() as s:  # a port nobody listens on
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/v1/chat/completions"
+
+
+def test_diverged_replay_stops_when_model_is_down(tmp_path):
+    trajectory = _record(tmp_path / "run.traj", [BLACK])
+    device = FakeAndroidDevice([WHITE])
+    minicpm = MiniCPMWrapper("test", endpoint=_dead_endpoint(), max_retry=1)
+    t0 = time.perf_counter()
+    try:
+        finished, replayed, model_steps = replay_steps(device, trajectory, minicpm)
+    finally:
+        minicpm.transport.close()
+    assert (finished, replayed, model_steps) == (False, 0, 0)
+    assert device.actions == []
+    assert time.perf_counter() - t0 < 5
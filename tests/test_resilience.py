@@ -0,0 +1,79 @@
+"""Which error `HedgedTransport` surfaces when both endpoints fail."""
+import asyncio
+import time
+
+import pytest
+
+from resilience import CircuitOpenError, HedgedTransport
+
+
+class _Failing:
+    """Transport double whose every call raises `error`; a refusing breaker
+    answers at once, an attempted call only after a short while."""
+
+    def __init__(self, name: str, error: type):
+        self.endpoint = name
+        self.error = error
+
+    def _raise(self, *args):
+        if self.error is not CircuitOpenError:
+            time.sleep(0.02)
+        raise self.error(f"{self.endpoint} failed")
+
+    post = post_stream = _raise
+
+    async def apost(self, *args):
+        self._raise()
+
+    async def apost_stream(self, *args):
+        self._raise()
+
+    def close(self) -> None:
+        pass
+
+
+CASES = [
+    (ConnectionError, CircuitOpenError, ConnectionError),
+    (CircuitOpenError, ConnectionError, ConnectionError),
+    (CircuitOpenError, CircuitOpenError, CircuitOpenError),
+]
+
+
+@pytest.fixture
+def hedged():
+    transports = []
+
+    def make(primary: type, secondary: type) -> HedgedTransport:
+        transport = HedgedTransport(_Failing("primary", primary), _Failing("secondary", secondary),
+                                    initial_delay=0.01)
+        transports.append(transport)
+        return transport
+
+    yield make
+    for transport in transports:
+        transport.close()
+
+
+@pytest.mark.parametrize("primary, secondary, raised", CASES)
+def test_post_prefers_an_attempted_endpoint(hedged, primary, secondary, raised):
+    with pytest.raises(raised) as info:
+        hedged(primary, secondary).post({})
+    assert type(info.value) is raised
+
+
+@pytest.mark.parametrize("primary, secondary, raised", CASES)
+def test_apost_prefers_an_attempted_endpoint(hedged, primary, secondary, raised):
+    with pytest.raises(raised) as info:
+        asyncio.run(hedged(primary, secondary).apost({}))
+    assert type(info.value) is raised
+
+
+@pytest.mark.parametrize("primary, secondary, raised", CASES)
+def test_stream_fallback_prefers_an_attempted_endpoint(hedged, primary, secondary, raised):
+    transport = hedged(primary, secondary)
+    with pytest.raises(raised) as info:
+        transport.post_stream({}, print)
+    assert type(info.value) is raised
+    with pytest.raises(raised) as info:
+        asyncio.run(transport.apost_stream({}, print))
+    assert type(info.value) is raised
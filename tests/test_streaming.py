@@ -0,0 +1,56 @@
+"""Streamed answers: when `ActionStreamParser` dispatches, and what
+`predict_mm` returns afterwards."""
+import pytest
+
+from action_schema import ActionStreamParser
+from agent_wrapper import MiniCPMWrapper, check_action
+from stub_server import StubChatServer
+
+SWIPE = '{"POINT":[1,2],"thought":"a","to":"up"}'
+
+
+def _feed(parser: ActionStreamParser, text: str, step: int = 3):
+    for i in range(0, len(text), step):
+        action = parser.feed(text[i:i + step])
+        if action is not None:
+            return action, i + step
+    return None, len(text)
+
+
+def test_waits_for_the_object_to_close():
+    action, consumed = _feed(ActionStreamParser(check_action), SWIPE)
+    assert action == {"POINT": [1, 2], "thought": "a", "to": "up"}
+    assert consumed >= len(SWIPE)
+
+
+def test_action_first_dispatches_at_the_thought():
+    text = '{"POINT":[1,2],"thought":"a long thought"}'
+    action, consumed = _feed(ActionStreamParser(check_action, action_first=True), text)
+    assert action == {"POINT": [1, 2]}
+    assert consumed < len(text)
+
+
+def _stream(answer: str, action_first: bool):
+    with StubChatServer([answer], token_latency=0.001) as server:
+        wrapper = MiniCPMWrapper("test", endpoint=server.endpoint, stream=True,
+                                 action_first=action_first)
+        dispatched = []
+        result = wrapper.predict_mm("q", [], on_action=dispatched.append)
+        wrapper.transport.close()
+    return result, dispatched
+
+
+@pytest.mark.parametrize("action_first", [False, True])
+def test_prediction_is_the_full_answer(action_first):
+    result, dispatched = _stream('{"POINT":[1,2],"thought":"a long thought"}', action_first)
+    assert result.ok and result.mismatch is None
+    assert result.action == {"POINT": [1, 2], "thought": "a long thought"}
+    assert len(dispatched) == 1 and dispatched[0]["POINT"] == [1, 2]
+
+
+def test_prediction_is_the_dispatched_action_on_mismatch():
+    # action-first dispatches a tap at the thought; the full answer is a swipe
+    result, dispatched = _stream(SWIPE, action_first=True)
+    assert dispatched == [{"POINT": [1, 2]}]
+    assert result.ok and result.action == dispatched[0]
+    assert result.mismatch == {"POINT": [1, 2], "thought": "a", "to": "up"}
@@ -0,0 +1,60 @@
+"""`ADBTRAJ1` trajectory files: writing, loading, damaged files."""
+import os
+
+import PIL.Image as Image
+import pytest
+
+from adb_utils import _frame_signature, _signature_distance
+from trajectory import MAGIC, TrajectoryWriter, load_trajectory
+
+ACTIONS = [{"POINT": [100, 200]}, {"TYPE": "你好"}, {"STATUS": "finish"}]
+
+
+def _frames():
+    return [Image.new("RGB", (1080, 2400), colour) for colour in ("black", "gray", "white")]
+
+
+def _write(path):
+    """Write a trajectory; returns its path and the offset where each record ends."""
+    ends = []
+    with TrajectoryWriter(str(path), "发一封邮件", "fake-0", (1080, 2400)) as writer:
+        ends.append(os.path.getsize(path))
+        for frame, action in zip(_frames(), ACTIONS):
+            writer.write_step(frame, action, {"infer": 123.456, "act": 7.0}, (1080, 2400))
+            ends.append(os.path.getsize(path))
+    return str(path), ends
+
+
+def test_round_trip(tmp_path):
+    path, _ = _write(tmp_path / "run.traj")
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC
+    trajectory = load_trajectory(path)
+    assert trajectory.query == "发一封邮件"
+    assert trajectory.meta["serial"] == "fake-0" and trajectory.meta["resolution"] == [1080, 2400]
+    assert [s.index for s in trajectory.steps] == [0, 1, 2]
+    assert [s.action for s in trajectory.steps] == ACTIONS
+    step = trajectory.steps[0]
+    assert step.timings == {"infer": 123.46, "act": 7.0}
+    assert step.resolution == (1080, 2400)
+    assert max(step.frame().size) == 720  # stored downscaled
+    for step, frame in zip(trajectory.steps, _frames()):
+        assert _signature_distance(step.signature(), _frame_signature(frame)) <= 4.0
+
+
+@pytest.mark.parametrize("into", [2, 6, 12, -1])
+def test_truncated_tail_record_is_ignored(tmp_path, into):
+    # cut inside the last record's length prefix, its JSON header or its frame
+    path, ends = _write(tmp_path / "run.traj")
+    with open(path, "r+b") as f:
+        f.truncate(ends[-1] + into if into < 0 else ends[-2] + into)
+    trajectory = load_trajectory(path)
+    assert [s.action for s in trajectory.steps] == ACTIONS[:2]
+    assert trajectory.steps[-1].frame().size == (324, 720)
+
+
+def test_bad_magic(tmp_path):
+    path = tmp_path / "run.traj"
+    path.write_bytes(b"ADBTRAJ0\n" + b"\0" * 16)
+    with pytest.raises(ValueError, match="not a trajectory file"):
+        load_trajectory(str(path))
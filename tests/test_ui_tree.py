@@ -0,0 +1,109 @@
+"""`ui_tree`: parsing, lookup indexes and the element list sent to the model."""
+import pytest
+
+from ui_tree import format_elements, parse_ui_xml
+
+W, H = 1080, 2400
+
+XML = b"""UI hierchary dumped to: /dev/tty
+<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation="0">
+<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="p"
+      content-desc="" clickable="false" enabled="true" bounds="[0,0][1080,2400]">
+  <node index="0" text="" resource-id="p:id/wifi_row" class="android.widget.LinearLayout"
+        package="p" content-desc="" clickable="true" enabled="true" bounds="[0,200][1080,400]">
+    <node index="0" text="Wi-Fi" resource-id="p:id/title" class="android.widget.TextView"
+          package="p" content-desc="" clickable="false" enabled="true" bounds="[40,250][500,350]"/>
+    <node index="1" text="" resource-id="" class="android.widget.ImageView" package="p"
+          content-desc="Connected" clickable="false" enabled="true" bounds="[900,250][1000,350]"/>
+  </node>
+  <node index="1" text="" resource-id="p:id/toggle" class="android.widget.Switch" package="p"
+        content-desc="Bluetooth" checkable="true" checked="true" clickable="true" enabled="true"
+        bounds="[900,600][1040,700]"/>
+  <node index="2" text="" resource-id="p:id/search" class="android.widget.EditText" package="p"
+        content-desc="" clickable="false" enabled="true" bounds="[0,800][1080,900]"/>
+  <node index="3" text="Advanced" resource-id="" class="android.widget.Button" package="p"
+        content-desc="" clickable="true" enabled="false" bounds="[0,1000][1080,1100]"/>
+  <node index="4" text="Below" resource-id="" class="android.widget.Button" package="p"
+        content-desc="" clickable="true" enabled="true" bounds="[0,2500][1080,2700]"/>
+  <node index="5" text="Back" resource-id="" class="android.widget.ImageButton" package="p"
+        content-desc="" clickable="true" enabled="true" bounds="[-100,0][200,100]"/>
+  <node index="6" text="OK" resource-id="p:id/ok" class="android.widget.Button" package="p"
+        content-desc="" clickable="true" enabled="true" bounds="[0,2200][540,2400]"/>
+  <node index="7" text="OK" resource-id="p:id/ok" class="android.widget.Button" package="p"
+        content-desc="" clickable="true" enabled="true" bounds="[0,2200][540,2400]"/>
+</node></hierarchy>
+"""
+
+
+@pytest.fixture(scope="module")
+def tree():
+    return parse_ui_xml(XML)
+
+
+def test_parse_builds_the_flat_tree(tree):
+    assert len(tree) == 11 and tree.root.cls == "android.widget.FrameLayout"
+    row = tree.find(resource_id="p:id/wifi_row")[0]
+    assert row.parent == 0 and row.depth == 1
+    assert [tree.nodes[i].text for i in row.children] == ["Wi-Fi", ""]
+    assert tree.nodes[row.children[0]].depth == 2
+    assert tree.find(text="Back")[0].bounds == (-100, 0, 200, 100)
+
+
+def test_parse_rejects_output_without_xml():
+    with pytest.raises(ValueError):
+        parse_ui_xml(b"ERROR: could not get idle state.")
+
+
+def test_indexes(tree):
+    assert [n.index for n in tree.find(text="OK")] == [9, 10]
+    assert [n.text for n in tree.find(resource_id="p:id/title")] == ["Wi-Fi"]
+    assert [n.resource_id for n in tree.find(content_desc="Bluetooth")] == ["p:id/toggle"]
+    assert len(tree.find(cls="android.widget.Button")) == 4
+    assert tree.find(text="Wi-Fi", clickable=True) == []
+    assert tree.find(text="Advanced", clickable=True)[0].enabled is False
+    assert {n.index for n in tree.find(clickable=False)} == {0, 2, 3, 5}
+    assert tree.find(text="OK", resource_id="p:id/nope") == []
+    assert len(tree.find()) == len(tree)
+
+
+def test_nodes_at_matches_a_full_scan(tree):
+    # the grid covers non-negative coordinates, the only ones a tap can have
+    for x in range(0, W + 200, 37):
+        for y in range(0, H + 400, 53):
+            expected = {n.index for n in tree if n.contains(x, y)}
+            assert {n.index for n in tree.nodes_at(x, y)} == expected, (x, y)
+
+
+def test_nodes_at_is_deepest_first(tree):
+    assert [n.text or n.resource_id for n in tree.nodes_at(216, 300)] == \
+        ["Wi-Fi", "p:id/wifi_row", ""]
+    assert tree.element_at(216, 300).resource_id == "p:id/wifi_row"
+    assert tree.element_at(216, 300, clickable_only=False).text == "Wi-Fi"
+    assert tree.element_at(540, 850) is None  # the EditText is not clickable
+    assert tree.element_at_normalized([200, 125], W, H).resource_id == "p:id/wifi_row"
+
+
+def test_interactive_elements_prune(tree):
+    elements = tree.interactive_elements(W, H)
+    labels = [e["label"] for e in elements]
+    # disabled "Advanced", off-screen "Below" and the second "OK" are dropped
+    assert labels == ["Wi-Fi Connected", "Bluetooth", "", "Back", "OK"]
+    assert [e["flags"] for e in elements] == [["click"], ["click", "checked"], ["edit"],
+                                              ["click"], ["click"]]
+    assert tree.interactive_elements(W, H, max_elements=2) == elements[:2]
+
+
+def test_interactive_elements_boxes_are_0_to_1000(tree):
+    by_label = {e["label"]: e for e in tree.interactive_elements(W, H)}
+    ok = by_label["OK"]
+    assert ok["box"] == [0, 916, 500, 1000] and ok["center"] == [250, 958]
+    assert ok["type"] == "Button" and ok["rid"] == "ok"
+    assert by_label["Back"]["box"] == [0, 0, 185, 41]  # clipped to the screen
+    for e in by_label.values():
+        assert all(0 <= v <= 1000 for v in e["box"] + e["center"])
+
+
+def test_format_elements(tree):
+    lines = format_elements(tree.interactive_elements(W, H)).splitlines()
+    assert lines[0] == '1 LinearLayout "Wi-Fi Connected" #wifi_row [0,83,1000,166] @[500,124] click'
+    assert lines[-1] == '9 Button "OK" #ok [0,916,500,1000] @[250,958] click'
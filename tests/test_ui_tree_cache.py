@@ -0,0 +1,84 @@
+"""`adb_utils.UITreeCache` reuse and invalidation rules."""
+from PIL import Image, ImageDraw
+
+from adb_utils import UITreeCache
+from ui_tree import parse_ui_xml
+
+XML = b"""<?xml version='1.0' encoding='UTF-8'?><hierarchy rotation="0">
+<node index="0" text="" class="android.widget.FrameLayout" package="p" clickable="false"
+      enabled="true" bounds="[0,0][1000,2000]">
+  <node index="0" text="Wi-Fi" class="android.widget.Switch" package="p" checkable="true"
+        checked="false" clickable="true" enabled="true" bounds="[800,100][1000,200]"/>
+  <node index="1" text="" class="android.widget.EditText" package="p" clickable="true"
+        enabled="true" bounds="[0,300][1000,400]"/>
+  <node index="2" text="OK" class="android.widget.Button" package="p" clickable="true"
+        enabled="true" bounds="[0,1800][1000,2000]"/>
+</node></hierarchy>"""
+
+
+class _Device:
+    width, height = 1000, 2000
+
+    def __init__(self):
+        self.dumps = 0
+
+    def current_activity(self) -> str:
+        return "p/.Main"
+
+    def ui_tree(self):
+        self.dumps += 1
+        return parse_ui_xml(XML)
+
+
+def _frame(mark: bool = False) -> Image.Image:
+    img = Image.new("RGB", (1000, 2000), "white")
+    if mark:  # a few typed characters
+        ImageDraw.Draw(img).rectangle([20, 330, 60, 370], fill="black")
+    return img
+
+
+def test_same_frame_reuses_tree():
+    device = _Device()
+    cache = UITreeCache(device)
+    tree = cache.get(_frame())
+    assert cache.get(_frame()) is tree
+    assert (device.dumps, cache.hits, cache.last_hit) == (1, 1, True)
+
+
+def test_small_local_change_is_a_miss():
+    device = _Device()
+    cache = UITreeCache(device)
+    cache.get(_frame())
+    cache.get(_frame(mark=True))
+    assert device.dumps == 2
+
+
+def test_type_and_checkable_tap_force_a_dump():
+    device = _Device()
+    cache = UITreeCache(device)
+    cache.get(_frame())
+    cache.note_action({"TYPE": "a"})
+    cache.get(_frame())
+    assert device.dumps == 2
+    cache.note_action({"POINT": [900, 75]})  # the switch
+    cache.get(_frame())
+    assert device.dumps == 3
+    cache.note_action({"POINT": [500, 950]})  # the button
+    cache.get(_frame())
+    assert device.dumps == 3
+
+
+def test_entries_expire():
+    device = _Device()
+    cache = UITreeCache(device, max_age=0.0)
+    cache.get(_frame())
+    cache.get(_frame())
+    assert device.dumps == 2
+
+
+def test_invalidate_resets_state():
+    cache = UITreeCache(_Device())
+    cache.get(_frame())
+    cache.get(_frame())
+    cache.invalidate()
+    assert (cache.current, cache.last_diff, cache.last_hit) == (None, None, False)
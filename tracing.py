@@ -0,0 +1,178 @@
+"""Lightweight timing spans for the agent loop.
+
+    from tracing import span
+    with span("http_post", endpoint=url):
+        ...
+
+Tracing is off unless `ADB_AGENT_TRACE=1` is set or `enable()` is called;
+while off, `span()` returns a shared no‑op context manager, so the
+instrumentation can stay in hot paths.  While on, every span feeds a
+per‑name latency histogram and a bounded event buffer that can be exported
+as Chrome trace‑event JSON (chrome://tracing, Perfetto) or CSV.
+"""
+import bisect
+import collections
+import csv
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+# histogram bucket upper bounds, milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+              1000, 2500, 5000, 10000, float("inf"))
+
+
+class Histogram:
+    """Fixed‑bucket latency histogram with exact count / total / min / max."""
+
+    __slots__ = ("count", "total_ms", "min_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, ms: float) -> None:
+        self.count += 1
+        self.total_ms += ms
+        self.min_ms = min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q‑th percentile (0‑100)."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "min_ms": self.min_ms if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "attrs", "start_ns")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, self.start_ns, time.perf_counter_ns(), self.attrs)
+        return False
+
+
+class Tracer:
+    """Collects spans into histograms and a bounded event buffer."""
+
+    def __init__(self, enabled: bool = False, max_events: int = 100_000):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._events: collections.deque = collections.deque(maxlen=max_events)
+
+    def span(self, name: str, **attrs: Any):
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name, attrs)
+
+    def _record(self, name: str, start_ns: int, end_ns: int, attrs: Dict[str, Any]) -> None:
+        ms = (end_ns - start_ns) / 1e6
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.add(ms)
+            self._events.append((name, start_ns, end_ns, threading.get_ident(), attrs))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._events.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: h.as_dict() for name, h in sorted(self._histograms.items())}
+
+    def summary(self) -> str:
+        rows = [f"{'span':<24}{'count':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}"]
+        for name, s in self.stats().items():
+            rows.append(f"{name:<24}{s['count']:>7}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+                        f"{s['p95_ms']:>10.2f}{s['max_ms']:>10.2f}")
+        return "\n".join(rows)
+
+    def _snapshot(self) -> List[tuple]:
+        with self._lock:
+            return list(self._events)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write complete ("X") trace events, loadable in chrome://tracing."""
+        pid = os.getpid()
+        events = [
+            {"name": name, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+             "pid": pid, "tid": tid, "args": {k: str(v) for k, v in attrs.items()}}
+            for name, start, end, tid, attrs in self._snapshot()
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def export_csv(self, path: str) -> None:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "start_us", "duration_ms", "thread", "attrs"])
+            for name, start, end, tid, attrs in self._snapshot():
+                writer.writerow([name, start // 1000, f"{(end - start) / 1e6:.3f}", tid,
+                                 json.dumps(attrs, ensure_ascii=False, default=str)])
+
+
+TRACER = Tracer(enabled=os.environ.get("ADB_AGENT_TRACE", "") not in ("", "0"))
+
+
+def span(name: str, **attrs: Any):
+    """Time a block under `name` on the global tracer (no‑op while disabled)."""
+    if not TRACER.enabled:
+        return _NOOP
+    return _Span(TRACER, name, attrs)
+
+
+def enable() -> None:
+    TRACER.enabled = True
+
+
+def disable() -> None:
+    TRACER.enabled = False
@@ -0,0 +1,128 @@
+"""Compact append‑only trajectory files for recording and replaying runs.
+
+Layout: the magic line ``ADBTRAJ1\\n`` followed by records of
+
+    >II header (json length, frame length) | JSON header | frame bytes
+
+The first record is the run's metadata (no frame); every later record is
+one step: the screen the action was decided on (JPEG, downscaled), the
+action, per‑phase timings and the device resolution.  Records are flushed
+as they are written, so a crashed run leaves a readable prefix and a
+truncated tail record is ignored on load.
+"""
+import io
+import json
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import PIL.Image as Image
+
+from adb_utils import _frame_signature, _resize_pillow
+
+MAGIC = b"ADBTRAJ1\n"
+_RECORD = struct.Struct(">II")
+
+
+@dataclass
+class TrajectoryStep:
+    index: int
+    action: Any
+    timings: Dict[str, float]
+    resolution: Tuple[int, int]
+    frame_bytes: bytes = b""
+    _signature: Optional[Image.Image] = field(default=None, repr=False)
+
+    def frame(self) -> Image.Image:
+        return Image.open(io.BytesIO(self.frame_bytes))
+
+    def signature(self) -> Image.Image:
+        """36×64 grayscale signature of the recorded screen (cached)."""
+        if self._signature is None:
+            self._signature = _frame_signature(self.frame().convert("RGB"))
+        return self._signature
+
+
+@dataclass
+class Trajectory:
+    meta: Dict[str, Any]
+    steps: List[TrajectoryStep]
+
+    @property
+    def query(self) -> str:
+        return self.meta.get("query", "")
+
+
+class TrajectoryWriter:
+    """Appends one record per step to `path`.
+
+    Args:
+      frame_side: longest side of the stored frames.
+      quality: JPEG quality of the stored frames.
+    """
+
+    def __init__(self, path: str, query: str, serial: Optional[str] = None,
+                 resolution: Optional[Tuple[int, int]] = None,
+                 frame_side: int = 720, quality: int = 70):
+        self.path = path
+        self.frame_side = frame_side
+        self.quality = quality
+        self.steps = 0
+        self._f: BinaryIO = open(path, "wb")
+        self._f.write(MAGIC)
+        self._write({"type": "meta", "query": query, "serial": serial,
+                     "resolution": list(resolution) if resolution else None,
+                     "created": time.time()}, b"")
+
+    def _write(self, header: Dict[str, Any], frame: bytes) -> None:
+        data = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode()
+        self._f.write(_RECORD.pack(len(data), len(frame)) + data + frame)
+        self._f.flush()
+
+    def write_step(self, frame: Image.Image, action: Any, timings: Dict[str, float],
+                   resolution: Tuple[int, int]) -> None:
+        buf = io.BytesIO()
+        _resize_pillow(frame, self.frame_side).save(buf, format="JPEG", quality=self.quality)
+        self._write({"type": "step", "index": self.steps, "action": action,
+                     "timings": {k: round(v, 2) for k, v in timings.items()},
+                     "resolution": list(resolution)}, buf.getvalue())
+        self.steps += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def iter_records(path: str) -> Iterator[Tuple[Dict[str, Any], bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            json_len, frame_len = _RECORD.unpack(head)
+            data = f.read(json_len)
+            frame = f.read(frame_len)
+            if len(data) < json_len or len(frame) < frame_len:
+                return
+            yield json.loads(data), frame
+
+
+def load_trajectory(path: str) -> Trajectory:
+    meta: Dict[str, Any] = {}
+    steps: List[TrajectoryStep] = []
+    for header, frame in iter_records(path):
+        if header.get("type") == "meta":
+            meta = header
+        else:
+            steps.append(TrajectoryStep(header["index"], header["action"], header["timings"],
+                                        tuple(header["resolution"]), frame))
+    return Trajectory(meta, steps)
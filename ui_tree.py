@@ -0,0 +1,323 @@
+"""Parsed, indexed view of the Android accessibility hierarchy.
+
+`parse_ui_xml` turns a `uiautomator dump` into a flat array of `UINode`s
+(parent/children by index) and builds lookup tables once, so repeated
+queries — "what is under this tap?", "find the node with this
+resource‑id" — are dictionary / grid lookups instead of tree walks or
+fresh dumps.
+"""
+import io
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_BOUNDS_RE = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+class UINode:
+    """One view in the hierarchy; `parent` / `children` are node indexes."""
+
+    __slots__ = (
+        "index", "parent", "depth", "children", "cls", "package", "text",
+        "resource_id", "content_desc", "bounds", "clickable", "long_clickable",
+        "scrollable", "focusable", "enabled", "checkable", "checked", "selected",
+        "password",
+    )
+
+    def __init__(self, index: int, parent: int, depth: int, attrs: Dict[str, str]):
+        self.index = index
+        self.parent = parent
+        self.depth = depth
+        self.children: List[int] = []
+        self.cls = attrs.get("class", "")
+        self.package = attrs.get("package", "")
+        self.text = attrs.get("text", "")
+        self.resource_id = attrs.get("resource-id", "")
+        self.content_desc = attrs.get("content-desc", "")
+        m = _BOUNDS_RE.match(attrs.get("bounds", ""))
+        self.bounds: Tuple[int, int, int, int] = (
+            tuple(map(int, m.groups())) if m else (0, 0, 0, 0)
+        )
+        self.clickable = attrs.get("clickable") == "true"
+        self.long_clickable = attrs.get("long-clickable") == "true"
+        self.scrollable = attrs.get("scrollable") == "true"
+        self.focusable = attrs.get("focusable") == "true"
+        self.enabled = attrs.get("enabled") == "true"
+        self.checkable = attrs.get("checkable") == "true"
+        self.checked = attrs.get("checked") == "true"
+        self.selected = attrs.get("selected") == "true"
+        self.password = attrs.get("password") == "true"
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        x1, y1, x2, y2 = self.bounds
+        return (x1 + x2) // 2, (y1 + y2) // 2
+
+    @property
+    def area(self) -> int:
+        x1, y1, x2, y2 = self.bounds
+        return max(x2 - x1, 0) * max(y2 - y1, 0)
+
+    def contains(self, x: int, y: int) -> bool:
+        x1, y1, x2, y2 = self.bounds
+        return x1 <= x < x2 and y1 <= y < y2
+
+    @property
+    def interactive(self) -> bool:
+        return self.enabled and (self.clickable or self.long_clickable or
+                                 self.scrollable or self.checkable)
+
+    def __repr__(self) -> str:
+        label = self.text or self.content_desc or self.resource_id
+        return f"<UINode #{self.index} {self.cls.rsplit('.', 1)[-1]} {label!r} {self.bounds}>"
+
+
+class UITree:
+    """Flat node array plus indexes by id / text / desc / class / flags / grid."""
+
+    GRID_CELL = 128  # px
+
+    def __init__(self, nodes: List[UINode]):
+        self.nodes = nodes
+        self.by_resource_id: Dict[str, List[int]] = {}
+        self.by_text: Dict[str, List[int]] = {}
+        self.by_desc: Dict[str, List[int]] = {}
+        self.by_class: Dict[str, List[int]] = {}
+        self.clickable: List[int] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        cell = self.GRID_CELL
+        for node in nodes:
+            i = node.index
+            if node.resource_id:
+                self.by_resource_id.setdefault(node.resource_id, []).append(i)
+            if node.text:
+                self.by_text.setdefault(node.text, []).append(i)
+            if node.content_desc:
+                self.by_desc.setdefault(node.content_desc, []).append(i)
+            self.by_class.setdefault(node.cls, []).append(i)
+            if node.clickable:
+                self.clickable.append(i)
+            x1, y1, x2, y2 = node.bounds
+            if x2 <= x1 or y2 <= y1:
+                continue
+            for gx in range(max(x1, 0) // cell, (x2 - 1) // cell + 1):
+                for gy in range(max(y1, 0) // cell, (y2 - 1) // cell + 1):
+                    self._grid.setdefault((gx, gy), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __iter__(self) -> Iterator[UINode]:
+        return iter(self.nodes)
+
+    @property
+    def root(self) -> Optional[UINode]:
+        return self.nodes[0] if self.nodes else None
+
+    def find(
+        self,
+        resource_id: Optional[str] = None,
+        text: Optional[str] = None,
+        content_desc: Optional[str] = None,
+        cls: Optional[str] = None,
+        clickable: Optional[bool] = None,
+    ) -> List[UINode]:
+        """Nodes matching every given criterion (exact match), in tree order."""
+        candidates: Optional[set] = None
+        for index, key in ((self.by_resource_id, resource_id), (self.by_text, text),
+                           (self.by_desc, content_desc), (self.by_class, cls)):
+            if key is None:
+                continue
+            hits = set(index.get(key, ()))
+            candidates = hits if candidates is None else candidates & hits
+        if clickable is not None:
+            flagged = set(self.clickable)
+            if candidates is None:
+                candidates = flagged if clickable else set(range(len(self.nodes))) - flagged
+            else:
+                candidates = candidates & flagged if clickable else candidates - flagged
+        if candidates is None:
+            return list(self.nodes)
+        return [self.nodes[i] for i in sorted(candidates)]
+
+    def nodes_at(self, x: int, y: int) -> List[UINode]:
+        """All nodes whose bounds contain (x, y), deepest first."""
+        cell = self.GRID_CELL
+        hits = [self.nodes[i] for i in self._grid.get((x // cell, y // cell), ())
+                if self.nodes[i].contains(x, y)]
+        hits.sort(key=lambda n: (-n.depth, n.area))
+        return hits
+
+    def element_at(self, x: int, y: int, clickable_only: bool = True) -> Optional[UINode]:
+        """Deepest node at (x, y); with `clickable_only`, the deepest clickable one."""
+        for node in self.nodes_at(x, y):
+            if not clickable_only or node.clickable:
+                return node
+        return None
+
+    def element_at_normalized(self, point: List[int], width: int, height: int,
+                              clickable_only: bool = True) -> Optional[UINode]:
+        """`element_at` for a model POINT in 0‑1000 screen coordinates."""
+        x = int(point[0] / 1000 * width)
+        y = int(point[1] / 1000 * height)
+        return self.element_at(x, y, clickable_only)
+
+    def interactive_elements(self, width: int, height: int,
+                             max_elements: int = 120) -> List[Dict[str, object]]:
+        """Pruned list of on‑screen interactive elements for the model.
+
+        Keeps enabled nodes that can be tapped, scrolled, checked or edited;
+        containers without a label borrow the text of their descendants.
+        Boxes are normalised to the 0‑1000 grid the action schema uses, and
+        exact duplicates (same box and label) are dropped.
+        """
+        elements: List[Dict[str, object]] = []
+        seen = set()
+        for node in self.nodes:
+            editable = node.cls.endswith("EditText")
+            if not node.enabled or not (node.interactive or editable):
+                continue
+            x1, y1, x2, y2 = node.bounds
+            x1, y1 = max(x1, 0), max(y1, 0)
+            x2, y2 = min(x2, width), min(y2, height)
+            if x2 <= x1 or y2 <= y1:
+                continue  # off screen or zero‑sized
+            box = [x1 * 1000 // width, y1 * 1000 // height,
+                   x2 * 1000 // width, y2 * 1000 // height]
+            label = node.text or node.content_desc or self._descendant_label(node)
+            key = (tuple(box), label)
+            if key in seen:
+                continue
+            seen.add(key)
+            flags = [name for name, on in (
+                ("click", node.clickable), ("long", node.long_clickable),
+                ("scroll", node.scrollable), ("edit", editable),
+                ("checked" if node.checked else "check", node.checkable),
+            ) if on]
+            elements.append({
+                "id": node.index,
+                "type": node.cls.rsplit(".", 1)[-1],
+                "label": label,
+                "rid": node.resource_id.rsplit("/", 1)[-1],
+                "box": box,
+                "center": [(box[0] + box[2]) // 2, (box[1] + box[3]) // 2],
+                "flags": flags,
+            })
+            if len(elements) >= max_elements:
+                break
+        return elements
+
+    def _descendant_label(self, node: UINode, limit: int = 3) -> str:
+        """First few texts / descriptions below `node`, joined."""
+        labels: List[str] = []
+        stack = list(reversed(node.children))
+        while stack and len(labels) < limit:
+            child = self.nodes[stack.pop()]
+            label = child.text or child.content_desc
+            if label:
+                labels.append(label)
+            stack.extend(reversed(child.children))
+        return " ".join(labels)
+
+
+def format_elements(elements: List[Dict[str, object]], max_label: int = 40) -> str:
+    """One compact line per element: `id type "label" #rid box center flags`."""
+    lines = []
+    for e in elements:
+        label = str(e["label"]).replace("\n", " ")
+        if len(label) > max_label:
+            label = label[:max_label - 1] + "…"
+        rid = f" #{e['rid']}" if e["rid"] else ""
+        x1, y1, x2, y2 = e["box"]
+        cx, cy = e["center"]
+        lines.append(f"{e['id']} {e['type']} \"{label}\"{rid} [{x1},{y1},{x2},{y2}] "
+                     f"@[{cx},{cy}] {','.join(e['flags'])}")
+    return "\n".join(lines)
+
+
+def parse_ui_xml(data: bytes) -> UITree:
+    """Stream‑parse `uiautomator dump` XML into a `UITree`.
+
+    Anything before the `<?xml`/`<hierarchy` start (e.g. status lines) is
+    ignored.
+    """
+    start = data.find(b"<")
+    end = data.rfind(b">")
+    if start < 0 or end < start:
+        raise ValueError("No UI hierarchy XML in dump output")
+    nodes: List[UINode] = []
+    stack: List[int] = []
+    for event, elem in ET.iterparse(io.BytesIO(data[start:end + 1]), events=("start", "end")):
+        if elem.tag != "node":
+            continue
+        if event == "start":
+            parent = stack[-1] if stack else -1
+            node = UINode(len(nodes), parent, len(stack), elem.attrib)
+            if parent >= 0:
+                nodes[parent].children.append(node.index)
+            nodes.append(node)
+            stack.append(node.index)
+        else:
+            stack.pop()
+            elem.clear()
+    return UITree(nodes)
+
+
+# ---------------------------------------------------------------------------
+# Diffing
+# ---------------------------------------------------------------------------
+
+NodePath = Tuple[Tuple[str, str, int], ...]
+
+
+def node_paths(tree: UITree) -> Dict[NodePath, UINode]:
+    """Map each node to an XPath‑like key from the root.
+
+    Each step is (class, resource‑id, n‑th such sibling), so inserting an
+    unrelated sibling does not shift the keys of the others.
+    """
+    paths: Dict[NodePath, UINode] = {}
+    keys: List[NodePath] = [()] * len(tree.nodes)
+    seen: Dict[Tuple[int, str, str], int] = {}
+    for node in tree.nodes:  # parents always precede children
+        slot = (node.parent, node.cls, node.resource_id)
+        nth = seen.get(slot, 0)
+        seen[slot] = nth + 1
+        base = keys[node.parent] if node.parent >= 0 else ()
+        keys[node.index] = base + ((node.cls, node.resource_id, nth),)
+        paths[keys[node.index]] = node
+    return paths
+
+
+def _node_state(node: UINode) -> tuple:
+    return (node.resource_id, node.text, node.content_desc, node.bounds,
+            node.enabled, node.checked, node.selected)
+
+
+class UITreeDiff:
+    """Structural difference between two hierarchies, matched by node path."""
+
+    __slots__ = ("added", "removed", "changed")
+
+    def __init__(self, added: List[UINode], removed: List[UINode],
+                 changed: List[Tuple[UINode, UINode]]):
+        self.added = added        # nodes of the new tree
+        self.removed = removed    # nodes of the old tree
+        self.changed = changed    # (old, new) pairs
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    def __repr__(self) -> str:
+        return (f"<UITreeDiff +{len(self.added)} -{len(self.removed)} "
+                f"~{len(self.changed)}>")
+
+
+def diff_trees(old: UITree, new: UITree) -> UITreeDiff:
+    old_paths, new_paths = node_paths(old), node_paths(new)
+    added = [n for p, n in new_paths.items() if p not in old_paths]
+    removed = [n for p, n in old_paths.items() if p not in new_paths]
+    changed = [(old_paths[p], n) for p, n in new_paths.items()
+               if p in old_paths and _node_state(old_paths[p]) != _node_state(n)]
+    return UITreeDiff(added, removed, changed)